@@ -1,6 +1,7 @@
 # Importing the libraries
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.preprocessing import OrdinalEncoder
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.preprocessing import StandardScaler
@@ -46,35 +47,30 @@ class carsfactors:
         body_type_df = trimmed_df[['body_type']].copy()
         body_type_df[['body_type']] = self.oe.fit_transform(body_type_df[['body_type']])
 
-        # Apply one-hot encoder to each column with categorical data starting with transmission
+        # Apply one-hot encoder to each column with categorical data starting with transmission. The encoded columns
+        # are kept sparse (one value per row) rather than densified with toarray()
         self.ohc_transmission = OneHotEncoder()
-        ohe_transmission = self.ohc_transmission.fit_transform(trimmed_df['transmission'].values.reshape(-1,1)).toarray()
-        df_transmission = pd.DataFrame(ohe_transmission, columns = self.ohc_transmission.categories_[0])
+        ohe_transmission = self.ohc_transmission.fit_transform(trimmed_df['transmission'].values.reshape(-1,1))
 
         # Apply one-hot encoder to Manufacturer
         self.ohc_manufacturer = OneHotEncoder()
-        ohe_manufacturer = self.ohc_manufacturer.fit_transform(trimmed_df['manufacturer_name'].values.reshape(-1,1)).toarray()
-        df_manufacturer = pd.DataFrame(ohe_manufacturer, columns = self.ohc_manufacturer.categories_[0])
+        ohe_manufacturer = self.ohc_manufacturer.fit_transform(trimmed_df['manufacturer_name'].values.reshape(-1,1))
 
         # Apply one-hot encoder to color
         self.ohc_color = OneHotEncoder()
-        ohe_color = self.ohc_color.fit_transform(trimmed_df['color'].values.reshape(-1,1)).toarray()
-        df_color = pd.DataFrame(ohe_color, columns = self.ohc_color.categories_[0])
+        ohe_color = self.ohc_color.fit_transform(trimmed_df['color'].values.reshape(-1,1))
 
         # Apply one-hot encoder to engine type
         self.ohc_engine = OneHotEncoder()
-        ohe_engine = self.ohc_engine.fit_transform(trimmed_df['engine_type'].values.reshape(-1,1)).toarray()
-        df_engine = pd.DataFrame(ohe_engine, columns = self.ohc_engine.categories_[0])
+        ohe_engine = self.ohc_engine.fit_transform(trimmed_df['engine_type'].values.reshape(-1,1))
 
         # Apply one-hot encoder to drive train 
         self.ohc_drivetrain = OneHotEncoder()
-        ohe_drivetrain = self.ohc_drivetrain.fit_transform(trimmed_df['drivetrain'].values.reshape(-1,1)).toarray()
-        df_drivetrain = pd.DataFrame(ohe_drivetrain, columns = self.ohc_drivetrain.categories_[0])
+        ohe_drivetrain = self.ohc_drivetrain.fit_transform(trimmed_df['drivetrain'].values.reshape(-1,1))
 
         # Apply one-hot encoder to state 
         self.ohc_state = OneHotEncoder()
-        ohe_state = self.ohc_state.fit_transform(trimmed_df['state'].values.reshape(-1,1)).toarray()
-        df_state = pd.DataFrame(ohe_state, columns = self.ohc_state.categories_[0])
+        ohe_state = self.ohc_state.fit_transform(trimmed_df['state'].values.reshape(-1,1))
     
         # We will use Label Encoder for has_warranty since I presume having it has higher order
         self.le_warranty = LabelEncoder()
@@ -89,12 +85,12 @@ class carsfactors:
         normalizable_cols = ['odometer_value','year_produced','price_usd']
         numeric_df[normalizable_cols] = self.min_max_scaler.fit_transform(trimmed_df[normalizable_cols])
         
-        # Concatenate all the dataframes (hence delete is not needed)
-        car_factors_features = pd.concat([df_manufacturer, df_transmission, df_color, df_engine, df_drivetrain, df_state,
-                                 body_type_df, has_warranty_df, numeric_df], axis=1)
+        # Concatenate all the columns into a sparse matrix in the same order as model_infer (hence delete is not needed)
+        car_factors_features = sparse.hstack([ohe_manufacturer, ohe_transmission, ohe_color, ohe_engine, ohe_drivetrain, ohe_state,
+                                 body_type_df.values, has_warranty_df.values, numeric_df.values], format='csr')
   
         # Seperate X and y (features and label)  The last feature "duration_listed" is the label (y)
-        X = car_factors_features.values 
+        X = car_factors_features
         y = trimmed_df['duration_listed'].values
         
         # Splitting the dataset into the Training set and Test set 
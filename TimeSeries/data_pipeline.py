@@ -5,6 +5,122 @@ from sklearn import preprocessing
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.preprocessing import OrdinalEncoder
 from sklearn.preprocessing import LabelEncoder
+from cache import Feature_Cache
+from geo_cache import Distance_Cache
+
+class Weekly_Aggregator:
+    """
+    A class used to aggregate transactions into weekly series of total and fraudulent transactions in a single pass
+
+    Transactions are added a chunk at a time and only the running sums of every week (and segment) are kept, so
+    memory grows with the number of weeks rather than the number of transactions. The weeks end on Mondays and are 
+    labelled with that Monday like pd.Grouper(freq='W-Mon') does
+
+    ...
+
+    Attributes
+    ----------
+    segment_cols : list
+        the columns (such as category or state) the weekly series are also kept by
+    _weeks : df
+        the running amount and number of all and of fraudulent transactions by segment and week
+
+    Methods
+    -------
+    update()
+        Adds a chunk of transactions to the weekly sums
+    result()
+        Provides the weekly series with every week from the first to the last one
+    fill()
+        Adds the weeks without transactions to weekly series
+    """
+    value_cols = ['amt', 'y', 'fraud_amt', 'fraud_y']
+
+    def __init__(self, segment_cols=None):
+        """ Initializes the Weekly Aggregator
+
+        Parameters
+        ----------
+        segment_cols : list
+            The columns (such as category or state) to also keep the weekly series by
+
+        """
+        self.segment_cols = [] if segment_cols is None else list(segment_cols)
+        self._weeks = None
+
+    def update(self, chunk_df):
+        """ Adds a chunk of transactions to the weekly sums
+
+        Parameters
+        ----------
+        chunk_df : df
+            The transactions (Pandas Dataframe) with trans_date in YYYY-MM-DD format, amt, is_fraud and the segment 
+            columns
+
+        """
+        # The Monday ending the week of every transaction, transactions without a valid date are left out
+        txn_dt = pd.to_datetime(chunk_df['trans_date'], format='%Y-%m-%d', errors='coerce')
+        week = txn_dt + pd.to_timedelta((-txn_dt.dt.weekday) % 7, unit='D')
+
+        amt = chunk_df['amt'].to_numpy(dtype=np.float64)
+        is_fraud = chunk_df['is_fraud'].to_numpy() == 1
+        values_df = pd.DataFrame({'amt': amt, 'y': 1, 'fraud_amt': np.where(is_fraud, amt, 0.0),
+                                  'fraud_y': is_fraud.astype(np.int64)})
+        keys = [chunk_df[col].to_numpy() for col in self.segment_cols] + [week.to_numpy()]
+
+        # Add the sums of the chunk to the running ones
+        chunk_weeks = values_df.groupby(keys, sort=False).sum()
+        chunk_weeks.index.names = self.segment_cols + ['ds']
+        self._weeks = chunk_weeks if self._weeks is None else self._weeks.add(chunk_weeks, fill_value=0)
+
+    def result(self):
+        """ Provides the weekly series
+
+        Returns
+        -------
+        weekly_df
+            The dataset (Pandas Dataframe) with the segment columns, ds (the Monday ending the week), amt and y (the 
+            amount and number of all transactions) and fraud_amt and fraud_y (those of the fraudulent ones). Every 
+            segment has every week from its first week to its last one, the weeks without transactions hold 0
+        """
+        if self._weeks is None:
+            return pd.DataFrame({**{col: pd.Series(dtype=object) for col in self.segment_cols},
+                                 'ds': pd.Series(dtype='datetime64[ns]'),
+                                 **{col: pd.Series(dtype=np.float64 if col.endswith('amt') else np.int64) 
+                                    for col in Weekly_Aggregator.value_cols}})
+
+        if len(self.segment_cols) == 0:
+            return Weekly_Aggregator.fill(self._weeks).reset_index()
+
+        # Fill the weeks of every segment on its own
+        segment_dfs = []
+        for segment, segment_weeks in self._weeks.groupby(level=self.segment_cols, sort=True):
+            segment_df = Weekly_Aggregator.fill(segment_weeks.droplevel(self.segment_cols)).reset_index()
+            segment = segment if isinstance(segment, tuple) else (segment,)
+            for col, value in zip(self.segment_cols, segment):
+                segment_df.insert(self.segment_cols.index(col), col, value)
+            segment_dfs.append(segment_df)
+
+        return pd.concat(segment_dfs, ignore_index=True)
+
+    @staticmethod
+    def fill(weeks_df):
+        """ Adds the weeks without transactions to weekly series
+
+        Parameters
+        ----------
+        weeks_df : df
+            The weekly series (Pandas Dataframe) indexed by the Monday ending every week
+
+        Returns
+        -------
+        weeks_df
+            The weekly series with every week from the first to the last one, the added weeks hold 0
+        """
+        weeks = pd.date_range(weeks_df.index.min(), weeks_df.index.max(), freq='W-MON', name='ds')
+        weeks_df = weeks_df.sort_index().reindex(weeks, fill_value=0)
+
+        return weeks_df.astype({col: np.float64 if col.endswith('amt') else np.int64 for col in weeks_df.columns})
 
 class ETL_Pipeline:
     """
@@ -22,13 +138,28 @@ class ETL_Pipeline:
         the dataframe representing the source data
     transformed_df : df
         the dataframe representing the transformed data
+    segment_cols : list
+        the columns (such as category or state) kept in the transformed data so that the transactions can be 
+        forecast by segment
+    _cache : Feature_Cache
+        the cache holding the transformed data in a columnar format, keyed by the source file fingerprint
+    _weekly_cache : Feature_Cache
+        the cache holding the weekly series of total and fraudulent transactions, keyed the same way
+    version : str
+        the version of the transformations. Bump it whenever they change so that cached transformed data is rebuilt
 
     Methods
     -------
     process()
         Key method that extracts, transforms and loads the source. Optimizes by ensuring that if transformed
-        data is present then it simply reads it back instead of reading source, applying transforms and writing
-        transformed file
+        data is present for the same source, pipeline version and parameters then it simply reads it back instead 
+        of reading source, applying transforms and writing transformed file
+    process_weekly()
+        Aggregates the source into the weekly series of total and fraudulent transactions reading it in chunks,
+        which is all that the forecasting models are trained on. Reads them back when they are up to date
+    fingerprint()
+        Computes the fingerprint of the source history, which changes with its content, the pipeline version and
+        parameters
     extract()
         Reads the source file given the directory and file name. Expects the file to be a CSV
     transform()
@@ -38,8 +169,9 @@ class ETL_Pipeline:
     load()
         Saves the final transformed file
     """
+    version = '2'
     
-    def __init__(self, data_folder):
+    def __init__(self, data_folder, segment_cols=None):
         """ Initializes the Data Pipeline Class
 
         Parameters
@@ -48,11 +180,19 @@ class ETL_Pipeline:
             The name of the source file
         data_folder : str
             The folder with the source file is kept
+        segment_cols : list
+            The columns (such as category or state) to keep in the transformed data for forecasting by segment
 
         """
         self._data_folder = data_folder
         self.source_df = None
         self.transformed_df = None
+        self.segment_cols = [] if segment_cols is None else list(segment_cols)
+        self._cache = Feature_Cache(data_folder, 'forecasting_history', ETL_Pipeline.version,
+                                    {'segment_cols': self.segment_cols} if len(self.segment_cols) > 0 else None)
+        self._weekly_cache = Feature_Cache(data_folder, 'forecasting_weekly', ETL_Pipeline.version,
+                                           {'segment_cols': self.segment_cols} if len(self.segment_cols) > 0 else None)
+        self._cache_key = None
     
     def process(self, source_file):
         """ Executes the Pipeline to return transformed dataset 
@@ -63,16 +203,68 @@ class ETL_Pipeline:
             The dataset (Pandas Dataframe) equivalent of the transformed file
 
         """
-        try:
-            transformed_df = pd.read_csv(self._data_folder + "forecasting_history.csv")
-        except Exception:
-            print("Did not find the forecasting_history.csv")
+        self._cache_key = self.fingerprint(source_file)
+        transformed_df = self._cache.read(self._cache_key)
+
+        if transformed_df is None:
+            print("Did not find an up to date forecasting_history.feather")
             source_df = self.extract(source_file)
             transformed_df = self.transform(source_df)
             self.load()   
         
         return transformed_df
 
+    def process_weekly(self, source_file, chunk_size=100000):
+        """ Executes the Pipeline to return the weekly series of total and fraudulent transactions
+
+        Only the transaction date, amount, class label and segment columns of the source are read, chunk_size rows 
+        at a time, and every chunk is added to the running weekly sums, so the transactions are never held in memory 
+        as a whole. The weekly series are cached so that they are only aggregated again when the source changes
+
+        Parameters
+        ----------
+        source_file : str
+            The name of the source file
+        chunk_size : int
+            The number of rows of the source read at a time
+
+        Returns
+        -------
+        weekly_df
+            The weekly series (Pandas Dataframe) as provided by Weekly_Aggregator.result()
+
+        """
+        self._cache_key = self.fingerprint(source_file)
+        weekly_df = self._weekly_cache.read(self._cache_key)
+
+        if weekly_df is None:
+            print("Did not find an up to date forecasting_weekly.feather")
+            aggregator = Weekly_Aggregator(self.segment_cols)
+            for source_chunk_df in pd.read_csv(self._data_folder + source_file, chunksize=chunk_size,
+                                               usecols=['trans_date', 'amt', 'is_fraud'] + self.segment_cols):
+                aggregator.update(source_chunk_df)
+
+            weekly_df = aggregator.result()
+            self._weekly_cache.write(weekly_df, self._cache_key)
+
+        return weekly_df
+
+    def fingerprint(self, source_file):
+        """ Computes the fingerprint of the source history, the key its transformed data is cached under
+
+        Parameters
+        ----------
+        source_file : str
+            The name of the source file
+
+        Returns
+        -------
+        key
+            The hex digest of the content of the source file, the pipeline version and its parameters
+
+        """
+        return self._cache.fingerprint([self._data_folder + source_file])
+
     def extract(self, source_file):
         """ Reads the source to return source dataset 
         
@@ -115,15 +307,16 @@ class ETL_Pipeline:
         # Compute month from transaction date
         source_df['txn_month'] = source_df['txn_dt'].dt.month_name()
 
-        # Compute distance between customer's location and merchant location 
-        source_df['distance_from_merchant'] = self.haversine_vectorize(source_df['lat'],source_df['long'],
+        # Compute distance between customer's location and merchant location, kept as float32, and classify it
+        source_df['distance_from_merchant'] = Distance_Cache.distances(source_df['lat'],source_df['long'],
                                                                        source_df['merch_lat'],source_df['merch_long'])
-        source_df['txn_dist'] = source_df["distance_from_merchant"].apply(ETL_Pipeline.classify_distance) 
+        source_df['txn_dist'] = ETL_Pipeline.classify_distance_vectorize(source_df["distance_from_merchant"])
 
         # Drop the above columns
         cols_to_drop = ['ssn','acct_num','cc_num','person','first','last','dob','gender','street','city','state','zip','person_loc','age',
                 'merchant_loc','lat','long','trans_num','trans_date', 'trans_time','unix_time','txn_time','distance_from_merchant','txn_month',
                 'dob_dt','txn_hour','address','category','merch_lat','merch_long','normalized_job', 'merchant','job','city_pop']
+        cols_to_drop = [col for col in cols_to_drop if col not in self.segment_cols]
 
         trimmed_df = source_df.drop(columns=cols_to_drop,errors='ignore')
 
@@ -152,7 +345,7 @@ class ETL_Pipeline:
         if self.transformed_df is None:
             self.transform()
 
-        self.transformed_df.to_csv(self._data_folder + 'forecasting_history.csv', index=False)  
+        self._cache.write(self.transformed_df, self._cache_key)
 
     @staticmethod
     def age(born): 
@@ -193,16 +386,7 @@ class ETL_Pipeline:
             The distance between source and destination in miles
 
         """
-        lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
- 
-        newlon = lon2 - lon1
-        newlat = lat2 - lat1
- 
-        haver_formula = np.sin(newlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(newlon/2.0)**2
- 
-        dist = 2 * np.arcsin(np.sqrt(haver_formula ))
-        miles = 3958 * dist #6367 for distance in KM 
-        return miles
+        return Distance_Cache.haversine_vectorize(lon1, lat1, lon2, lat2)
 
     def classify_distance(_haversine_distance): 
         if (int(_haversine_distance) < 20):
@@ -211,3 +395,20 @@ class ETL_Pipeline:
             return 'High'
         else:
             return 'Medium'
+
+    @staticmethod
+    def classify_distance_vectorize(distance): 
+        """ Classifies a whole series of distances the same way as classify_distance()
+
+        Parameters
+        ----------
+        distance : Series
+            The distances in miles
+
+        Returns
+        -------
+        txn_dist
+            The series of Low (under 20 miles), Medium or High (50 miles and more)
+
+        """
+        return pd.Series(np.select([distance < 20, distance >= 50], ['Low', 'High'], 'Medium'), index=distance.index)
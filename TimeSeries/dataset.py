@@ -1,17 +1,19 @@
 import pandas as pd
+from data_pipeline import Weekly_Aggregator
 
 class Time_Series_Dataset:
     """
     A class used to represent the Time Series Dataset 
 
+    The dataset is built from the weekly series of the ETL_Pipeline (see ETL_Pipeline.process_weekly()), so the
+    transactions themselves never need to be loaded
+
     ...
 
     Attributes
     ----------
-    _df : df
-        the dataframe representing the time series dataset
-    class_label_col: str
-        The name of the field that is working as class label 
+    _weekly_df : df
+        the dataframe representing the weekly series of total and fraudulent transactions
     tot_train : df
         the dataframe comprising of training data for total transactions
     tot_test : df
@@ -20,6 +22,10 @@ class Time_Series_Dataset:
         the dataframe comprising of training data for fraudulent transactions
     fraud_test : df
         the dataframe comprising of testing data for fraudulent transactions
+    segment_col : str
+        The name of the column (such as category or state) the transactions are also forecast by, None when they are not
+    segments : dict
+        the tuple of training data for total and fraudulent transactions of every segment
 
     Methods
     -------
@@ -27,37 +33,34 @@ class Time_Series_Dataset:
         Get Training data for the specified fold 
     get_testing_dataset()
         Get Testing data for the specified fold 
+    get_segment_training_datasets()
+        Get Training data for every segment
     """
     
-    def __init__(self, transformed_df, class_label_col, train_size=209):
+    def __init__(self, weekly_df, train_size=209, segment_col=None):
         """ Initializes the Fraud_Dataset Class
 
         Parameters
         ----------
-        transformed_df : df
-            The dataset (Pandas Dataframe) that represents the final cleansed and preprocessed data
-        class_label_col : str
-            The name of the column that holds the class label 
+        weekly_df : df
+            The weekly series (Pandas Dataframe) of total and fraudulent transactions as provided by 
+            ETL_Pipeline.process_weekly(), by segment when they were aggregated by one
+        train_size : int
+            The number of weeks used for training
+        segment_col : str
+            The name of the column (such as category or state) to also build the weekly series of every segment by
 
         """
-        self._df = transformed_df
-        self.class_label_col = class_label_col
+        self._weekly_df = weekly_df
+        self.segment_col = segment_col
 
-        # Convert to dates
-        self._df["ds"] = pd.to_datetime(self._df['ds'], format='%Y-%m-%d', errors='coerce')
-        
-        # Total Transactions 
-        total_txn_group_df = self._df.groupby(pd.Grouper(key='ds',freq='W-Mon'))
-        total_txn_agg_df = total_txn_group_df[['amt']].agg('sum')
-        total_txn_agg_df['y'] = total_txn_group_df.size()
-        total_txn_agg_df['ds'] = total_txn_agg_df.index
-
-        # Fraudulent Transactions
-        fraud_df = self._df[self._df[self.class_label_col] == 1] 
-        fraud_txn_group_df = fraud_df.groupby(pd.Grouper(key='ds',freq='W-Mon'))
-        fraud_txn_agg_df = fraud_txn_group_df[['amt']].agg('sum')
-        fraud_txn_agg_df['y'] = fraud_txn_group_df.size()
-        fraud_txn_agg_df['ds'] = fraud_txn_agg_df.index
+        # Total and Fraudulent Transactions by week, adding up the segments when the series are kept by segment
+        value_cols = Weekly_Aggregator.value_cols
+        if len(weekly_df.columns.difference(['ds'] + value_cols)) > 0:
+            weeks_df = Weekly_Aggregator.fill(weekly_df.groupby('ds')[value_cols].sum())
+        else:
+            weeks_df = Weekly_Aggregator.fill(weekly_df.set_index('ds')[value_cols])
+        total_txn_agg_df, fraud_txn_agg_df = self._series(weeks_df)
 
         # Form the Training and Test sets with ~5 years for testing we will use the latest data for the best forecasting
         self.tot_train = total_txn_agg_df.iloc[:train_size]
@@ -65,6 +68,37 @@ class Time_Series_Dataset:
 
         self.fraud_train = fraud_txn_agg_df.iloc[:train_size]
         self.fraud_test = fraud_txn_agg_df.iloc[train_size:]
+
+        # The same weekly series for every segment, up to the last training week of all the transactions. Prophet needs 
+        # at least two weeks to fit so segments with less are left out
+        self.segments = {}
+        if segment_col is not None:
+            last_week = self.tot_train['ds'].max()
+            for segment, segment_df in weekly_df.groupby(segment_col, observed=True, sort=True):
+                tot_segment_df, fraud_segment_df = self._series(segment_df.set_index('ds')[value_cols])
+                tot_segment_df = tot_segment_df[tot_segment_df['ds'] <= last_week]
+                fraud_segment_df = fraud_segment_df[fraud_segment_df['ds'] <= last_week]
+                if (len(tot_segment_df) < 2) or (len(fraud_segment_df) < 2):
+                    print(f'Leaving out segment {segment} with less than two weeks of transactions')
+                    continue
+                self.segments[str(segment)] = (tot_segment_df, fraud_segment_df)
+
+    def _series(self, weeks_df):
+        """ Splits weekly sums into the series of total and fraudulent transactions. The fraudulent transactions run 
+        from the first to the last week with any
+        """
+        # Total Transactions 
+        total_txn_agg_df = weeks_df[['amt', 'y']].copy()
+        total_txn_agg_df['ds'] = total_txn_agg_df.index
+
+        # Fraudulent Transactions
+        fraud_weeks = weeks_df.index[weeks_df['fraud_y'] > 0]
+        fraud_txn_agg_df = weeks_df.loc[fraud_weeks.min():fraud_weeks.max(), ['fraud_amt', 'fraud_y']] if len(fraud_weeks) > 0 \
+                           else weeks_df.iloc[:0][['fraud_amt', 'fraud_y']]
+        fraud_txn_agg_df = fraud_txn_agg_df.rename(columns={'fraud_amt': 'amt', 'fraud_y': 'y'})
+        fraud_txn_agg_df['ds'] = fraud_txn_agg_df.index
+
+        return (total_txn_agg_df, fraud_txn_agg_df)
     
     def get_training_dataset(self):
         """ Get the Training Dataset
@@ -80,6 +114,13 @@ class Time_Series_Dataset:
         """
         # Return tuple of training data for Total and Fraudulent Transactions
         return (self.tot_test, self.fraud_test)
+
+    def get_segment_training_datasets(self):
+        """ Get the Training Dataset of every segment
+
+        """
+        # Return the tuple of training data for Total and Fraudulent Transactions by segment
+        return self.segments
     
        
     
\ No newline at end of file
@@ -1,14 +1,21 @@
 from flask import Flask
-from flask import request, jsonify
+from flask import request, jsonify, Response
 import sys
 import os
+import json
+import pandas as pd
+from datetime import datetime
 
 from data_pipeline import ETL_Pipeline 
 from dataset import Time_Series_Dataset
 from model import Forecast_Model
+from instrumentation import instrumentation
 
 app = Flask(__name__)
 
+# Time every request by endpoint when the instrumentation environment variable is set
+instrumentation.instrument_app(app)
+
 """
 A class used to provides an REST API to detect if a given transaction is fraudulent or not
 
@@ -20,6 +27,15 @@ Methods
 
 forecast()
     Will determine if the supplied transaction is fraudulent or not. To execute you use POST http://localhost:8786/detect-fraud
+    The forecasts are looked up in a table of every day up to forecast-horizon-days after the training data, which is 
+    computed at startup and extended the first time a date outside of it is asked for. With forecast-segment set to 
+    category or state a segment can be forecast on its own
+forecast_batch()
+    Will provide the forecasts with their uncertainty intervals for a list or range of dates. To execute you use 
+    POST http://localhost:8786/fraud-forecast-batch
+getMetrics()
+    Will provide the request latency per endpoint and the time spent parsing, forecasting and serializing as Prometheus 
+    metrics when the instrumentation environment variable is set. To execute you use GET http://localhost:8786/metrics
 
     Sample JSON as body below
 
@@ -39,7 +55,12 @@ def forecast():
     Encoded into Json with following mandatory attributes
 
     forecast_date : str
-        Date for which a forecast is needed
+        Date for which a forecast is needed in YYYY-MM-DD format, status 400 when it is not
+
+    and the optional attribute
+
+    segment : str
+        The category or state (as set by forecast-segment) to forecast, status 400 when it was not trained
 
 
     Sample JSON Below
@@ -50,59 +71,287 @@ def forecast():
 
     """
     # Obtain request payload as a dictionary
-    forecast_details = request.json
+    with instrumentation.span('json_parse'):
+        forecast_details = request.json
 
     # Get the forecasted date
     forecast_date = forecast_details["forecast_date"]
 
-    # Pass dictionary data to model's prediction 
-    total_transactions, fraudulent_transactions = model.predict(forecast_date)
+    # Look the date up in the forecast table of the model
+    with instrumentation.span('inference'):
+        try:
+            total_transactions, fraudulent_transactions = get_model(forecast_details).predict(forecast_date)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
     # Return the result as Json
-    return jsonify({"total_transactions":total_transactions, "fraudulent_transactions":fraudulent_transactions})
+    with instrumentation.span('serialization'):
+        return jsonify({"total_transactions":total_transactions, "fraudulent_transactions":fraudulent_transactions})
 
-if __name__ == "__main__":
+def get_model(forecast_details):
+    """ Provides the model of the segment asked for, the model of all the transactions when there is none
+
+    Parameters
+    ----------
+    forecast_details : dict
+        The request payload with the optional segment
+
+    Returns
+    ----------
+    model : Forecast_Model
+        The model forecasting the transactions of the segment
+    """
+    segment = forecast_details.get('segment') if isinstance(forecast_details, dict) else None
+    if segment is None:
+        return model
+
+    if segment not in segment_models:
+        raise ValueError(f"No forecast for segment {segment}, the segments are {', '.join(segment_models)}" 
+                         if len(segment_models) > 0 else "Forecasts by segment are disabled, set forecast-segment to category or state")
+    return segment_models[segment]
+
+def get_forecast_dates(forecast_details):
+    """ Reads the dates of a batch forecast request, either a list of dates or a range of dates
+
+    Parameters
+    ----------
+    forecast_details : dict
+        The request payload with forecast_dates or start_date and end_date
+
+    Returns
+    ----------
+    forecast_dates : list
+        The dates in YYYY-MM-DD format, at most max-forecast-dates of them
+    """
+    if not isinstance(forecast_details, dict):
+        raise ValueError("Provide forecast_dates or start_date and end_date")
+
+    if 'forecast_dates' in forecast_details:
+        forecast_dates = forecast_details['forecast_dates']
+        if not isinstance(forecast_dates, list):
+            raise ValueError("forecast_dates needs to be a list of dates")
+    elif ('start_date' in forecast_details) and ('end_date' in forecast_details):
+        try:
+            start_date = datetime.strptime(forecast_details['start_date'], '%Y-%m-%d')
+            end_date = datetime.strptime(forecast_details['end_date'], '%Y-%m-%d')
+        except (TypeError, ValueError):
+            raise ValueError("start_date and end_date need to be dates in YYYY-MM-DD format")
+        if end_date < start_date:
+            raise ValueError("end_date needs to be on or after start_date")
+
+        # Check the size before building the range so that a long range is not built only to be rejected
+        if (end_date - start_date).days + 1 > max_forecast_dates:
+            raise ValueError(f"At most {max_forecast_dates} dates can be forecast at once")
+        forecast_dates = pd.date_range(start_date, end_date, freq='D').strftime('%Y-%m-%d').tolist()
+    else:
+        raise ValueError("Provide forecast_dates or start_date and end_date")
+
+    if len(forecast_dates) > max_forecast_dates:
+        raise ValueError(f"At most {max_forecast_dates} dates can be forecast at once")
+
+    return forecast_dates
+
+@app.route('/fraud-forecast-batch', methods=['POST'])
+def forecast_batch():
+    """ Provides the forecasts of the Total and Fraudulent Transactions for many dates with a single call to each model
+        
+    Parameters 
+    ----------
+    Encoded into Json with either of
+
+    forecast_dates : list
+        Dates for which a forecast is needed in YYYY-MM-DD format
+    start_date, end_date : str
+        First and last date (included) of the range of days for which a forecast is needed in YYYY-MM-DD format
+
+    and optionally the segment as for /fraud-forecast. At most max-forecast-dates (default 3660) dates, status 400 otherwise or when a date is not valid
+
+    Returns
+    ----------
+    A JSON array with the forecast and the lower and upper bounds of its uncertainty interval for every date in the 
+    order of the request. The array is streamed back 1,000 dates at a time so that long horizons do not need to be 
+    serialized whole
+
+    Sample JSON Below
+
+    [
+        {
+            "forecast_date": "2019-01-01",
+            "total_transactions": 24915.4, "total_transactions_lower": 23020.1, "total_transactions_upper": 26864.9,
+            "fraudulent_transactions": 143.2, "fraudulent_transactions_lower": 98.7, "fraudulent_transactions_upper": 189.5
+        }
+    ]
+
+    """
+    # Obtain request payload as a dictionary
+    with instrumentation.span('json_parse'):
+        forecast_details = request.json
+
+    # Look the dates up in the forecast table of the model, the ones outside of it are forecast together
+    try:
+        forecast_dates = get_forecast_dates(forecast_details)
+        with instrumentation.span('inference'):
+            future_dates, total_transactions, fraudulent_transactions = get_model(forecast_details).predict_batch(forecast_dates)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        # Serialize the forecasts 1,000 dates at a time
+        yield '['
+        for start in range(0, len(future_dates), 1000):
+            end = start + 1000
+            rows = zip(future_dates[start:end].strftime('%Y-%m-%d'), total_transactions[start:end].tolist(), 
+                       fraudulent_transactions[start:end].tolist())
+            chunk = ','.join(json.dumps({"forecast_date": date, 
+                                         "total_transactions": total[0], "total_transactions_lower": total[1], 
+                                         "total_transactions_upper": total[2],
+                                         "fraudulent_transactions": fraud[0], "fraudulent_transactions_lower": fraud[1],
+                                         "fraudulent_transactions_upper": fraud[2]}) for date, total, fraud in rows)
+            yield chunk if start == 0 else ',' + chunk
+        yield ']'
+
+    return Response(generate(), mimetype='application/json')
+
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    """ Provides the timings of the service in the Prometheus text format
+        
+    Returns
+    ----------
+    Histograms of the request latency by endpoint (http_request_duration_seconds) and of the time spent in every step 
+    of the hot path (span_duration_seconds) along with the requests by endpoint and status (http_requests_total). 
+    The spans are json_parse, inference, serialization and at startup etl and training (along with the forecast tables). Status 404 when the 
+    instrumentation environment variable is not set. With several gunicorn workers every worker reports its own requests
+
+    """
+    if not instrumentation.enabled:
+        return jsonify({"error": "Instrumentation is disabled, set the instrumentation environment variable to true"}), 404
+
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+def initialize(args):
     """ Initializes the Forecast Service Class
 
     It does the following as a part of initialization
 
-    1. Initialize the ETL_Pipeline and use it to process the training data to get the features we need
+    When started with --model-artifact <folder> (or the model-artifact environment variable) and the folder holds 
+    saved models, the models and their forecast tables are loaded from it and steps 1 to 4 are skipped, either without 
+    any training data (load only) or when the fingerprint of the training data is the one the models were trained on. 
+    Otherwise the steps run and the trained models are saved to the folder
+
+    1. Initialize the ETL_Pipeline and use it to aggregate the training data into weekly series, reading it chunk-size 
+       (default 100,000) rows at a time
     2. Initialize Time_Series_Dataset to get the training data split
-    3. Initialize the Forecast_Model to train the classifier on the training data  
+    3. Initialize a Forecast_Model for all the transactions and one for every segment of forecast-segment (category 
+       or state, none by default)
+    4. Train all of them at once, with every series fitted by one of at most training-workers (default the number of 
+       CPUs) processes, which also forecast every day up to forecast-horizon-days (default 730) after the training data 
+       into the forecast tables
+
+    Parameters
+    ----------
+    args : list
+        The command line arguments without the script name, the environment variables are used when there are none
     """
-    flaskPort = 8786
+    global model, segment_models, max_forecast_dates
 
-    # Get command line arguments
-    if (len(sys.argv)>1):
-        data_folder                 = sys.argv[1]
-        fraud_training_data_file    = sys.argv[2]
+    # Get command line arguments, --model-artifact <folder> can be given along with them
+    args = list(args)
+    model_artifact = os.environ.get('model-artifact')
+    if '--model-artifact' in args:
+        i = args.index('--model-artifact')
+        model_artifact = args[i + 1]
+        del args[i:i + 2]
+
+    if (len(args)>0):
+        data_folder                 = args[0]
+        fraud_training_data_file    = args[1]
     else: 
-        data_folder = os.environ['data-folder']
-        fraud_training_data_file = os.environ['training-data-file']
+        data_folder = os.environ.get('data-folder')
+        fraud_training_data_file = os.environ.get('training-data-file')
+
+    # Column the transactions are also forecast by, category or state
+    segment_col = os.environ.get('forecast-segment', '') or None
+    if segment_col not in [None, 'category', 'state']:
+        raise ValueError(f'forecast-segment needs to be category or state, not {segment_col}')
+
+    # Number of days after the training data that are forecast up front
+    horizon_days = int(os.environ.get('forecast-horizon-days', 730))
+
+    # Most dates a single /fraud-forecast-batch request can ask for
+    max_forecast_dates = int(os.environ.get('max-forecast-dates', 3660))
+
+    # Rows of the training data read at a time when aggregating it into weekly series
+    chunk_size = int(os.environ.get('chunk-size', 100000))
+
+    # Most processes fitting the series at the same time
+    workers = int(os.environ.get('training-workers', '') or (os.cpu_count() or 1))
+
+    # The saved models are used as they are without training data, otherwise only when they were trained on it
+    manifest = Forecast_Model.read_manifest(model_artifact) if model_artifact is not None else None
+    has_training_data = (data_folder is not None) and (fraud_training_data_file is not None) and \
+                        os.path.exists(data_folder + fraud_training_data_file)
+    if (manifest is None) and (not has_training_data):
+        raise FileNotFoundError(f'Neither the training data {fraud_training_data_file} in {data_folder} nor saved models in {model_artifact} were found')
+
+    dp = None
+    fingerprint = None
+    if has_training_data:
+        dp = ETL_Pipeline(data_folder, [segment_col] if segment_col is not None else None)
+        fingerprint = dp.fingerprint(fraud_training_data_file)
 
-    # Process the Data needed to train the model
-    print(f'Start an ETL_Pipeline to load training data with shared folder = {data_folder} and training data file = {fraud_training_data_file}')
-    dp = ETL_Pipeline(data_folder)
-    df = dp.process(fraud_training_data_file)
-    print('Successfully processed and created feature data and initialized metrics')
+    if (manifest is not None) and ((fingerprint is None) or (manifest['fingerprint'] == fingerprint)):
+        # Serve the saved models without processing the training data or training
+        print(f'Loading Forecasting Models from {model_artifact}')
+        with instrumentation.span('training'):
+            models, manifest = Forecast_Model.load_all(model_artifact, horizon_days)
+        if manifest['segment_col'] != segment_col:
+            print(f"Forecasting Models were trained by segment {manifest['segment_col']} rather than {segment_col}, serving them as they are")
+        print(f"Successfully loaded {len(models)} Forecasting Models trained on {manifest['created']}")
+    else:
+        if manifest is not None:
+            print(f'Training data changed since the Forecasting Models in {model_artifact} were trained, training them again')
 
-    # Create a fraud dataset with single fold
-    fd = Time_Series_Dataset(df,'is_fraud')
-    print('Successfully created Fraud Dataset')
+        # Process the Data needed to train the model, only its weekly series are loaded
+        print(f'Start an ETL_Pipeline to load training data with shared folder = {data_folder} and training data file = {fraud_training_data_file}')
+        with instrumentation.span('etl'):
+            weekly_df = dp.process_weekly(fraud_training_data_file, chunk_size)
+        print(f'Successfully processed and created {len(weekly_df)} weekly series rows')
 
-    # Obtain the training data
-    tot_train, fraud_train = fd.get_training_dataset()
-    tot_test, fraud_test = fd.get_testing_dataset()
-    print('Successfully created training and testing data')
+        # Create a fraud dataset with single fold
+        fd = Time_Series_Dataset(weekly_df, segment_col=segment_col)
+        print('Successfully created Fraud Dataset')
 
-    # Train the Model
-    model = Forecast_Model()
-    print('Successfully created Fraud Data Model')
+        # Obtain the training data
+        tot_train, fraud_train = fd.get_training_dataset()
+        tot_test, fraud_test = fd.get_testing_dataset()
+        print('Successfully created training and testing data')
 
-    model.train(tot_train, fraud_train)
-    print('Successfully trained Forecasting Model')
+        # Train the Models, one for all the transactions and one for every segment
+        datasets = {None: (tot_train, fraud_train)}
+        datasets.update(fd.get_segment_training_datasets())
+        models = {name: Forecast_Model(horizon_days) for name in datasets}
+        print(f'Successfully created {len(models)} Fraud Data Models')
+
+        # Fit every series and forecast every day up front so that requests only look their date up
+        with instrumentation.span('training'):
+            days = Forecast_Model.train_all(models, datasets, workers)
+        print(f'Successfully trained {2 * len(models)} series with {min(workers, 2 * len(models))} workers and forecast {days[None]} days up to {horizon_days} days after the training data')
+
+        # Save the models with their fingerprint so that the next start skips training while the data is the same
+        if model_artifact is not None:
+            Forecast_Model.save_all(models, model_artifact, fingerprint, segment_col)
+            print(f'Successfully saved Forecasting Models to {model_artifact}')
+
+    model = models.pop(None)
+    segment_models = models
+
+if __name__ == "__main__":
+    flaskPort = 8786
+
+    # Initialize the service from the command line arguments
+    initialize(sys.argv[1:])
 
     # Now that all the setup has been done start the service
     print('Starting Server...')
     app.run(host = '0.0.0.0', port = flaskPort)
-
@@ -0,0 +1,149 @@
+import math
+import struct
+import numpy as np
+
+# Rounds a python float to float32 much faster than going through numpy
+_float32 = struct.Struct('f')
+
+class Distance_Cache:
+    """
+    A class used to provide the distance in miles between the customer's location and the merchant's location
+
+    A customer transacts from the same home location with the same merchants over and over, so the distance of a
+    (customer location, merchant location) pair is computed once for single transactions and looked up afterwards.
+    Whole columns are computed at once instead, which costs about as much as finding their repeated pairs (see the
+    geo benchmark). Distances are kept as float32 both ways so that a transaction gets the same distance in the
+    service as it got in the training data
+
+    ...
+
+    Attributes
+    ----------
+    max_entries : int
+        the number of pairs kept, the pairs are forgotten all at once when it is reached
+    hits : int
+        the number of single transactions whose distance was looked up
+    misses : int
+        the number of single transactions whose distance had to be computed
+    _distances : dict
+        the distance by (lat, long, merch_lat, merch_long) pair
+
+    Methods
+    -------
+    distance()
+        Provides the distance of a single transaction, computing it only for pairs not seen before
+    distances()
+        Computes the distances of whole columns of locations at once
+    get_stats()
+        Provides the number of pairs kept and how many lookups found their pair
+    haversine_vectorize()
+        Returns the distances in miles between columns of coordinates
+    haversine()
+        Returns the distance in miles between a single pair of coordinates
+    """
+
+    def __init__(self, max_entries=100000):
+        """ Initializes the Distance Cache
+
+        Parameters
+        ----------
+        max_entries : int
+            The number of pairs kept, the pairs are forgotten all at once when it is reached
+
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._distances = {}
+
+    def distance(self, lat, long, merch_lat, merch_long):
+        """ Provides the distance of a single transaction
+
+        Parameters
+        ----------
+        lat : float
+            Latitude of the customer
+        long : float
+            Longitude of the customer
+        merch_lat : float
+            Latitude of the merchant
+        merch_long : float
+            Longitude of the merchant
+
+        Returns
+        -------
+        miles
+            The distance in miles, rounded to float32 exactly like distances()
+        """
+        key = (lat, long, merch_lat, merch_long)
+        miles = self._distances.get(key)
+        if miles is not None:
+            self.hits += 1
+            return miles
+
+        self.misses += 1
+        miles = _float32.unpack(_float32.pack(Distance_Cache.haversine(lat, long, merch_lat, merch_long)))[0]
+
+        # Single dictionary operations are thread safe, so requests served in parallel can share the pairs
+        if len(self._distances) >= self.max_entries:
+            self._distances.clear()
+        self._distances[key] = miles
+
+        return miles
+
+    @staticmethod
+    def distances(lat, long, merch_lat, merch_long):
+        """ Computes the distances of whole columns of locations at once
+
+        Parameters
+        ----------
+        lat : Series
+            Latitudes of the customers
+        long : Series
+            Longitudes of the customers
+        merch_lat : Series
+            Latitudes of the merchants
+        merch_long : Series
+            Longitudes of the merchants
+
+        Returns
+        -------
+        miles
+            The float32 array of distances in miles
+        """
+        lat, long, merch_lat, merch_long = [np.asarray(values, dtype=np.float64)
+                                            for values in [lat, long, merch_lat, merch_long]]
+        return Distance_Cache.haversine_vectorize(lat, long, merch_lat, merch_long).astype(np.float32)
+
+    def get_stats(self):
+        """ Provides the number of pairs kept and how many single transactions found their pair
+
+        Returns
+        -------
+        stats
+            Dictionary with entries, hits, misses and hit_ratio
+        """
+        lookups = self.hits + self.misses
+        return {'entries': len(self._distances),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups > 0 else 0.0}
+
+    @staticmethod
+    def haversine_vectorize(lon1, lat1, lon2, lat2):
+        """ Returns distances in miles between columns of coordinates. The pipeline has always passed the latitude 
+        as lon1 and the longitude as lat1, distance() and distances() keep doing so that the distances do not change
+        """
+        lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+
+        haver_formula = np.sin((lat2 - lat1)/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1)/2.0)**2
+        return 3958 * (2 * np.arcsin(np.sqrt(haver_formula)))
+
+    @staticmethod
+    def haversine(lon1, lat1, lon2, lat2):
+        """ Scalar equivalent of haversine_vectorize for a single transaction
+        """
+        lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+
+        haver_formula = math.sin((lat2 - lat1)/2.0)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1)/2.0)**2
+        return 3958 * (2 * math.asin(math.sqrt(haver_formula)))
@@ -0,0 +1,240 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+
+class Instrumentation:
+    """
+    A class used to time the hot path of a service and expose the timings as Prometheus metrics
+
+    Spans time the steps a request goes through (parsing, ETL, feature transform, inference, serialization) and
+    the requests themselves are timed per endpoint. Every timing is counted into a histogram with fixed buckets so
+    that memory stays constant however many requests are served. render() writes all of them in the Prometheus
+    text format, which the services return from /metrics
+
+    The module level instrumentation is enabled with the environment variable instrumentation. When it is not, span()
+    returns a shared span that does nothing and no request hooks are installed, so the instrumented code only pays
+    for a method call
+
+    ...
+
+    Attributes
+    ----------
+    enabled : bool
+        whether timings are recorded
+    buckets : list
+        the upper bounds in seconds of the histogram buckets
+    _histograms : dict
+        the histogram by metric name and labels
+
+    Methods
+    -------
+    span()
+        Provides a context manager timing the code it wraps
+    observe()
+        Counts a timing into the histogram of a span
+    instrument_app()
+        Times every request of a Flask app by endpoint
+    render()
+        Writes every metric in the Prometheus text format
+    """
+    buckets = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    def __init__(self, enabled=False, buckets=None):
+        """ Initializes the Instrumentation
+
+        Parameters
+        ----------
+        enabled : bool
+            Whether timings are recorded
+        buckets : list
+            The upper bounds in seconds of the histogram buckets, in increasing order
+
+        """
+        self.enabled = enabled
+        self.buckets = list(buckets if buckets is not None else Instrumentation.buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        """ Provides a context manager timing the code it wraps into the histogram of the span
+
+        Parameters
+        ----------
+        name : str
+            The name of the span, such as etl, feature_transform, inference or serialization
+
+        Returns
+        -------
+        span
+            The context manager, one that does nothing when disabled
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self._histogram('span_duration_seconds', (('span', name),)))
+
+    def observe(self, name, seconds):
+        """ Counts a timing measured elsewhere into the histogram of the span
+
+        Parameters
+        ----------
+        name : str
+            The name of the span
+        seconds : float
+            The timing in seconds
+
+        """
+        if self.enabled:
+            self._histogram('span_duration_seconds', (('span', name),)).observe(seconds)
+
+    def instrument_app(self, app):
+        """ Times every request of the Flask app by endpoint and method and counts them by status. Nothing is
+        installed when disabled. Streamed responses are timed until their first byte
+
+        Parameters
+        ----------
+        app : Flask
+            The app of the service
+
+        """
+        if not self.enabled:
+            return
+
+        from flask import g, request
+
+        @app.before_request
+        def start_timer():
+            g.instrumentation_start = time.perf_counter()
+
+        @app.after_request
+        def stop_timer(response):
+            start = g.pop('instrumentation_start', None)
+            if start is not None:
+                endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+                labels = (('endpoint', endpoint), ('method', request.method))
+                self._histogram('http_request_duration_seconds', labels).observe(time.perf_counter() - start)
+                self._count('http_requests_total', labels + (('status', str(response.status_code)),))
+            return response
+
+    def render(self):
+        """ Writes every metric in the Prometheus text format (version 0.0.4)
+
+        Returns
+        -------
+        text
+            The metrics, one sample per line
+        """
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        described = set()
+        for (metric, labels), histogram in histograms:
+            if metric not in described:
+                lines.append(f'# HELP {metric} {_HELP[metric]}')
+                lines.append(f'# TYPE {metric} histogram')
+                described.add(metric)
+
+            # Buckets are cumulative, every one counts the timings up to its bound
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{metric}_sum{_labels(labels)} {total}')
+            lines.append(f'{metric}_count{_labels(labels)} {count}')
+
+        for (metric, labels), value in counters:
+            if metric not in described:
+                lines.append(f'# HELP {metric} {_HELP[metric]}')
+                lines.append(f'# TYPE {metric} counter')
+                described.add(metric)
+            lines.append(f'{metric}{_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, metric, labels):
+        """ Returns the histogram of the metric and labels, creating it the first time
+        """
+        histogram = self._histograms.get((metric, labels))
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault((metric, labels), _Histogram(self.buckets))
+        return histogram
+
+    def _count(self, metric, labels):
+        """ Adds one to the counter of the metric and labels
+        """
+        with self._lock:
+            self._counters[(metric, labels)] = self._counters.get((metric, labels), 0) + 1
+
+class _Histogram:
+    """
+    The number of timings in every bucket along with their sum and count
+    """
+    __slots__ = ['bounds', 'counts', 'total', 'count', 'lock']
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        # The bucket is the first one whose bound is at least the timing, the last one is +Inf
+        i = bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total, self.count
+
+class _Span:
+    """
+    Times the code it wraps into a histogram
+    """
+    __slots__ = ['histogram', 'start']
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class _No_Span:
+    """
+    The span returned when disabled, it does nothing
+    """
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NO_SPAN = _No_Span()
+
+_HELP = {'span_duration_seconds': 'Time spent in every step of the hot path',
+         'http_request_duration_seconds': 'Time taken to serve the requests of every endpoint',
+         'http_requests_total': 'Requests served by endpoint, method and status'}
+
+def _labels(labels):
+    """ Writes labels as {name="value",...} escaping the values
+    """
+    escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+# Shared by the modules of the service, enabled by the instrumentation environment variable
+instrumentation = Instrumentation(os.environ.get('instrumentation', 'false').lower() in ['1', 'true', 'yes'])
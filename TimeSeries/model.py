@@ -1,36 +1,88 @@
 
 from data_pipeline import ETL_Pipeline 
+import os
+import json
+import threading
+import numpy as np
 import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import prophet
 from prophet import Prophet
+from prophet.serialize import model_to_json, model_from_json
 
 class Forecast_Model:
     """
     A class used to represent the Time Series Forecast Model 
 
+    Forecasts are served from a table holding the forecast of every day from the first training date up to the
+    horizon after the last one. The table is built with a single predict call per model over all its dates, so a
+    request only looks up the index of its date. Dates outside the table extend it (again with one predict call
+    per model) the first time they are asked for. Along with the forecast (yhat) the table holds the lower and upper
+    bounds of its uncertainty interval (yhat_lower and yhat_upper), which Prophet samples when it predicts
+
+    Every series is fitted independently, so train_all() fits the series of many models (the total and fraudulent
+    transactions of every segment) at the same time in a pool of worker processes. The workers forecast the table
+    of their series as well and send back the fitted model in the JSON format of Prophet
+
+    Trained models are saved together as an artifact folder with save_all() and loaded back with load_all(), so a
+    service can start without processing the training data or fitting anything
+
     ...
 
     Attributes
     ----------
-
+    horizon_days : int
+        the number of days after the last training date that are forecast up front
+    _table : tuple
+        the first date of the table and the arrays of total and fraudulent transactions forecast for every day from
+        it (one row per day with the columns of forecast_cols), replaced as a whole whenever the table is extended
+        so that lookups never need a lock
+    _extend_lock : Lock
+        the lock making sure the table is extended by one request at a time
 
     Methods
     -------
     train()
         Train the data using training data
+    train_all()
+        Train many models at once with all their series fitted concurrently by a pool of worker processes
     test()
         Predict the test data
+    precompute()
+        Forecast every day from the first training date up to the horizon into the forecast table
+    predict()
+        Forecast of the total and fraudulent transactions of a date from the forecast table
+    predict_batch()
+        Forecasts with uncertainty intervals of the total and fraudulent transactions of many dates at once
+    save_all()
+        Save many models with their forecast tables as an artifact folder
+    load_all()
+        Load the models saved as an artifact folder
+    read_manifest()
+        Read the manifest of an artifact folder, telling which history its models were trained on
 
     """
-    def __init__(self):
+    forecast_cols = ['yhat', 'yhat_lower', 'yhat_upper']
+    artifact_format = 1
+
+    def __init__(self, horizon_days=730):
         """ Initializes the Time Series Model
 
+        Parameters
+        ----------
+        horizon_days : int
+            The number of days after the last training date that are forecast up front
 
         """
         self.model_total_transactions = Prophet()
         self.model_fraud_transactions = Prophet()
+        self.horizon_days = horizon_days
+        self._table = None
+        self._extend_lock = threading.Lock()
 
-    def train(self, tot_train,fraud_train):
-        """ Train the Model 
+    def train(self, tot_train,fraud_train, workers=None):
+        """ Train the Model, fitting the total and fraudulent transactions at the same time
 
         Parameters
         ----------
@@ -38,10 +90,64 @@ class Forecast_Model:
             Dataframe holding the total transactions for training 
         fraud_train : df
             Dataframe holding the fraudulent transactions for training
+        workers : int
+            The most worker processes fitting at the same time, the number of CPUs when None
+
+        """
+        Forecast_Model.train_all({None: self}, {None: (tot_train, fraud_train)}, workers, precompute=False)
+
+    @staticmethod
+    def train_all(models, datasets, workers=None, precompute=True):
+        """ Train many models at once. The total and fraudulent transactions of every model are fitted in a pool of
+        at most workers processes, so training takes about as long as the slowest series once there are as many CPUs
+        as series. With a single worker the series are fitted one after the other in this process
 
+        Parameters
+        ----------
+        models : dict
+            The models to train by name
+        datasets : dict
+            The tuple of total and fraudulent transactions for training of every model by the same name
+        workers : int
+            The most worker processes fitting at the same time, the number of CPUs when None
+        precompute : bool
+            Whether the workers also forecast the table of every model as precompute() does
+
+        Returns
+        -------
+        days
+            The number of days in the forecast table of every model by name, when precomputed
         """
-        self.model_total_transactions.fit(tot_train)
-        self.model_fraud_transactions.fit(fraud_train)
+        # One task per series, the total and fraudulent transactions of a model are forecast over the same dates
+        tasks = []
+        table_dates = {}
+        for name, model in models.items():
+            tot_train, fraud_train = datasets[name]
+            table_dates[name] = model._table_dates(tot_train['ds']) if precompute else None
+            tasks.append((name, 'total', tot_train[['ds', 'y']], table_dates[name]))
+            tasks.append((name, 'fraud', fraud_train[['ds', 'y']], table_dates[name]))
+
+        workers = min(workers if workers is not None else (os.cpu_count() or 1), len(tasks))
+        if workers <= 1:
+            results = [_fit_series(series_df, future_dates) for _, _, series_df, future_dates in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_fit_series, [task[2] for task in tasks], [task[3] for task in tasks]))
+
+        # Put the fitted models and their forecasts back together by model
+        fitted = {(name, series): result for (name, series, _, _), result in zip(tasks, results)}
+        days = {}
+        for name, model in models.items():
+            total_json, total_forecast = fitted[(name, 'total')]
+            fraud_json, fraud_forecast = fitted[(name, 'fraud')]
+            with model._extend_lock:
+                model.model_total_transactions = model_from_json(total_json)
+                model.model_fraud_transactions = model_from_json(fraud_json)
+                model._table = (table_dates[name][0], total_forecast, fraud_forecast) if precompute else None
+            if precompute:
+                days[name] = len(total_forecast)
+
+        return days
 
     def test(self, tot_test, fraud_test):
         """ Test the Model 
@@ -59,18 +165,299 @@ class Forecast_Model:
 
         return (future_total, future_fraud)
 
+    @staticmethod
+    def save_all(models, artifact_folder, fingerprint, segment_col=None):
+        """ Save many models as an artifact folder that can be loaded without training
+
+        The folder holds the fitted Prophet models in their JSON format (models.json), the forecast tables of the 
+        models (tables.npz) and a manifest (manifest.json) that is written last, so that a partially written artifact
+        is never loaded. The manifest holds the fingerprint of the history the models were trained on
+
+        Parameters
+        ----------
+        models : dict
+            The trained models by name, None for the model of all the transactions
+        artifact_folder : str
+            The folder to save the artifact in, created when missing
+        fingerprint : str
+            The fingerprint of the history the models were trained on (see ETL_Pipeline.fingerprint())
+        segment_col : str
+            The column the segment models were trained by
+
+        """
+        manifest_file = os.path.join(artifact_folder, 'manifest.json')
+        os.makedirs(artifact_folder, exist_ok=True)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+        # The models are kept in the same order in every file, the tables of the i-th model are named after i
+        names = list(models)
+        tables = {}
+        with open(os.path.join(artifact_folder, 'models.json'), 'w') as f:
+            json.dump([{'total': model_to_json(models[name].model_total_transactions),
+                        'fraud': model_to_json(models[name].model_fraud_transactions)} for name in names], f)
+        for i, name in enumerate(names):
+            table = models[name]._table
+            if table is not None:
+                tables[f'start_{i}'] = np.datetime64(table[0], 'D')
+                tables[f'total_{i}'] = table[1]
+                tables[f'fraud_{i}'] = table[2]
+        np.savez(os.path.join(artifact_folder, 'tables.npz'), **tables)
+
+        manifest = {'format': Forecast_Model.artifact_format,
+                    'fingerprint': fingerprint,
+                    'segment_col': segment_col,
+                    'models': names,
+                    'horizon_days': [models[name].horizon_days for name in names],
+                    'prophet_version': prophet.__version__,
+                    'created': datetime.now().isoformat(timespec='seconds')}
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    @staticmethod
+    def load_all(artifact_folder, horizon_days=730):
+        """ Load the models saved as an artifact folder
+
+        The forecast tables are loaded along with the models. When they were computed for another horizon they
+        are forecast again
+
+        Parameters
+        ----------
+        artifact_folder : str
+            The folder the artifact was saved in
+        horizon_days : int
+            The number of days after the last training date that are forecast up front
+
+        Returns
+        -------
+        models
+            The Forecast_Model ready to predict by name, None for the model of all the transactions
+        manifest
+            The manifest of the artifact
+        """
+        manifest = Forecast_Model.read_manifest(artifact_folder)
+        if manifest is None:
+            raise FileNotFoundError(f'No model artifact in {artifact_folder}')
+        if manifest['format'] != Forecast_Model.artifact_format:
+            raise ValueError(f"Model artifact format {manifest['format']} is not supported")
+        if manifest['prophet_version'] != prophet.__version__:
+            print(f"Model artifact was saved with prophet {manifest['prophet_version']} but {prophet.__version__} is installed")
+
+        with open(os.path.join(artifact_folder, 'models.json'), 'r') as f:
+            fitted = json.load(f)
+        tables = np.load(os.path.join(artifact_folder, 'tables.npz'))
+
+        models = {}
+        for i, (name, series) in enumerate(zip(manifest['models'], fitted)):
+            model = Forecast_Model(horizon_days)
+            model.model_total_transactions = model_from_json(series['total'])
+            model.model_fraud_transactions = model_from_json(series['fraud'])
+            if (f'start_{i}' in tables) and (manifest['horizon_days'][i] == horizon_days):
+                model._table = (pd.Timestamp(tables[f'start_{i}'][()]), tables[f'total_{i}'], tables[f'fraud_{i}'])
+            else:
+                model.precompute()
+            models[name] = model
+
+        return models, manifest
+
+    @staticmethod
+    def read_manifest(artifact_folder):
+        """ Read the manifest of an artifact folder
+
+        Parameters
+        ----------
+        artifact_folder : str
+            The folder to look in
+
+        Returns
+        -------
+        manifest
+            The manifest with the fingerprint of the history the models were trained on, None when the folder does 
+            not hold a complete artifact
+        """
+        try:
+            with open(os.path.join(artifact_folder, 'manifest.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def precompute(self):
+        """ Forecasts every day from the first training date up to horizon_days after the last one into the
+        forecast table
+
+        Returns
+        -------
+        days
+            The number of days in the forecast table
+        """
+        with self._extend_lock:
+            self._table = self._forecast(self._table_dates(self.model_total_transactions.history['ds']))
+
+        return len(self._table[1])
+
+    def _table_dates(self, history):
+        """ Every day from the first training date up to horizon_days after the last one
+        """
+        start = history.min().normalize()
+        end = history.max().normalize() + pd.Timedelta(days=self.horizon_days)
+
+        return pd.date_range(start, end, freq='D')
+
     def predict(self, future_date_str):
-        """ Predict whether the transaction is fraud depending on the transaction details
+        """ Forecast of the total and fraudulent transactions of a date, looked up in the forecast table
 
         Parameters
         ----------
         future_date : str
-            Future Date provided
+            Future Date provided in YYYY-MM-DD format
+
+        Returns
+        -------
+        forecast
+            The tuple of the total and fraudulent transactions forecast for the date
+        """
+        try:
+            future_date = pd.Timestamp(datetime.strptime(future_date_str, '%Y-%m-%d'))
+        except (TypeError, ValueError):
+            raise ValueError(f'Forecast date {future_date_str} is not a date in YYYY-MM-DD format')
+
+        # Look the date up in the table as it is now, extending the table when the date is outside of it
+        table = self._table
+        start, total, fraud = table if table is not None else self._extend(future_date)
+        index = (future_date - start).days
+        if (index < 0) or (index >= len(total)):
+            start, total, fraud = self._extend(future_date)
+            index = (future_date - start).days
+
+        return (float(total[index, 0]), float(fraud[index, 0]))
+
+    def predict_batch(self, future_date_strs):
+        """ Forecasts with uncertainty intervals of the total and fraudulent transactions of many dates at once
+
+        The dates in the forecast table are looked up together. The table is extended towards the earliest and
+        latest dates as for predict() and the dates still outside of it are forecast with one predict call per model
+
+        Parameters
+        ----------
+        future_date_strs : list
+            Future Dates provided in YYYY-MM-DD format
+
+        Returns
+        -------
+        future_dates
+            The dates as a DatetimeIndex in the same order
+        total_transactions
+            The array of total transactions forecast with one row per date and the columns of forecast_cols
+        fraud_transactions
+            The array of fraudulent transactions forecast with one row per date and the columns of forecast_cols
         """
-        future_date_df = pd.DataFrame({'ds':[future_date_str]})
-        future_date_df['ds'] = pd.to_datetime(future_date_df['ds'], format='%Y-%m-%d', errors='coerce')
+        try:
+            future_dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(future_date_strs, dtype=object), format='%Y-%m-%d'))
+        except (TypeError, ValueError):
+            future_dates = None
+        if (future_dates is None) or future_dates.hasnans:
+            raise ValueError('Forecast dates need to be dates in YYYY-MM-DD format')
+        if len(future_dates) == 0:
+            return future_dates, np.empty((0, len(Forecast_Model.forecast_cols))), np.empty((0, len(Forecast_Model.forecast_cols)))
+
+        # Extend the table towards the earliest and latest dates within horizon_days of it, which covers the dates in
+        # between as well
+        if self._table is None:
+            self._extend(future_dates[0])
+        start, total, _ = self._table
+        horizon = pd.Timedelta(days=self.horizon_days)
+        end = start + pd.Timedelta(days=len(total) - 1)
+        near_dates = future_dates[(future_dates >= start - horizon) & (future_dates <= end + horizon)]
+        if len(near_dates) > 0:
+            if near_dates.min() < start:
+                self._extend(near_dates.min())
+            if near_dates.max() > end:
+                self._extend(near_dates.max())
+
+        # Look up the dates in the table together
+        start, total, fraud = self._table
+        index = (future_dates - start).days.to_numpy()
+        in_table = (index >= 0) & (index < len(total))
+        total_transactions = np.empty((len(future_dates), total.shape[1]))
+        fraud_transactions = np.empty((len(future_dates), fraud.shape[1]))
+        total_transactions[in_table] = total[index[in_table]]
+        fraud_transactions[in_table] = fraud[index[in_table]]
+
+        # Forecast the dates too far away for the table together. Prophet sorts the dates it predicts so every
+        # distinct date is predicted once in order and the forecasts are put back in the order of the request
+        if not in_table.all():
+            far_dates = future_dates[~in_table]
+            distinct_dates = far_dates.unique().sort_values()
+            _, far_total, far_fraud = self._forecast(distinct_dates)
+            position = distinct_dates.get_indexer(far_dates)
+            total_transactions[~in_table] = far_total[position]
+            fraud_transactions[~in_table] = far_fraud[position]
+
+        return future_dates, total_transactions, fraud_transactions
+
+    def _extend(self, future_date):
+        """ Extends the forecast table to cover the date and returns it, growing it by at least horizon_days at a time
+        so that dates asked for next are most likely covered too. A date more than horizon_days away from the table
+        is forecast on its own without extending the table, so that one request cannot make it grow without bound
+        """
+        with self._extend_lock:
+            # Another request may have extended the table while we were waiting for the lock
+            if self._table is None:
+                self._table = self._forecast(pd.date_range(future_date, periods=self.horizon_days + 1, freq='D'))
+                return self._table
+
+            start, total, fraud = self._table
+            end = start + pd.Timedelta(days=len(total) - 1)
+            if start <= future_date <= end:
+                return self._table
+
+            if (future_date < start - pd.Timedelta(days=self.horizon_days)) or (future_date > end + pd.Timedelta(days=self.horizon_days)):
+                return self._forecast(pd.DatetimeIndex([future_date]))
+
+            # Only the missing days are forecast, the rest of the table is kept as it is
+            if future_date < start:
+                new_start = start - pd.Timedelta(days=self.horizon_days)
+                _, new_total, new_fraud = self._forecast(pd.date_range(new_start, start - pd.Timedelta(days=1), freq='D'))
+                self._table = (new_start, np.concatenate([new_total, total]), np.concatenate([new_fraud, fraud]))
+            else:
+                new_end = end + pd.Timedelta(days=self.horizon_days)
+                _, new_total, new_fraud = self._forecast(pd.date_range(end + pd.Timedelta(days=1), new_end, freq='D'))
+                self._table = (start, np.concatenate([total, new_total]), np.concatenate([fraud, new_fraud]))
+
+            return self._table
+
+    def _forecast(self, future_dates):
+        """ Forecasts the dates with one predict call per model
+
+        Returns
+        -------
+        table
+            The tuple of the first date and the arrays of total and fraudulent transactions forecast for every date,
+            one row per date with the columns of forecast_cols
+        """
+        future_dates_df = pd.DataFrame({'ds': future_dates})
+
+        total_transactions = self.model_total_transactions.predict(future_dates_df)
+        fraud_transactions = self.model_fraud_transactions.predict(future_dates_df)
+
+        return (future_dates[0], total_transactions[Forecast_Model.forecast_cols].to_numpy(dtype=np.float64),
+                fraud_transactions[Forecast_Model.forecast_cols].to_numpy(dtype=np.float64))
+
+def _fit_series(series_df, future_dates=None):
+    """ Fits a Prophet model to a series in a worker process and forecasts the dates when there are any
+
+    Returns
+    -------
+    fitted
+        The tuple of the fitted model in the JSON format of Prophet and the array of the forecast with one row per date
+        and the columns of forecast_cols (None without dates)
+    """
+    model = Prophet()
+    model.fit(series_df)
 
-        total_transactions = self.model_total_transactions.predict(future_date_df)
-        fraud_transactions = self.model_fraud_transactions.predict(future_date_df)
+    forecast = None
+    if future_dates is not None:
+        forecast = model.predict(pd.DataFrame({'ds': future_dates}))[Forecast_Model.forecast_cols].to_numpy(dtype=np.float64)
 
-        return (total_transactions['yhat'].values[0], fraud_transactions['yhat'].values[0])
\ No newline at end of file
+    return (model_to_json(model), forecast)
@@ -0,0 +1,15 @@
+import forecast_service
+
+"""
+Entry point for serving the Forecast Service with gunicorn (see gunicorn.conf.py)
+
+    python -m gunicorn -c gunicorn.conf.py wsgi:app
+
+The service is initialized from the environment variables (data-folder, training-data-file) when gunicorn loads 
+this module in the master process, so the workers forked afterwards share the model
+"""
+
+# Train the model once for all workers
+forecast_service.initialize([])
+
+app = forecast_service.app
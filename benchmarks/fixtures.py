@@ -0,0 +1,185 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from services import REPO_FOLDER
+
+class Fixtures:
+    """
+    A class used to write the local data every service is started with by the load test
+
+    The data is synthetic but has the columns and types of the real training data so the services run their full
+    startup (ETL, training) on it. Every service gets its own folder since the services cache their transformed
+    data next to it. The data is only written when missing and the same seed always writes the same data, so
+    results stay comparable between commits. The data is written to a new folder whenever version changes
+
+    ...
+
+    Attributes
+    ----------
+    folder : str
+        the folder holding the data of every service
+    rows : int
+        the number of transactions, and a tenth of it the number of reviews
+    seed : int
+        the seed of the random data
+    version : int
+        the version of the generated data, bump it whenever the data changes so that it is written again
+    yolo_weights : str
+        the yolov3.weights file of the object detection network, which cannot be generated
+
+    Methods
+    -------
+    prepare()
+        Writes the data of a service when missing and provides its command line arguments
+    transactions()
+        Provides synthetic credit card transactions
+    reviews()
+        Provides synthetic movie reviews
+    """
+    categories = ['misc_net', 'grocery_pos', 'entertainment', 'gas_transport', 'misc_pos', 'grocery_net',
+                  'shopping_net', 'shopping_pos', 'food_dining', 'personal_care', 'health_fitness', 'travel',
+                  'kids_pets', 'home']
+    version = 2
+
+    def __init__(self, folder, rows=20000, seed=0, yolo_weights=None):
+        """ Initializes the Fixtures
+
+        Parameters
+        ----------
+        folder : str
+            The folder holding the data of every service
+        rows : int
+            The number of transactions, and a tenth of it the number of reviews
+        seed : int
+            The seed of the random data
+        yolo_weights : str
+            The yolov3.weights file of the object detection network
+
+        """
+        self.folder = folder
+        self.rows = rows
+        self.seed = seed
+        self.yolo_weights = yolo_weights
+
+    def prepare(self, service):
+        """ Writes the data of the service when missing
+
+        Parameters
+        ----------
+        service : str
+            The name of the service as in benchmarks/services.py
+
+        Returns
+        -------
+        service_args
+            The command line arguments of the service, the data folder first
+        """
+        data_folder = os.path.join(self.folder, f'{service}-{self.rows}-{self.seed}-v{Fixtures.version}') + os.sep
+        os.makedirs(data_folder, exist_ok=True)
+
+        if service in ['fraud', 'forecast']:
+            if not os.path.exists(data_folder + 'transactions.csv'):
+                self.transactions().to_csv(data_folder + 'transactions.csv')
+            return [data_folder, 'transactions.csv']
+
+        if service == 'sentiment':
+            if not os.path.exists(data_folder + 'reviews.csv'):
+                self.reviews().to_csv(data_folder + 'reviews.csv')
+            return [data_folder, 'reviews.csv']
+
+        if service == 'email':
+            # Without the source files the service falls back to the preprocessed campaign data
+            shutil.copyfile(os.path.join(REPO_FOLDER, 'reinforcement-learning', 'email_campaign_data.csv'),
+                            data_folder + 'email_campaign_data.csv')
+            return [data_folder, 'sent_emails.csv', 'responded.csv', 'userbase.csv']
+
+        if service == 'object-detection':
+            if (self.yolo_weights is None) or (not os.path.exists(self.yolo_weights)):
+                raise FileNotFoundError('Object detection needs yolov3.weights, pass it with --yolo-weights')
+            shutil.copyfile(os.path.join(REPO_FOLDER, 'cvbasicsAssignment-main', 'yolov3.cfg'), data_folder + 'yolov3.cfg')
+            if not os.path.exists(data_folder + 'yolov3.weights'):
+                os.symlink(os.path.abspath(self.yolo_weights), data_folder + 'yolov3.weights')
+            return [data_folder]
+
+        raise ValueError(f'Unknown service {service}')
+
+    def transactions(self):
+        """ Provides synthetic credit card transactions over two years, the columns of the fraud training data
+        along with the trans_date of the forecasting data
+
+        Returns
+        -------
+        transactions_df
+            The dataset (Pandas Dataframe) of transactions in time order
+        """
+        rng = np.random.default_rng(self.seed)
+        n = self.rows
+        n_cards = max(n // 40, 1)
+
+        # Every card has its own customer, home location and job
+        card = rng.integers(0, n_cards, n)
+        card_lat = rng.uniform(25, 48, n_cards).round(4)
+        card_long = rng.uniform(-123, -70, n_cards).round(4)
+        card_dob = pd.to_datetime(rng.integers(pd.Timestamp('1940-01-01').value // 10**9,
+                                               pd.Timestamp('2002-01-01').value // 10**9, n_cards), unit='s')
+        card_job = np.array([f'Job {j}' for j in rng.integers(0, 400, n_cards)])
+        card_sex = rng.choice(['F', 'M'], n_cards)
+
+        txn_time = pd.Timestamp('2019-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 3600 * 24 * 730, n)), unit='s')
+        amt = rng.gamma(2, 40, n).round(2)
+
+        transactions_df = pd.DataFrame({
+            'trans_date_trans_time': txn_time.strftime('%Y-%m-%d %H:%M:%S'),
+            'cc_num': 4000000000000000 + card,
+            'merchant': ['fraud_Merchant ' + str(m) for m in rng.integers(0, 700, n)],
+            'category': rng.choice(Fixtures.categories, n),
+            'amt': amt,
+            'first': 'John',
+            'last': 'Doe',
+            'sex': card_sex[card],
+            'street': '57636 Russet Ln',
+            'city': 'South Lyon',
+            'state': rng.choice(['MI', 'TX', 'NY', 'CA', 'PA'], n_cards)[card],
+            'zip': 48122,
+            'lat': card_lat[card],
+            'long': card_long[card],
+            'city_pop': rng.integers(100, 2000000, n_cards)[card],
+            'job': card_job[card],
+            'dob': card_dob.strftime('%Y-%m-%d').values[card],
+            'trans_num': [f'{i:032x}' for i in range(n)],
+            'unix_time': (txn_time - pd.Timestamp(0)) // pd.Timedelta(seconds=1),
+            'merch_lat': (card_lat[card] + rng.normal(0, 0.5, n)).round(6),
+            'merch_long': (card_long[card] + rng.normal(0, 0.5, n)).round(6),
+        })
+
+        # Large amounts are more often fraudulent
+        transactions_df['is_fraud'] = (((amt > 200) & (rng.random(n) < 0.3)) | (rng.random(n) < 0.003)).astype(int)
+        transactions_df['trans_date'] = txn_time.strftime('%Y-%m-%d')
+
+        return transactions_df
+
+    def reviews(self):
+        """ Provides synthetic movie reviews with the columns of the review training data
+
+        Returns
+        -------
+        reviews_df
+            The dataset (Pandas Dataframe) of reviews
+        """
+        rng = np.random.default_rng(self.seed)
+        n = max(self.rows // 10, 10)
+        rating = rng.integers(1, 6, n)
+        opinions = {1: 'It was a waste of time', 2: 'I did not like it much', 3: 'It was OK',
+                    4: 'I liked it and would watch it again', 5: 'I loved it, a wonderful movie'}
+
+        return pd.DataFrame({
+            'rating': rating,
+            'title': [opinions[r].split(',')[0] for r in rating],
+            'text': [f'{opinions[r]}. The story and the acting were as expected for review {i}.'
+                     for i, r in enumerate(rating)],
+            'categories': "['Movies & TV', 'Featured Categories']",
+            'details': "{'Content advisory': ['Violence'], 'Genre': ['Drama']}",
+            'verified_purchase': True,
+        })
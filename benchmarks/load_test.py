@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+import numpy as np
+from datetime import datetime
+
+from services import REPO_FOLDER, SERVICES, build_request, free_port, start_service, wait_until_ready, \
+    stop_service, memory_usage
+from fixtures import Fixtures
+
+"""
+Load test of the REST endpoints of every service
+
+Every service is started with gunicorn against local fixture data (see fixtures.py) and driven by concurrent
+clients, each sending its next request as soon as it gets the response to the previous one. For every concurrency
+the throughput, the latency percentiles, the errors and the memory of the service processes are reported. The
+results are saved as JSON along with the git commit so that two commits can be compared
+
+Usage
+-----
+python benchmarks/load_test.py run [--services fraud,email] [--concurrency 1,8,32] [--duration 10] [--output <file>]
+python benchmarks/load_test.py compare <baseline results> <candidate results> [--tolerance 0.1]
+
+The results are saved to benchmarks/results/<commit>.json unless --output is given. compare exits with 1 when the
+throughput drops or the p95/p99 latency grows by more than the tolerance for any service and concurrency
+"""
+
+class Load_Test:
+    """
+    A class used to load test the services and compare the results between commits
+
+    ...
+
+    Attributes
+    ----------
+    concurrency : list
+        the numbers of concurrent clients every service is driven with
+    duration : float
+        the seconds every concurrency is measured for
+    warmup : float
+        the seconds every concurrency is driven for before measuring
+    workers : int
+        the number of gunicorn worker processes
+    threads : int
+        the number of threads of every worker
+    startup_timeout : float
+        the seconds a service may take to load its data and model
+
+    Methods
+    -------
+    run()
+        Starts a service and measures it at every concurrency
+    drive()
+        Sends requests from concurrent clients and measures their latency
+    compare()
+        Compares the results of two commits
+    """
+    percentiles = [50, 95, 99]
+
+    def __init__(self, concurrency=None, duration=10.0, warmup=2.0, workers=1, threads=4, startup_timeout=900.0):
+        """ Initializes the Load Test
+
+        Parameters
+        ----------
+        concurrency : list
+            The numbers of concurrent clients every service is driven with, 1, 8 and 32 by default
+        duration : float
+            The seconds every concurrency is measured for
+        warmup : float
+            The seconds every concurrency is driven for before measuring
+        workers : int
+            The number of gunicorn worker processes
+        threads : int
+            The number of threads of every worker
+        startup_timeout : float
+            The seconds a service may take to load its data and model
+
+        """
+        self.concurrency = concurrency if concurrency is not None else [1, 8, 32]
+        self.duration = duration
+        self.warmup = warmup
+        self.workers = workers
+        self.threads = threads
+        self.startup_timeout = startup_timeout
+
+    def run(self, service, service_args):
+        """ Starts the service, measures it at every concurrency and stops it
+
+        Parameters
+        ----------
+        service : str
+            The name of the service as in benchmarks/services.py
+        service_args : list
+            The command line arguments of the service
+
+        Returns
+        -------
+        result
+            Dictionary with the startup time, the idle memory and the measurements by concurrency
+        """
+        request = build_request(service)
+        port = free_port()
+        log_path = os.path.join(tempfile.gettempdir(), f'load_test_{service}.log')
+
+        with open(log_path, 'w') as log_file:
+            start = time.perf_counter()
+            process = start_service(service, service_args, self.workers, self.threads, port, log_file)
+            try:
+                wait_until_ready(process, port, self.startup_timeout)
+                result = {'endpoint': f'{request[0]} {request[1]}',
+                          'startup_seconds': time.perf_counter() - start,
+                          'idle_memory': memory_usage(process.pid),
+                          'concurrency': {}}
+
+                for clients in self.concurrency:
+                    self.drive(port, request, clients, self.warmup)
+                    result['concurrency'][str(clients)] = self.drive(port, request, clients, self.duration, process.pid)
+            except RuntimeError as e:
+                raise RuntimeError(f'{e}, see {log_path}')
+            finally:
+                stop_service(process)
+
+        return result
+
+    def drive(self, port, request, clients, duration, pid=None):
+        """ Sends requests from concurrent clients for the duration, every client reusing one connection. The
+        memory of the service is sampled meanwhile
+
+        Parameters
+        ----------
+        port : int
+            The port of the service
+        request : tuple
+            The method, path, body and headers of the request
+        clients : int
+            The number of concurrent clients
+        duration : float
+            The seconds to send requests for
+        pid : int
+            The gunicorn master whose memory is sampled, none to skip sampling
+
+        Returns
+        -------
+        measurement
+            Dictionary with requests, errors, throughput, the latency percentiles and mean in ms, and the peak memory
+        """
+        method, path, body, headers = request
+        latencies = [[] for _ in range(clients)]
+        errors = [0] * clients
+        stop = time.perf_counter() + duration
+
+        def client(k):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            while time.perf_counter() < stop:
+                sent = time.perf_counter()
+                try:
+                    connection.request(method, path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status == 200:
+                        latencies[k].append(time.perf_counter() - sent)
+                    else:
+                        errors[k] += 1
+                except (OSError, http.client.HTTPException):
+                    errors[k] += 1
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.close()
+
+        # Sample the memory of the service while it serves the requests
+        peak = {'rss_mb': 0.0, 'pss_mb': 0.0}
+        def sample():
+            while time.perf_counter() < stop:
+                usage = memory_usage(pid)
+                for key in peak:
+                    peak[key] = max(peak[key], usage[key])
+                time.sleep(0.25)
+
+        threads = [threading.Thread(target=client, args=(k,)) for k in range(clients)]
+        if pid is not None:
+            threads.append(threading.Thread(target=sample))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        latency_ms = np.concatenate([np.asarray(l) for l in latencies]) * 1000
+        measurement = {'requests': int(latency_ms.size), 'errors': sum(errors), 'throughput': latency_ms.size / elapsed}
+        for p, value in zip(Load_Test.percentiles, np.percentile(latency_ms, Load_Test.percentiles)
+                            if latency_ms.size > 0 else [None] * len(Load_Test.percentiles)):
+            measurement[f'p{p}_ms'] = None if value is None else float(value)
+        measurement['mean_ms'] = float(latency_ms.mean()) if latency_ms.size > 0 else None
+        measurement['peak_memory'] = peak
+
+        return measurement
+
+    @staticmethod
+    def compare(baseline, candidate, tolerance=0.1):
+        """ Compares the results of two commits for every service and concurrency found in both
+
+        Parameters
+        ----------
+        baseline : dict
+            The results of the earlier commit
+        candidate : dict
+            The results of the later commit
+        tolerance : float
+            The relative change in throughput, p95 or p99 latency tolerated before it is a regression
+
+        Returns
+        -------
+        rows
+            List of dictionaries with service, concurrency, the baseline and candidate values, their change and
+            whether it is a regression
+        """
+        rows = []
+        for service, result in candidate['services'].items():
+            base_result = baseline['services'].get(service)
+            if (base_result is None) or ('concurrency' not in base_result) or ('concurrency' not in result):
+                continue
+
+            for clients, measurement in result['concurrency'].items():
+                base = base_result['concurrency'].get(clients)
+                if base is None:
+                    continue
+
+                # Higher is better for the throughput, lower for the latency
+                for metric, higher_is_better in [('throughput', True), ('p50_ms', False), ('p95_ms', False),
+                                                 ('p99_ms', False), ('peak_memory', False)]:
+                    before, after = base[metric], measurement[metric]
+                    if metric == 'peak_memory':
+                        metric, before, after = 'peak_rss_mb', before['rss_mb'], after['rss_mb']
+                    if (before is None) or (after is None) or (before == 0):
+                        continue
+
+                    change = (after - before) / before
+                    regression = (metric in ['throughput', 'p95_ms', 'p99_ms']) and \
+                                 ((-change if higher_is_better else change) > tolerance)
+                    rows.append({'service': service, 'concurrency': int(clients), 'metric': metric,
+                                 'baseline': before, 'candidate': after, 'change': change, 'regression': regression})
+
+        return rows
+
+def git_commit():
+    """ Returns the commit checked out and whether the tree has uncommitted changes
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_FOLDER, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_FOLDER,
+                               capture_output=True, text=True, check=True).stdout.strip() != ''
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+def run(args):
+    """ Load tests the services and saves the results
+    """
+    load_test = Load_Test([int(c) for c in args.concurrency.split(',')], args.duration, args.warmup,
+                          args.workers, args.threads, args.startup_timeout)
+    fixtures = Fixtures(args.fixture_folder, args.rows, args.seed, args.yolo_weights)
+    commit, dirty = git_commit()
+
+    results = {'commit': commit,
+               'dirty': dirty,
+               'created_at': datetime.now().isoformat(timespec='seconds'),
+               'machine': {'cpus': os.cpu_count(), 'platform': platform.platform(), 'python': platform.python_version()},
+               'settings': {'concurrency': load_test.concurrency, 'duration': load_test.duration,
+                            'warmup': load_test.warmup, 'workers': load_test.workers, 'threads': load_test.threads,
+                            'rows': args.rows, 'seed': args.seed},
+               'services': {}}
+
+    print(f'{"service":<17} {"clients":>7} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>6} '
+          f'{"RSS MB":>8} {"PSS MB":>8}')
+    for service in args.services.split(','):
+        # A service that cannot start is reported and the others still run
+        try:
+            service_args = fixtures.prepare(service)
+            result = load_test.run(service, service_args)
+        except (RuntimeError, FileNotFoundError) as e:
+            results['services'][service] = {'error': str(e)}
+            print(f'{service:<17} skipped: {e}')
+            continue
+
+        results['services'][service] = result
+        for clients, m in result['concurrency'].items():
+            print(f'{service:<17} {clients:>7} {m["throughput"]:>9,.1f} {m["p50_ms"] or 0:>8.2f} {m["p95_ms"] or 0:>8.2f} '
+                  f'{m["p99_ms"] or 0:>8.2f} {m["errors"]:>6} {m["peak_memory"]["rss_mb"]:>8.0f} '
+                  f'{m["peak_memory"]["pss_mb"]:>8.0f}')
+
+    output = args.output or os.path.join(REPO_FOLDER, 'benchmarks', 'results', f'{commit[:12]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results of commit {commit[:12]}{" with uncommitted changes" if dirty else ""} written to {output}')
+
+def compare(args):
+    """ Prints the changes between two results and returns 1 when any of them is a regression
+    """
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f'Baseline {baseline["commit"][:12]} vs candidate {candidate["commit"][:12]}, '
+          f'tolerance {args.tolerance:.0%}')
+    if baseline.get('settings') != candidate.get('settings') or baseline.get('machine') != candidate.get('machine'):
+        print('Warning: the results were measured with different settings or on different machines')
+
+    rows = Load_Test.compare(baseline, candidate, args.tolerance)
+    print(f'{"service":<17} {"clients":>7} {"metric":<12} {"baseline":>10} {"candidate":>10} {"change":>8}')
+    for row in rows:
+        print(f'{row["service"]:<17} {row["concurrency"]:>7} {row["metric"]:<12} {row["baseline"]:>10.2f} '
+              f'{row["candidate"]:>10.2f} {row["change"]:>+8.1%}{"  REGRESSION" if row["regression"] else ""}')
+
+    regressions = sum(row['regression'] for row in rows)
+    print(f'{regressions} regressions')
+    return 1 if regressions > 0 else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test of the REST endpoints of the services')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='load test the services and save the results')
+    run_parser.add_argument('--services', default=','.join(SERVICES), help='comma separated services')
+    run_parser.add_argument('--concurrency', default='1,8,32', help='comma separated numbers of concurrent clients')
+    run_parser.add_argument('--duration', type=float, default=10.0)
+    run_parser.add_argument('--warmup', type=float, default=2.0)
+    run_parser.add_argument('--workers', type=int, default=1)
+    run_parser.add_argument('--threads', type=int, default=4)
+    run_parser.add_argument('--startup-timeout', type=float, default=900.0)
+    run_parser.add_argument('--fixture-folder', default=os.path.join(tempfile.gettempdir(), 'load-test-fixtures'))
+    run_parser.add_argument('--rows', type=int, default=20000)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--yolo-weights', default=os.environ.get('yolo-weights'))
+    run_parser.add_argument('--output')
+
+    compare_parser = commands.add_parser('compare', help='compare the results of two commits')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import http.client
+
+"""
+The services as the benchmarks see them: how to start each one with gunicorn, the request sent to it and the memory
+used by its processes
+"""
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_TRANSACTION = {"trans_date_trans_time": "2019-01-01 00:00:18", "cc_num": "2703186189652095",
+                      "merchant": "fraud_Rippin, Kub and Mann", "category": "misc_net", "amt": 4.97,
+                      "first": "John", "last": "Doe", "sex": "F", "street": "57636 Russet Ln", "city": "South Lyon",
+                      "state": "MI", "zip": "48122", "lat": 36.079, "long": -81.178, "city_pop": 2309,
+                      "job": "Psychologist, counselling", "dob": "1988-03-09",
+                      "trans_num": "0b242abb623afc578575680df30655b9", "unix_time": 1325376018,
+                      "merch_lat": 36.011, "merch_long": -82.048}
+
+# Folder, environment variables taking the command line args in order, and the request sent to every service
+SERVICES = {
+    'fraud': {'folder': 'fraud-detection',
+              'env': ['data-folder', 'training-data-file'],
+              'request': ('POST', '/detect-fraud', SAMPLE_TRANSACTION)},
+    'forecast': {'folder': 'TimeSeries',
+                 'env': ['data-folder', 'training-data-file'],
+                 'request': ('POST', '/fraud-forecast', {"forecast_date": "2019-01-01"})},
+    'sentiment': {'folder': 'sentiment-analysis',
+                  'env': ['data-folder', 'training-data-file'],
+                  'request': ('POST', '/get-sentiment', {"reviews": ["I loved it", "I did not like it", "It was OK"]})},
+    'email': {'folder': 'reinforcement-learning',
+              'env': ['data-folder', 'sent-emails-file', 'responded-emails-file', 'customers-file'],
+              'request': ('POST', '/get-next-action', {"state": [1, 0, 0, 0, 0, 0, 0], "action": 0})},
+    'object-detection': {'folder': 'cvbasicsAssignment-main',
+                         'env': ['data-folder'],
+                         'request': ('IMAGE', '/detect', 'Pictures/')},
+}
+
+def build_request(service):
+    """ Returns the method, path, body and headers of the request sent to the service
+    """
+    method, path, payload = SERVICES[service]['request']
+    if method != 'IMAGE':
+        return method, path, json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+
+    # Upload the first picture of the service folder as a multipart form
+    picture_folder = os.path.join(REPO_FOLDER, SERVICES[service]['folder'], payload)
+    picture = sorted(os.listdir(picture_folder))[0]
+    with open(os.path.join(picture_folder, picture), 'rb') as f:
+        content = f.read()
+    boundary = 'benchmark-boundary'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="imagefile"; filename="{picture}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return 'POST', path, body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+def free_port():
+    """ Returns a port nothing listens on
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_service(service, service_args, workers, threads, port, log_file):
+    """ Starts the service with gunicorn, its output going to the log file
+
+    Returns
+    -------
+    process
+        The gunicorn master process
+    """
+    env = dict(os.environ)
+    env.update(zip(SERVICES[service]['env'], service_args))
+    env.update({'workers': str(workers), 'threads': str(threads), 'port': str(port)})
+
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                               cwd=os.path.join(REPO_FOLDER, SERVICES[service]['folder']), env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    return process
+
+def wait_until_ready(process, port, timeout):
+    """ Waits until the service takes requests, it loads its data and model first
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Service exited with code {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f'Service not ready after {timeout} s')
+
+def stop_service(process):
+    """ Stops the gunicorn master along with its workers
+    """
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def process_tree(pid):
+    """ Returns the pid of the process and of all of its descendants
+    """
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The parent pid follows the command name, which is in parentheses and may hold spaces
+                    parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+
+    tree = [pid]
+    for current in tree:
+        tree.extend(child for child, parent in parents.items() if parent == current)
+    return tree
+
+def memory_usage(pid):
+    """ Returns the memory of the process and its descendants (the gunicorn master and its workers) in MB
+
+    The RSS counts the pages the workers share with the master once per process, the PSS splits every shared page
+    between the processes sharing it so it is the memory the service actually takes. The PSS is 0 where
+    /proc/<pid>/smaps_rollup is not available
+
+    Returns
+    -------
+    memory
+        Dictionary with rss_mb and pss_mb
+    """
+    rss = pss = 0
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/status') as f:
+                rss += sum(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+            with open(f'/proc/{member}/smaps_rollup') as f:
+                pss += sum(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        except OSError:
+            pass
+
+    return {'rss_mb': rss / 1024, 'pss_mb': pss / 1024}
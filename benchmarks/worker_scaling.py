@@ -0,0 +1,101 @@
+import os
+import time
+import argparse
+import tempfile
+import threading
+import http.client
+
+from services import SERVICES, build_request, free_port, start_service, wait_until_ready, stop_service
+
+"""
+Throughput of the services under gunicorn as the number of worker processes grows
+
+Every service is started with gunicorn (see gunicorn.conf.py in its folder) once per worker count, driven with
+concurrent requests for a fixed duration and stopped again. Ideally the requests per second grow linearly with
+the workers up to the number of cores, the efficiency column shows how close each worker count gets to that
+
+Usage
+-----
+python benchmarks/worker_scaling.py <service> <service args> [--workers 1,2,4] [--threads 4] [--concurrency 16] [--duration 10]
+
+The service args are the ones of the service's own command line, for example
+
+python benchmarks/worker_scaling.py fraud /data/ transactions-1.csv
+python benchmarks/worker_scaling.py forecast /data/ CreditCardFraudFourYears.csv
+python benchmarks/worker_scaling.py sentiment /data/ amazon_movie_reviews.csv
+python benchmarks/worker_scaling.py email /data/ sent_emails.csv responded.csv userbase.csv
+python benchmarks/worker_scaling.py object-detection /data/
+"""
+
+def drive(port, request, concurrency, duration):
+    """ Sends requests from concurrent clients for the duration, every client reusing one connection
+
+    Returns
+    -------
+    completed
+        The number of successful responses
+    errors
+        The number of failed requests
+    elapsed
+        The elapsed time in seconds
+    """
+    method, path, body, headers = request
+    counts = [[0, 0] for _ in range(concurrency)]
+    stop = time.perf_counter() + duration
+
+    def client(count):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while time.perf_counter() < stop:
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                count[0 if response.status == 200 else 1] += 1
+            except (OSError, http.client.HTTPException):
+                count[1] += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        connection.close()
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(count,)) for count in counts]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    return sum(count[0] for count in counts), sum(count[1] for count in counts), time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Throughput of a service under gunicorn by number of workers')
+    parser.add_argument('service', choices=list(SERVICES))
+    parser.add_argument('service_args', nargs='*')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--startup-timeout', type=float, default=900.0)
+    args = parser.parse_args()
+
+    request = build_request(args.service)
+    print(f'{args.service}: {request[0]} {request[1]} with {args.concurrency} clients for {args.duration:.0f} s, '
+          f'{args.threads} threads per worker on {os.cpu_count()} CPUs')
+    print(f'{"workers":>8} {"req/s":>10} {"req/s/worker":>13} {"efficiency":>11} {"errors":>7}')
+
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        port = free_port()
+        with open(os.path.join(tempfile.gettempdir(), f'{args.service}_{workers}_workers.log'), 'w') as log_file:
+            process = start_service(args.service, args.service_args, workers, args.threads, port, log_file)
+            try:
+                wait_until_ready(process, port, args.startup_timeout)
+                drive(port, request, args.concurrency, args.warmup)
+                completed, errors, elapsed = drive(port, request, args.concurrency, args.duration)
+            finally:
+                stop_service(process)
+
+        throughput = completed / elapsed
+        baseline = baseline if baseline is not None else throughput / workers
+        print(f'{workers:>8} {throughput:>10,.1f} {throughput / workers:>13,.1f} '
+              f'{throughput / (baseline * workers):>11.0%} {errors:>7}')
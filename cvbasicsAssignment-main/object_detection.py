@@ -1,5 +1,6 @@
 import cv2 as cv
 import numpy as np
+from instrumentation import instrumentation
 
 class ObjectDetection:
     def __init__(self, base_dir = '', confidence_threshold=0.5, box_threshold = 0.4, scaling_factor = 1/255):
@@ -111,14 +112,16 @@ class ObjectDetection:
             Array of confidences found through the object detection                        
         """
         # Load the image
-        img = cv.imread(self.base_dir + image_name)
+        with instrumentation.span('feature_transform'):
+            img = cv.imread(self.base_dir + image_name)
 
-        # Provide image to model 
-        blob = cv.dnn.blobFromImage(img, self.scaling_factor , (self.width, self.height), True, False)  
+            # Provide image to model 
+            blob = cv.dnn.blobFromImage(img, self.scaling_factor , (self.width, self.height), True, False)  
 
         # Detect objects
-        self.net.setInput(blob)
-        outs = self.net.forward(self.output_layer)
+        with instrumentation.span('inference'):
+            self.net.setInput(blob)
+            outs = self.net.forward(self.output_layer)
 
         # Initialize arrays for class ids (object class ids), confidence for each and box values to print in the image
         class_ids = []
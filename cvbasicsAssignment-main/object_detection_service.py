@@ -1,33 +1,73 @@
 from flask import Flask
-from flask import request, jsonify
+from flask import request, jsonify, Response
 import sys
 import os
 
 from object_detection import ObjectDetection
+from instrumentation import instrumentation
 
 app = Flask(__name__)
 
+# Time every request by endpoint when the instrumentation environment variable is set
+instrumentation.instrument_app(app)
+
 # Use postman to generate the post with a graphic of your choice
 
 @app.route('/detect', methods=['POST'])
 def detection():
-    imagefile = request.files.get('imagefile', '')
-    print("Image: ", imagefile.filename)
-    ot.save_source_image(imagefile.filename, imagefile)
+    with instrumentation.span('image_upload'):
+        imagefile = request.files.get('imagefile', '')
+        print("Image: ", imagefile.filename)
+        ot.save_source_image(imagefile.filename, imagefile)
 
     # The file is now downloaded and available to use with your detection class
-    return ot.detect(imagefile.filename)
+    objects = ot.detect(imagefile.filename)
 
-if __name__ == "__main__":
-    flaskPort = 8786
+    with instrumentation.span('serialization'):
+        return jsonify(objects)
+
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    """ Provides the timings of the service in the Prometheus text format
+        
+    Returns
+    ----------
+    Histograms of the request latency by endpoint (http_request_duration_seconds) and of the time spent in every step 
+    of the hot path (span_duration_seconds) along with the requests by endpoint and status (http_requests_total). 
+    The spans are image_upload, feature_transform (reading the image into a blob), inference
+    and serialization. Status 404 when the instrumentation environment variable is not set. 
+    With several gunicorn workers every worker reports its own requests
+
+    """
+    if not instrumentation.enabled:
+        return jsonify({"error": "Instrumentation is disabled, set the instrumentation environment variable to true"}), 404
+
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+def initialize(args):
+    """ Initializes the Object Detection Service by loading the detection network
+
+    Parameters
+    ----------
+    args : list
+        The command line arguments without the script name, the environment variables are used when there are none
+    """
+    global ot
 
     # Get command line arguments
-    if (len(sys.argv)>1):
-        data_folder                 = sys.argv[1]
+    if (len(args)>0):
+        data_folder                 = args[0]
     else: 
         data_folder = os.environ['data-folder']
 
     ot = ObjectDetection(base_dir=data_folder)
+
+if __name__ == "__main__":
+    flaskPort = 8786
+
+    # Initialize the service from the command line arguments
+    initialize(sys.argv[1:])
+
     print('starting server...')
     app.run(host = '0.0.0.0', port = flaskPort)
 
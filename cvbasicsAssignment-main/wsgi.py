@@ -0,0 +1,15 @@
+import object_detection_service
+
+"""
+Entry point for serving the Object Detection Service with gunicorn (see gunicorn.conf.py)
+
+    python -m gunicorn -c gunicorn.conf.py wsgi:app
+
+The service is initialized from the environment variable data-folder when gunicorn loads this module in the master
+process, so the workers forked afterwards share the detection network
+"""
+
+# Load the detection network once for all workers
+object_detection_service.initialize([])
+
+app = object_detection_service.app
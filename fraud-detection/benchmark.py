@@ -0,0 +1,536 @@
+import sys
+import os
+import time
+import tempfile
+import resource
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from data_pipeline import ETL_Pipeline
+from cache import Feature_Cache
+from scipy import sparse
+from sklearn.metrics import average_precision_score
+from dataset import Fraud_Dataset, Sparse_Fraud_Dataset
+from model import Fraud_Detector_Model
+from metrics import Metrics, Metrics_Accumulator
+from geo_cache import Distance_Cache
+
+"""
+Benchmarks for the Fraud Detection pipeline and model
+
+Every benchmark runs either on a real transactions file or on synthetic transactions that follow the
+same schema, and prints the throughput or latency it measured
+
+Usage
+-----
+python benchmark.py <benchmark> [<data folder> <transactions file>]
+python benchmark.py <benchmark> [<number of synthetic rows>]
+python benchmark.py metrics [<number of labels>]
+python benchmark.py geo [<number of transactions>]
+
+Benchmarks
+----------
+transform
+    Row wise (apply) vs vectorized derived attributes in ETL_Pipeline.transform, including an equivalence check
+streaming
+    Peak memory and throughput of ETL_Pipeline.process reading the whole source vs streaming it in chunks
+cache
+    Time to load the transformed data from CSV vs from the columnar Feature_Cache
+engine
+    Single transaction latency and batch throughput of the Random Forest in sklearn vs compiled (Compiled_Forest)
+metrics
+    Separate sklearn metric calls vs Metrics.run and Metrics_Accumulator on synthetic label arrays (10M by default)
+geo
+    Distances computed for every row vs once per repeated location pair, in batch and for single transactions, 
+    at several repeat ratios (1M synthetic transactions by default)
+layout
+    Memory of the transformed data and feature matrix and the training time with the float64 layout vs the compact
+    types (uint8, int8, int16 and float32)
+sparse
+    Memory and training throughput with job and merchant one hot encoded into a dense matrix vs a sparse CSR matrix,
+    along with the label encoded features as a reference
+"""
+
+def generate_transactions(n_rows, seed=0):
+    """ Generates synthetic transactions with the same columns as the training data
+
+    Parameters
+    ----------
+    n_rows : int
+        The number of transactions to generate
+    seed : int
+        Seed for the random generator so that runs are repeatable
+
+    Returns
+    -------
+    source_df
+        The dataset (Pandas Dataframe) of synthetic transactions
+
+    """
+    rng = np.random.default_rng(seed)
+    categories = np.array(['misc_net','grocery_pos','entertainment','gas_transport','misc_pos','grocery_net',
+                           'shopping_net','shopping_pos','food_dining','personal_care','health_fitness','travel',
+                           'kids_pets','home'])
+    n_customers = max(n_rows // 100, 10)
+    customer = rng.integers(0, n_customers, n_rows)
+    txn_dt = pd.Timestamp('2019-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 3600*24*730, n_rows)), unit='s')
+    dob = pd.Timestamp('1940-01-01') + pd.to_timedelta(rng.integers(0, 365*60, n_customers), unit='D')
+    lat = rng.uniform(25, 48, n_customers)
+    long = rng.uniform(-122, -70, n_customers)
+    amt = rng.gamma(2, 40, n_rows).round(2)
+
+    source_df = pd.DataFrame({
+        'trans_date_trans_time': txn_dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'cc_num': 2703186189652095 + customer,
+        'merchant': np.char.add('fraud_Merchant ', rng.integers(0, 700, n_rows).astype(str)),
+        'category': categories[rng.integers(0, len(categories), n_rows)],
+        'amt': amt,
+        'first': 'John',
+        'last': 'Doe',
+        'sex': np.where(customer % 2 == 0, 'F', 'M'),
+        'street': '57636 Russet Ln',
+        'city': 'South Lyon',
+        'state': 'MI',
+        'zip': '48122',
+        'lat': lat[customer].round(4),
+        'long': long[customer].round(4),
+        'city_pop': (customer * 7919) % 2000000 + 100,
+        'job': np.char.add('Job ', (customer % 480).astype(str)),
+        'dob': dob.strftime('%Y-%m-%d').values[customer],
+        'trans_num': 'x',
+        'unix_time': (txn_dt - pd.Timestamp(0)) // pd.Timedelta(seconds=1),
+        'merch_lat': (lat[customer] + rng.normal(0, 0.5, n_rows)).round(6),
+        'merch_long': (long[customer] + rng.normal(0, 0.5, n_rows)).round(6),
+    })
+    source_df['is_fraud'] = (((amt > 300) & (rng.random(n_rows) < 0.3)) | (rng.random(n_rows) < 0.003)).astype(int)
+    return source_df
+
+def benchmark_transform(data_folder, source_file):
+    """ Compares the row wise derivation of attributes with the vectorized one used by ETL_Pipeline.transform
+
+    Parameters
+    ----------
+    data_folder : str
+        The folder with the source file
+    source_file : str
+        The name of the source file
+
+    """
+    source_df = pd.read_csv(data_folder + source_file)
+    n_rows = len(source_df)
+    dp = ETL_Pipeline('')
+
+    # Row wise derivation as the pipeline used to do it
+    start = time.perf_counter()
+    is_internet_rows = source_df.apply(lambda x: dp.is_txn_internet(x['category']),axis=1)
+    category_rows = source_df.apply(lambda x: dp.normalize_category(x['category']),axis=1)
+    age_rows = source_df['dob'].apply(ETL_Pipeline.age)
+    row_wise_time = time.perf_counter() - start
+
+    # Vectorized derivation
+    start = time.perf_counter()
+    is_internet = source_df['category'].str.endswith('_net').astype(int)
+    category_lookup = {category: dp.normalize_category(category) for category in source_df['category'].unique()}
+    category = source_df['category'].map(category_lookup)
+    age = ETL_Pipeline.age_vectorize(pd.to_datetime(source_df['dob'], format='%Y-%m-%d', errors='coerce'))
+    vectorized_time = time.perf_counter() - start
+
+    # Both must produce the same attributes
+    pd.testing.assert_series_equal(is_internet_rows, is_internet, check_dtype=False, check_names=False)
+    pd.testing.assert_series_equal(category_rows, category, check_names=False)
+    pd.testing.assert_series_equal(age_rows, age, check_dtype=False, check_names=False)
+    print('Row wise and vectorized derived attributes are identical')
+
+    # Full transformation
+    start = time.perf_counter()
+    dp.transform(source_df.copy())
+    transform_time = time.perf_counter() - start
+
+    print(f'Derived attributes row wise   : {n_rows / row_wise_time:,.0f} rows/sec')
+    print(f'Derived attributes vectorized : {n_rows / vectorized_time:,.0f} rows/sec')
+    print(f'Full transform                : {n_rows / transform_time:,.0f} rows/sec')
+
+def _run_pipeline(data_folder, source_file, chunk_size, results):
+    """ Runs the pipeline in a fresh process and reports its elapsed time and peak resident memory
+    """
+    output_folder = tempfile.mkdtemp(dir=data_folder) + '/'
+    os.symlink(os.path.abspath(data_folder + source_file), output_folder + source_file)
+
+    start = time.perf_counter()
+    ETL_Pipeline(output_folder).process(source_file, chunk_size)
+    elapsed = time.perf_counter() - start
+
+    results.put((elapsed, _peak_rss_mb()))
+
+def _peak_rss_mb():
+    """ Returns the peak resident memory of this process in MB
+    """
+    # VmHWM starts afresh in a spawned process whereas ru_maxrss carries over the parent's peak on Linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def benchmark_streaming(data_folder, source_file, chunk_size=100000):
+    """ Compares peak memory and throughput of the whole file pipeline with the chunked streaming pipeline
+
+    Every run happens in its own freshly spawned process so that peak memory of one run does not hide the other
+
+    Parameters
+    ----------
+    data_folder : str
+        The folder with the source file
+    source_file : str
+        The name of the source file
+    chunk_size : int
+        The number of rows read at a time when streaming
+
+    """
+    with open(data_folder + source_file) as f:
+        n_rows = sum(1 for _ in f) - 1
+
+    context = multiprocessing.get_context('spawn')
+    for name, size in [('Whole file', None), (f'Streaming ({chunk_size} rows per chunk)', chunk_size)]:
+        results = context.Queue()
+        process = context.Process(target=_run_pipeline, args=(data_folder, source_file, size, results))
+        process.start()
+        elapsed, peak_rss = results.get()
+        process.join()
+        print(f'{name:40}: {n_rows / elapsed:,.0f} rows/sec, peak RSS {peak_rss:,.0f} MB')
+
+def benchmark_cache(data_folder, source_file):
+    """ Compares loading the transformed data from a CSV file with loading it from the Feature_Cache
+
+    Parameters
+    ----------
+    data_folder : str
+        The folder with the source file
+    source_file : str
+        The name of the source file
+
+    """
+    output_folder = tempfile.mkdtemp(dir=data_folder) + '/'
+    transformed_df = ETL_Pipeline(output_folder).transform(pd.read_csv(data_folder + source_file))
+    transformed_df.to_csv(output_folder + 'transformed_data.csv', index=False)
+
+    cache = Feature_Cache(output_folder, 'transformed_data', ETL_Pipeline.version)
+    start = time.perf_counter()
+    key = cache.fingerprint([data_folder + source_file])
+    fingerprint_time = time.perf_counter() - start
+    cache.write(transformed_df, key)
+
+    start = time.perf_counter()
+    pd.read_csv(output_folder + 'transformed_data.csv')
+    csv_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache.read(key)
+    cache_time = time.perf_counter() - start
+
+    print(f'Load transformed_data.csv       : {csv_time * 1000:,.1f} ms')
+    print(f'Load transformed_data.feather   : {cache_time * 1000:,.1f} ms')
+    print(f'Fingerprint of the source file  : {fingerprint_time * 1000:,.1f} ms')
+
+def _latency_us(predict, rows):
+    """ Returns the median and 99th percentile latency in microseconds of predicting every row on its own
+    """
+    latencies = []
+    for row in rows:
+        start = time.perf_counter()
+        predict(row)
+        latencies.append(time.perf_counter() - start)
+    return np.percentile(latencies, 50) * 1e6, np.percentile(latencies, 99) * 1e6
+
+def benchmark_engine(data_folder, source_file, n_samples=500):
+    """ Compares predictions of the trained Random Forest through sklearn with the compiled forest
+
+    Parameters
+    ----------
+    data_folder : str
+        The folder with the source file
+    source_file : str
+        The name of the source file
+    n_samples : int
+        The number of single transactions timed
+
+    """
+    output_folder = tempfile.mkdtemp(dir=data_folder) + '/'
+    os.symlink(os.path.abspath(data_folder + source_file), output_folder + source_file)
+    dp = ETL_Pipeline(output_folder)
+    fd = Fraud_Dataset(dp.process(source_file), 'is_fraud', 2)
+    X_train, y_train = fd.get_training_dataset(0)
+    X_test, _ = fd.get_testing_dataset(0)
+
+    model = Fraud_Detector_Model(feature_transformer=dp.feature_transformer)
+    model.train(X_train, y_train)
+
+    # The compiled forest must give the same probabilities as sklearn
+    start = time.perf_counter()
+    compiled = model.compile(X_test)
+    compile_time = time.perf_counter() - start
+    assert compiled, 'Compiled forest does not match sklearn'
+    print(f'Compiled forest is identical to sklearn on {len(X_test):,} rows (compiled in {compile_time * 1000:,.0f} ms)')
+
+    rows = [X_test[i:i+1] for i in range(min(n_samples, len(X_test)))]
+    for name, predict in [('sklearn', model.cls.predict), ('compiled', model.engine.predict)]:
+        p50, p99 = _latency_us(predict, rows)
+        print(f'Single row {name:9}: p50 {p50:,.0f} us, p99 {p99:,.0f} us')
+
+    for batch_size in [32, 512, 10000]:
+        X_batch = X_test[:batch_size]
+        for name, predict_proba in [('sklearn', model.cls.predict_proba), ('compiled', model.engine.predict_proba)]:
+            start = time.perf_counter()
+            predict_proba(X_batch)
+            print(f'Batch of {len(X_batch):6} {name:9}: {len(X_batch) / (time.perf_counter() - start):,.0f} rows/sec')
+
+def benchmark_metrics(n_rows=10000000, batch_size=1000000):
+    """ Compares the separate sklearn metric calls Metrics.run used to make with the single pass Metrics
+
+    Parameters
+    ----------
+    n_rows : int
+        The number of labels and predictions
+    batch_size : int
+        The number of predictions added to the accumulator at a time
+
+    """
+    from sklearn.metrics import (confusion_matrix, accuracy_score, balanced_accuracy_score, precision_score,
+                                 recall_score, f1_score, roc_auc_score, average_precision_score)
+
+    rng = np.random.default_rng(0)
+    y_val = (rng.random(n_rows) < 0.01).astype(np.int64)
+    y_score = np.clip(y_val * 0.3 + rng.random(n_rows) * 0.7, 0, 1).round(3)
+    y_pred = (y_score > 0.5).astype(np.int64)
+
+    def sklearn_metrics(y_score):
+        tn, fp, fn, tp = confusion_matrix(y_val, y_pred).ravel()
+        return (accuracy_score(y_val, y_pred), balanced_accuracy_score(y_val, y_pred), tn / (tn + fp), tp / (tp + fn),
+                precision_score(y_val, y_pred), recall_score(y_val, y_pred), f1_score(y_val, y_pred),
+                roc_auc_score(y_val, y_score), average_precision_score(y_val, y_score))
+
+    def accumulate(y_score):
+        accumulator = Metrics_Accumulator()
+        for start in range(0, n_rows, batch_size):
+            end = start + batch_size
+            accumulator.update(y_val[start:end], y_pred[start:end], None if y_score is None else y_score[start:end])
+        return accumulator.result()
+
+    metrics = Metrics()
+    for scores, name in [(None, 'predicted classes'), (y_score, 'scores')]:
+        print(f'Ranking by {name}:')
+        results = []
+        for method, run in [('sklearn', lambda: sklearn_metrics(y_pred if scores is None else scores)),
+                            ('Metrics.run', lambda: metrics.run(y_val, y_pred, y_score=scores)),
+                            ('Metrics_Accumulator', lambda: accumulate(scores))]:
+            start = time.perf_counter()
+            results.append(run())
+            print(f'    {method:20}: {(time.perf_counter() - start) * 1000:,.0f} ms')
+
+        # All must give the same metrics
+        assert np.allclose(results[0], results[1], rtol=0, atol=1e-9) and np.allclose(results[0], results[2], rtol=0, atol=1e-9)
+    print(f'All metrics identical on {n_rows:,} labels')
+
+def benchmark_geo(n_rows=1000000, n_single=20000):
+    """ Compares computing the distance of every transaction with computing it once per repeated location pair
+
+    Parameters
+    ----------
+    n_rows : int
+        The number of transactions in a batch
+    n_single : int
+        The number of single transactions looked up one at a time
+
+    """
+    rng = np.random.default_rng(0)
+    n_customers = max(n_rows // 100, 10)
+    lat = rng.uniform(25, 48, n_customers).round(4)
+    long = rng.uniform(-122, -70, n_customers).round(4)
+
+    for repeat_ratio in [0.0, 0.5, 0.9, 0.99]:
+        # Draw the transactions from a fixed set of customer and merchant location pairs
+        n_pairs = max(int(n_rows * (1 - repeat_ratio)), 1)
+        customer = rng.integers(0, n_customers, n_pairs)
+        pair_lat, pair_long = lat[customer], long[customer]
+        pair_merch_lat = (pair_lat + rng.normal(0, 0.5, n_pairs)).round(6)
+        pair_merch_long = (pair_long + rng.normal(0, 0.5, n_pairs)).round(6)
+        pair = rng.permutation(np.r_[np.arange(n_pairs), rng.integers(0, n_pairs, n_rows - n_pairs)])
+        columns = [pd.Series(values[pair]) for values in [pair_lat, pair_long, pair_merch_lat, pair_merch_long]]
+        print(f'Repeat ratio {repeat_ratio:.2f} ({n_pairs:,} distinct pairs in {n_rows:,} transactions):')
+
+        # Every row vs the distinct pairs only, found by factorizing the customer and merchant locations
+        start = time.perf_counter()
+        direct = Distance_Cache.distances(*columns)
+        direct_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        customer_codes, customers = pd.factorize(columns[0].values + 1j * columns[1].values)
+        merchant_codes, merchants = pd.factorize(columns[2].values + 1j * columns[3].values)
+        pair_codes, pairs = pd.factorize(customer_codes.astype(np.int64) * len(merchants) + merchant_codes)
+        customers, merchants = customers[pairs // len(merchants)], merchants[pairs % len(merchants)]
+        deduplicated = Distance_Cache.distances(customers.real, customers.imag, merchants.real, merchants.imag)[pair_codes]
+        deduplicated_time = time.perf_counter() - start
+
+        assert np.array_equal(direct, deduplicated), 'Deduplicated distances differ'
+        print(f'    Batch every row          : {direct_time * 1000:,.0f} ms')
+        print(f'    Batch distinct pairs     : {deduplicated_time * 1000:,.0f} ms')
+
+        # Single transactions as the service sees them, with and without the cache
+        singles = [tuple(float(column.values[i]) for column in columns) for i in range(min(n_single, n_rows))]
+        start = time.perf_counter()
+        for single in singles:
+            Distance_Cache.haversine(*single)
+        compute_time = time.perf_counter() - start
+
+        distance_cache = Distance_Cache()
+        start = time.perf_counter()
+        for single in singles:
+            distance_cache.distance(*single)
+        cache_time = time.perf_counter() - start
+
+        print(f'    Single computed          : {compute_time / len(singles) * 1e9:,.0f} ns')
+        print(f'    Single Distance_Cache    : {cache_time / len(singles) * 1e9:,.0f} ns '
+              f'(hit ratio {distance_cache.get_stats()["hit_ratio"]:.2f})')
+
+    print(f'Distance column as float64 {n_rows * 8 / 1e6:,.0f} MB vs float32 {direct.nbytes / 1e6:,.0f} MB')
+
+def benchmark_layout(data_folder, source_file):
+    """ Compares the float64 layout the transformed data used to have with the compact types
+
+    The float64 layout is rebuilt from the compact one (int64 job code and class label, float64 for the rest),
+    which holds the same values since every compact value is exact in float64
+
+    Parameters
+    ----------
+    data_folder : str
+        The folder with the source file
+    source_file : str
+        The name of the source file
+
+    """
+    output_folder = tempfile.mkdtemp(dir=data_folder) + '/'
+    os.symlink(os.path.abspath(data_folder + source_file), output_folder + source_file)
+    dp = ETL_Pipeline(output_folder)
+    compact_df = dp.process(source_file)
+    wide_df = compact_df.astype({col: np.int64 if col in ['job_enc', 'is_fraud'] else np.float64 
+                                 for col in compact_df.columns})
+
+    results = {}
+    for name, transformed_df in [('float64', wide_df), ('compact', compact_df)]:
+        feather_file = output_folder + name + '.feather'
+        transformed_df.reset_index(drop=True).to_feather(feather_file)
+
+        # The float64 layout used to take the values of the whole frame, the compact one is gathered as float32
+        start = time.perf_counter()
+        if name == 'float64':
+            X = transformed_df.loc[:, transformed_df.columns != 'is_fraud'].values
+            y = transformed_df['is_fraud'].values
+        else:
+            fd = Fraud_Dataset(transformed_df, 'is_fraud', 2)
+            X, y = fd.X, fd.y
+        matrix_time = time.perf_counter() - start
+
+        # Train on the same rows with the default model
+        train_index = np.arange(0, len(y), 2)
+        X_train, y_train = np.take(X, train_index, axis=0), np.take(y, train_index, axis=0)
+        model = Fraud_Detector_Model(feature_transformer=dp.feature_transformer)
+        start = time.perf_counter()
+        model.train(X_train, y_train)
+        train_time = time.perf_counter() - start
+
+        results[name] = (transformed_df.memory_usage(index=False).sum() / 1e6, os.path.getsize(feather_file) / 1e6,
+                         X.nbytes / 1e6, matrix_time, train_time, model.cls.predict_proba(X[1::2]))
+        print(f'{name:8}: transformed data {results[name][0]:,.1f} MB ({results[name][1]:,.1f} MB on disk), '
+              f'feature matrix {X.dtype} {results[name][2]:,.1f} MB built in {matrix_time * 1000:,.0f} ms, '
+              f'training {train_time:,.2f} s')
+
+    wide, compact = results['float64'], results['compact']
+    print(f'Memory reduction: transformed data {1 - compact[0] / wide[0]:.0%}, feature matrix {1 - compact[2] / wide[2]:.0%}, '
+          f'training time {compact[4] / wide[4] - 1:+.0%}, identical predictions {np.array_equal(wide[5], compact[5])}')
+
+def benchmark_sparse(data_folder, source_file):
+    """ Compares training on job and merchant one hot encoded into a dense matrix (as OneHotEncoder().toarray()
+    gives) with training on the sparse CSR matrix of ETL_Pipeline.process_sparse(), along with the label encoded
+    features the service trains on by default as a reference
+
+    Every model is trained on the even rows and tested on the odd rows. The dense one hot matrix takes
+    rows x (jobs + merchants) x 4 bytes, so keep the number of rows moderate (e.g. 100,000)
+
+    Parameters
+    ----------
+    data_folder : str
+        The folder with the source file
+    source_file : str
+        The name of the source file
+
+    """
+    output_folder = tempfile.mkdtemp(dir=data_folder) + '/'
+    os.symlink(os.path.abspath(data_folder + source_file), output_folder + source_file)
+
+    start = time.perf_counter()
+    X_sparse, y = ETL_Pipeline(output_folder, one_hot=['job', 'merchant']).process_sparse(source_file)
+    etl_time = time.perf_counter() - start
+    print(f'Sparse ETL {len(y) / etl_time:,.0f} rows/sec, {X_sparse.shape[1]:,} features with {X_sparse.nnz / len(y):.1f} '
+          f'values that are not zero per row')
+
+    train_index, test_index = np.arange(0, len(y), 2), np.arange(1, len(y), 2)
+    results = {}
+    for name in ['label encoded', 'one hot dense', 'one hot sparse']:
+        # Build one matrix at a time so that a single dense one hot copy is held
+        if name == 'label encoded':
+            X = Fraud_Dataset(ETL_Pipeline(output_folder).process(source_file), 'is_fraud', 2).X
+        elif name == 'one hot dense':
+            X = X_sparse.toarray()
+        else:
+            X = Sparse_Fraud_Dataset(X_sparse, y, 2).X
+        memory = (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) if sparse.issparse(X) else X.nbytes
+
+        X_train = X[train_index] if sparse.issparse(X) else np.take(X, train_index, axis=0)
+        X_test = X[test_index] if sparse.issparse(X) else np.take(X, test_index, axis=0)
+        model = Fraud_Detector_Model()
+        start = time.perf_counter()
+        model.train(X_train, y[train_index])
+        train_time = time.perf_counter() - start
+
+        y_score = model.cls.predict_proba(X_test)[:, 1]
+        results[name] = (memory / 1e6, train_time, y_score)
+        print(f'{name:14}: feature matrix {X.shape[1]:,} columns {memory / 1e6:,.1f} MB, training '
+              f'{len(train_index) / train_time:,.0f} rows/sec ({train_time:,.2f} s), '
+              f'average precision {average_precision_score(y[test_index], y_score):.4f}')
+        del X, X_train, X_test
+
+    dense, sparse_ = results['one hot dense'], results['one hot sparse']
+    print(f'One hot sparse vs dense: memory {1 - sparse_[0] / dense[0]:.0%} less, training throughput '
+          f'{dense[1] / sparse_[1]:.2f}x, identical predictions {np.array_equal(dense[2], sparse_[2])}')
+
+benchmarks = {'transform': benchmark_transform, 'streaming': benchmark_streaming, 'cache': benchmark_cache,
+              'engine': benchmark_engine, 'layout': benchmark_layout, 'sparse': benchmark_sparse}
+
+if __name__ == "__main__":
+    if sys.argv[1] == 'metrics':
+        benchmark_metrics(int(sys.argv[2]) if len(sys.argv)>2 else 10000000)
+        sys.exit(0)
+
+    if sys.argv[1] == 'geo':
+        benchmark_geo(int(sys.argv[2]) if len(sys.argv)>2 else 1000000)
+        sys.exit(0)
+
+    benchmark = benchmarks[sys.argv[1]]
+
+    # Get command line arguments
+    if (len(sys.argv)>3):
+        data_folder = sys.argv[2]
+        source_file = sys.argv[3]
+    else:
+        # Write synthetic transactions to a temporary folder
+        n_rows = int(sys.argv[2]) if len(sys.argv)>2 else 1000000
+        data_folder = tempfile.mkdtemp() + '/'
+        source_file = 'transactions.csv'
+        generate_transactions(n_rows).to_csv(data_folder + source_file)
+
+    print(f'Running {sys.argv[1]} benchmark on {data_folder + source_file}')
+    benchmark(data_folder, source_file)
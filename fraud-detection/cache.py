@@ -0,0 +1,258 @@
+import os
+import json
+import hashlib
+import zipfile
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+class Feature_Cache:
+    """
+    A class used to represent the Cache of a transformed dataset
+
+    The dataset is stored in the columnar Feather format next to a small json file holding the key it was
+    built for. Sparse feature matrices along with their class labels are stored as a compressed numpy archive
+    instead (read_matrix() and write_matrix()). The key is a fingerprint of the content of the source files, the pipeline version and the
+    pipeline parameters, so a changed source, a new version of the pipeline or different parameters all
+    invalidate the cache on their own
+
+    ...
+
+    Attributes
+    ----------
+    _data_file : str
+        the full path to the feather file with the cached dataset
+    _meta_file : str
+        the full path to the json file with the key and schema of the cached dataset
+    _matrix_file : str
+        the full path to the npz file with the cached sparse matrix and labels
+    version : str
+        the version of the pipeline that produces the dataset
+    params : dict
+        the parameters of the pipeline that change the dataset it produces
+
+    Methods
+    -------
+    fingerprint()
+        Computes the key for the given source files
+    read()
+        Returns the cached dataset if it was built for the given key
+    write()
+        Stores a dataset under the given key
+    write_chunks()
+        Stores a dataset produced chunk by chunk under the given key
+    read_matrix()
+        Returns the cached sparse matrix and labels if they were built for the given key
+    write_matrix()
+        Stores a sparse matrix and its labels under the given key
+    """
+
+    def __init__(self, data_folder, name, version, params=None):
+        """ Initializes the Feature Cache
+
+        Parameters
+        ----------
+        data_folder : str
+            The folder where the cache files are kept
+        name : str
+            The name of the cached dataset, used for the file names
+        version : str
+            The version of the pipeline that produces the dataset
+        params : dict
+            The parameters of the pipeline that change the dataset it produces
+
+        """
+        self._data_file = data_folder + name + '.feather'
+        self._meta_file = data_folder + name + '.cache.json'
+        self._matrix_file = data_folder + name + '.npz'
+        self.version = str(version)
+        self.params = params if params is not None else {}
+
+    def fingerprint(self, source_files):
+        """ Computes the key of the dataset built from the source files
+
+        Parameters
+        ----------
+        source_files : list
+            The full paths to the source files
+
+        Returns
+        -------
+        key
+            The hex digest of the content of the source files, the pipeline version and its parameters
+
+        """
+        digest = hashlib.sha256()
+        digest.update(self.version.encode())
+        digest.update(json.dumps(self.params, sort_keys=True).encode())
+
+        for source_file in source_files:
+            with open(source_file, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+
+        return digest.hexdigest()
+
+    def read(self, key):
+        """ Reads the cached dataset
+
+        Parameters
+        ----------
+        key : str
+            The key the dataset needs to have been built for
+
+        Returns
+        -------
+        df
+            The cached dataset (Pandas Dataframe) or None when it is missing, stale or does not match its schema
+
+        """
+        try:
+            with open(self._meta_file, 'r') as f:
+                meta = json.load(f)
+
+            if meta['key'] != key:
+                print(f'Cache {self._data_file} is stale')
+                return None
+
+            # Memory map the file so that columns are not copied more than needed
+            table = feather.read_table(self._data_file, memory_map=True)
+            if Feature_Cache._schema(table) != meta['schema']:
+                print(f'Cache {self._data_file} does not match its schema')
+                return None
+
+            return table.to_pandas()
+        except (OSError, ValueError, KeyError, pa.ArrowException):
+            return None
+
+    def write(self, df, key):
+        """ Writes the dataset into the cache
+
+        Parameters
+        ----------
+        df : df
+            The dataset (Pandas Dataframe) to cache
+        key : str
+            The key the dataset was built for
+
+        """
+        self.write_chunks([df], key)
+
+    def write_chunks(self, chunks, key):
+        """ Writes a dataset produced chunk by chunk into the cache, holding only one chunk at a time
+
+        Parameters
+        ----------
+        chunks : iterable
+            The chunks of the dataset (Pandas Dataframes), all with the same columns
+        key : str
+            The key the dataset was built for
+
+        Raises
+        ------
+        ValueError
+            When there are no chunks, in which case the cache is left as it was
+
+        """
+        writer = None
+        tmp_file = self._data_file + '.tmp'
+        try:
+            for df in chunks:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    # Remove the key first so that a partially written cache can never be read
+                    if os.path.exists(self._meta_file):
+                        os.remove(self._meta_file)
+                    schema = table.schema
+                    writer = pa.ipc.new_file(tmp_file, schema)
+                writer.write_table(table.cast(schema))
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if writer is None:
+            raise ValueError(f'No data to write to {self._data_file}, the dataset has no chunks')
+
+        os.replace(tmp_file, self._data_file)
+
+        with open(self._meta_file, 'w') as f:
+            json.dump({'key': key, 'version': self.version, 'params': self.params,
+                       'schema': Feature_Cache._schema(schema)}, f)
+
+    def read_matrix(self, key):
+        """ Reads the cached sparse matrix and labels
+
+        Parameters
+        ----------
+        key : str
+            The key the matrix needs to have been built for
+
+        Returns
+        -------
+        X
+            The cached CSR matrix or None when it is missing, stale or does not match its schema
+        y
+            The cached labels or None
+        """
+        from scipy import sparse
+
+        try:
+            with open(self._meta_file, 'r') as f:
+                meta = json.load(f)
+
+            if meta['key'] != key:
+                print(f'Cache {self._matrix_file} is stale')
+                return None, None
+
+            with np.load(self._matrix_file) as arrays:
+                X = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']))
+                y = arrays['labels']
+
+            if Feature_Cache._matrix_schema(X, y) != meta['schema']:
+                print(f'Cache {self._matrix_file} does not match its schema')
+                return None, None
+
+            return X, y
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None, None
+
+    def write_matrix(self, X, y, key):
+        """ Writes a sparse matrix and its labels into the cache
+
+        Parameters
+        ----------
+        X : csr_matrix
+            The sparse feature matrix to cache
+        y : ndarray
+            The class labels, one per row of X
+        key : str
+            The key the matrix was built for
+
+        """
+        # Remove the key first so that a partially written cache can never be read
+        if os.path.exists(self._meta_file):
+            os.remove(self._meta_file)
+
+        # The archive is written under a temporary name ending in .npz so that numpy does not add the extension
+        tmp_file = self._matrix_file[:-len('.npz')] + '.tmp.npz'
+        X = X.tocsr()
+        np.savez_compressed(tmp_file, data=X.data, indices=X.indices, indptr=X.indptr, shape=np.array(X.shape), labels=y)
+        os.replace(tmp_file, self._matrix_file)
+
+        with open(self._meta_file, 'w') as f:
+            json.dump({'key': key, 'version': self.version, 'params': self.params,
+                       'schema': Feature_Cache._matrix_schema(X, y)}, f)
+
+    @staticmethod
+    def _matrix_schema(X, y):
+        """ Returns the shape and types of a sparse matrix and its labels as a json friendly list
+        """
+        return [['shape', list(X.shape)], ['data', str(X.data.dtype)], ['indices', str(X.indices.dtype)],
+                ['labels', str(y.dtype)]]
+
+    @staticmethod
+    def _schema(table_or_schema):
+        """ Returns the column names and types as a json friendly list
+        """
+        schema = table_or_schema.schema if isinstance(table_or_schema, pa.Table) else table_or_schema
+        return [[field.name, str(field.type)] for field in schema]
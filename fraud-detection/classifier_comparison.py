@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from data_pipeline import ETL_Pipeline
+from dataset import Fraud_Dataset
+from model import Fraud_Detector_Model
+from metrics import Metrics
+
+# Arrays shared with the worker processes, attached once per worker
+_shared_arrays = {}
+
+def _attach(shared_specs):
+    """ Attaches a worker process to the shared memory blocks holding X and y
+    """
+    for name, (shm_name, shape, dtype) in shared_specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared_arrays[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+def _fit_and_test(classifier_code, fold, train_index, test_index, latency_samples):
+    """ Trains one classifier on one fold in a worker process and measures its metrics and timings
+    """
+    start = time.perf_counter()
+    X = _shared_arrays['X'][1]
+    y = _shared_arrays['y'][1]
+
+    # Train the classifier on the rows of the fold
+    model = Fraud_Detector_Model(classifier_code)
+    fit_start = time.perf_counter()
+    model.train(X[train_index], y[train_index])
+    fit_time = time.perf_counter() - fit_start
+
+    # Predict the whole testing set at once
+    X_test = X[test_index]
+    y_test = y[test_index]
+    predict_start = time.perf_counter()
+    y_score = model.score_features(X_test)
+    predict_time = time.perf_counter() - predict_start
+    y_pred = Fraud_Detector_Model.decide(y_score)
+
+    # Predict single transactions as the service does
+    latencies = []
+    for i in range(min(latency_samples, len(X_test))):
+        latency_start = time.perf_counter()
+        model.cls.predict(X_test[i:i+1])
+        latencies.append(time.perf_counter() - latency_start)
+
+    return {'classifier': classifier_code,
+            'fold': fold,
+            'metrics': Metrics().run(y_test, y_pred, y_score=y_score),
+            'fit_time': fit_time,
+            'predict_time': predict_time,
+            'n_test': len(test_index),
+            'latencies': latencies,
+            'wall_time': time.perf_counter() - start}
+
+class Classifier_Comparison:
+    """
+    A class used to train and compare all supported classifiers of the Fraud Detection Model
+
+    Every classifier is trained and tested on every fold of the Fraud Dataset in a pool of worker processes.
+    X and y are placed in shared memory once so that the workers only receive the row indices of their fold
+    instead of pickled copies of the data
+
+    ...
+
+    Attributes
+    ----------
+    classifier_codes : tuple
+        the codes of the classifiers to compare
+    n_workers : int
+        the number of worker processes
+    latency_samples : int
+        the number of single transaction predictions timed per fold
+    results : list
+        the metrics and timings of every classifier and fold from the last run
+
+    Methods
+    -------
+    run()
+        Trains and tests every classifier on every fold in parallel
+    summarize()
+        Averages the results of every classifier over the folds
+    generate_report()
+        Writes the metrics report followed by the timings of every classifier
+    """
+
+    def __init__(self, classifier_codes=('RF', 'GB', 'AB'), n_workers=None, latency_samples=200):
+        """ Initializes the Classifier Comparison
+
+        Parameters
+        ----------
+        classifier_codes : tuple
+            The codes of the classifiers to compare, as accepted by Fraud_Detector_Model
+        n_workers : int
+            The number of worker processes (defaults to the number of CPUs)
+        latency_samples : int
+            The number of single transaction predictions timed per fold
+
+        """
+        self.classifier_codes = classifier_codes
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        self.latency_samples = latency_samples
+        self.results = []
+
+    def run(self, fraud_dataset, n_folds):
+        """ Trains and tests every classifier on every fold of the dataset in a pool of worker processes
+
+        Parameters
+        ----------
+        fraud_dataset : Fraud_Dataset
+            The dataset with the folds to train and test on
+        n_folds : int
+            The number of folds in the dataset
+
+        Returns
+        -------
+        wall_time
+            The elapsed time in seconds for the whole comparison
+
+        """
+        start = time.perf_counter()
+        shared_blocks = []
+        shared_specs = {}
+
+        try:
+            # Copy X and y into shared memory once for all workers
+            for name, array in [('X', fraud_dataset.X), ('y', fraud_dataset.y)]:
+                array = np.ascontiguousarray(array)
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                shared_blocks.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+                shared_specs[name] = (shm.name, array.shape, array.dtype.str)
+
+            # Submit one job per classifier and fold, each job only carries the row indices of its fold
+            with ProcessPoolExecutor(max_workers=self.n_workers, initializer=_attach,
+                                     initargs=(shared_specs,)) as executor:
+                jobs = []
+                futures = []
+                for classifier_code in self.classifier_codes:
+                    for fold in range(n_folds):
+                        jobs.append((classifier_code, fold))
+                        train_index, test_index = fraud_dataset.get_fold_indices(fold)
+                        futures.append(executor.submit(_fit_and_test, classifier_code, fold,
+                                                       train_index, test_index, self.latency_samples))
+
+                # A classifier that fails on a fold is reported without stopping the others
+                self.results = []
+                for (classifier_code, fold), future in zip(jobs, futures):
+                    try:
+                        self.results.append(future.result())
+                    except Exception as e:
+                        print(f'{classifier_code} failed on fold {fold}: {e}')
+        finally:
+            for shm in shared_blocks:
+                shm.close()
+                shm.unlink()
+
+        return time.perf_counter() - start
+
+    def summarize(self):
+        """ Averages the metrics and timings of every classifier over the folds of the last run
+
+        Returns
+        -------
+        summary_df
+            The dataset (Pandas Dataframe) with one row per classifier
+        """
+        rows = []
+        for classifier_code in self.classifier_codes:
+            results = [result for result in self.results if result['classifier'] == classifier_code]
+            if len(results) == 0:
+                continue
+            metrics = np.mean([result['metrics'] for result in results], axis=0)
+            latencies = np.concatenate([result['latencies'] for result in results]) * 1000
+            n_test = sum(result['n_test'] for result in results)
+            predict_time = sum(result['predict_time'] for result in results)
+
+            rows.append([classifier_code, *metrics,
+                         sum(result['wall_time'] for result in results),
+                         np.mean([result['fit_time'] for result in results]),
+                         n_test / predict_time,
+                         np.percentile(latencies, 50) if len(latencies) > 0 else np.nan,
+                         np.percentile(latencies, 99) if len(latencies) > 0 else np.nan])
+
+        return pd.DataFrame(rows, columns=['classifier', 'accuracy', 'balanced_accuracy', 'specificity',
+                                           'sensitivity', 'precision', 'recall', 'f1', 'roc_auc',
+                                           'average_precision', 'wall_time', 'fit_time',
+                                           'predict_throughput', 'latency_p50_ms', 'latency_p99_ms'])
+
+    def generate_report(self, report_file, wall_time=None):
+        """ Writes the metrics averaged over the folds followed by the timings of every classifier
+
+        Parameters
+        ----------
+        report_file : str
+            The full path to the file where the results need to be stored
+        wall_time : float
+            The elapsed time of the whole comparison, reported when given
+
+        """
+        summary_df = self.summarize()
+
+        # Metrics report for all classifiers
+        metrics = Metrics()
+        metrics.generate_report(*[summary_df[col].values for col in summary_df.columns[1:10]],
+                                summary_df['classifier'].values, report_file)
+
+        # Timings of every classifier
+        with open(report_file, "a") as f:
+            for _, row in summary_df.iterrows():
+                f.write(f"Timings for {row['classifier']}:\n")
+                f.write(f"\t\tWall Time (all folds) = {row['wall_time']:.2f} s\n")
+                f.write(f"\t\tFit Time (per fold) = {row['fit_time']:.2f} s\n")
+                f.write(f"\t\tBatch Predict Throughput = {row['predict_throughput']:,.0f} rows/s\n")
+                f.write(f"\t\tSingle Predict Latency p50 = {row['latency_p50_ms']:.2f} ms\n")
+                f.write(f"\t\tSingle Predict Latency p99 = {row['latency_p99_ms']:.2f} ms\n")
+                f.write("\n")
+
+            if wall_time is not None:
+                f.write(f"Total Wall Time = {wall_time:.2f} s with {self.n_workers} workers\n")
+
+if __name__ == "__main__":
+    # Get command line arguments, falling back to the environment like the service does
+    if (len(sys.argv)>2):
+        data_folder = sys.argv[1]
+        file = sys.argv[2]
+    else:
+        data_folder = os.environ['data-folder']
+        file = os.environ['training-data-file']
+
+    n_folds = int(sys.argv[3]) if len(sys.argv)>3 else 5
+    report_file = sys.argv[4] if len(sys.argv)>4 else data_folder + 'classifier_comparison.txt'
+    n_workers = int(os.environ['comparison-workers']) if 'comparison-workers' in os.environ else None
+
+    # Perform ETL and build the folds
+    velocity = os.environ.get('velocity-features', 'false').lower() in ['1', 'true', 'yes']
+    dp = ETL_Pipeline(data_folder, velocity)
+    df = dp.process(file)
+    fd = Fraud_Dataset(df, 'is_fraud', n_folds)
+
+    # Train and test every classifier on every fold
+    comparison = Classifier_Comparison(n_workers=n_workers)
+    wall_time = comparison.run(fd, n_folds)
+    comparison.generate_report(report_file, wall_time)
+
+    print(comparison.summarize().to_string(index=False))
+    print(f'Report written to {report_file}')
@@ -0,0 +1,211 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from instrumentation import instrumentation
+
+class Request_Coalescer:
+    """
+    A class used to coalesce concurrent single transaction requests into batches
+
+    Every request is put on a queue and waits on its own future. A background thread takes the first waiting
+    request, keeps collecting requests until either the batch is full or the wait window has passed, and
+    then makes one vectorized prediction for the whole batch. When the prediction of a batch fails every request
+    is predicted again on its own, so that only the request that caused the failure gets the exception
+
+    The transactions can be transformed to features before they are predicted, in one step for the whole batch.
+    Transforming may have side effects (such as adding the transactions to the activity of their card), so a
+    batch is transformed again request by request only when transforming it failed, which is expected to leave
+    no side effect. When predicting the transformed batch fails, the features of every request are predicted
+    on their own instead
+
+    ...
+
+    Attributes
+    ----------
+    max_batch_size : int
+        the maximum number of requests predicted together
+    max_wait_ms : float
+        the maximum time in milliseconds the first request of a batch waits for others to join
+    batch_sizes : Counter
+        the number of batches seen for every achieved batch size
+
+    Methods
+    -------
+    predict()
+        Submits a transaction and waits for its prediction
+    submit()
+        Submits a transaction and returns the future that will hold its prediction
+    get_stats()
+        Provides the knobs and the achieved batch sizes
+    """
+
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=2.0, transform_batch=None):
+        """ Initializes the Request Coalescer
+
+        Parameters
+        ----------
+        predict_batch : function
+            Function that takes a list of transactions (the features of the transactions when transform_batch is 
+            given) and returns the list of predictions in the same order
+        max_batch_size : int
+            The maximum number of requests predicted together
+        max_wait_ms : float
+            The maximum time in milliseconds the first request of a batch waits for others to join
+        transform_batch : function
+            Function that takes a list of transactions and returns their features as an array with a row per 
+            transaction, and that leaves no side effect when it fails. None when the transactions are predicted 
+            as they are
+
+        """
+        self._predict_batch = predict_batch
+        self._transform_batch = transform_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batch_sizes = Counter()
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def predict(self, transaction_details, timeout=None):
+        """ Submits a transaction and waits for its prediction
+
+        Parameters
+        ----------
+        transaction_details : dictionary
+            Dictionary of transaction attributes
+        timeout : float
+            Seconds to wait for the prediction before giving up (wait forever by default)
+
+        """
+        return self.submit(transaction_details).result(timeout)
+
+    def submit(self, transaction_details):
+        """ Submits a transaction to be predicted with the next batch
+
+        Parameters
+        ----------
+        transaction_details : dictionary
+            Dictionary of transaction attributes
+
+        Returns
+        -------
+        future
+            The Future that will hold the prediction of the transaction
+
+        """
+        self._ensure_started()
+
+        future = Future()
+        self._queue.put((transaction_details, future, time.perf_counter()))
+        return future
+
+    def get_stats(self):
+        """ Provides the knobs and the achieved batch sizes
+
+        Returns
+        -------
+        stats
+            Dictionary with the knobs, the number of batches and requests and the histogram of batch sizes
+
+        """
+        with self._lock:
+            batch_sizes = dict(self.batch_sizes)
+
+        batches = sum(batch_sizes.values())
+        requests = sum(size * count for size, count in batch_sizes.items())
+
+        return {'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'batches': batches,
+                'requests': requests,
+                'mean_batch_size': requests / batches if batches > 0 else 0.0,
+                'batch_size_histogram': {str(size): batch_sizes[size] for size in sorted(batch_sizes)}}
+
+    def _ensure_started(self):
+        """ Starts the batching thread the first time it is needed in this process
+
+        Threads do not survive a fork so the process id is checked as well, which lets the coalescer be created
+        before worker processes are forked
+        """
+        if (self._thread is not None) and (self._pid == os.getpid()):
+            return
+
+        with self._lock:
+            if (self._thread is None) or (self._pid != os.getpid()):
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='request-coalescer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        """ Blocks until a request arrives and then gathers others until the batch is full or the window passed
+        """
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        """ Predicts batches for as long as the process lives
+        """
+        while True:
+            batch = self._next_batch()
+            transactions = [transaction_details for transaction_details, _, _ in batch]
+
+            # Time every request waited for its batch to be scored
+            if instrumentation.enabled:
+                started = time.perf_counter()
+                for _, _, submitted in batch:
+                    instrumentation.observe('coalescer_wait', started - submitted)
+
+            try:
+                features = self._transform_batch(transactions) if self._transform_batch is not None else transactions
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._predict_alone(batch)
+            else:
+                try:
+                    predictions = self._predict_batch(features)
+                except Exception as e:
+                    if len(batch) == 1:
+                        batch[0][1].set_exception(e)
+                    else:
+                        self._predict_alone(batch, features)
+                else:
+                    for (_, future, _), prediction in zip(batch, predictions):
+                        future.set_result(prediction)
+
+            with self._lock:
+                self.batch_sizes[len(batch)] += 1
+
+    def _predict_alone(self, batch, features=None):
+        """ Predicts every request of a failed batch on its own so that only the failing ones get their exception.
+        The requests are transformed again unless the features of the batch are given, as they are when only the 
+        prediction failed. Transactions are validated before they are submitted, so this is only a safety net
+        """
+        for i, (transaction_details, future, _) in enumerate(batch):
+            try:
+                if features is not None:
+                    future.set_result(self._predict_batch(features[i:i + 1])[0])
+                elif self._transform_batch is not None:
+                    future.set_result(self._predict_batch(self._transform_batch([transaction_details]))[0])
+                else:
+                    future.set_result(self._predict_batch([transaction_details])[0])
+            except Exception as e:
+                future.set_exception(e)
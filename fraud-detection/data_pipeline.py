@@ -1,10 +1,14 @@
 import numpy as np
 import pandas as pd
+import json
+from scipy import sparse
+from bisect import bisect_left
 from datetime import datetime, date 
 from sklearn import preprocessing
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.preprocessing import OrdinalEncoder
-from sklearn.preprocessing import LabelEncoder
+from cache import Feature_Cache
+from geo_cache import Distance_Cache
+from velocity import Velocity_Store
+from instrumentation import instrumentation
 
 class ETL_Pipeline:
     """
@@ -22,24 +26,42 @@ class ETL_Pipeline:
         the dataframe representing the source data
     transformed_df : df
         the dataframe representing the transformed data
+    feature_transformer : Feature_Transformer
+        the scaling and encoding state fitted on the source data (needed to transform new transactions)
+    velocity : bool
+        whether the velocity features of every card (see Velocity_Store) are added to the features
+    one_hot : list
+        the high cardinality columns (out of job and merchant) one hot encoded by process_sparse()
+    _cache : Feature_Cache
+        the cache holding the transformed data in a columnar format, keyed by the source file fingerprint
+    _sparse_cache : Feature_Cache
+        the cache holding the sparse transformed data and labels, keyed by the source file fingerprint
+    version : str
+        the version of the transformations. Bump it whenever they change so that cached transformed data is rebuilt
 
     Methods
     -------
     process()
         Key method that extracts, transforms and loads the source. Optimizes by ensuring that if transformed
-        data is present then it simply reads it back instead of reading source, applying transforms and writing
-        transformed file
+        data is present for the same source, pipeline version and parameters then it simply reads it back instead 
+        of reading source, applying transforms and writing transformed file
+    process_sparse()
+        Same as process() but one hot encodes the high cardinality columns into a sparse CSR matrix of features
     extract()
         Reads the source file given the directory and file name. Expects the file to be a CSV
     transform()
         Performs Transformations on the source file to produce final features. As a part of transformation
         it creates new derived attributes (as advised from data analysis), removes unncessary columns, 
         performing scaling and encoding operations
+    stream()
+        Performs the same Transformations as transform() reading and writing the source in chunks so that
+        memory stays bounded whatever the size of the source file
     load()
-        Saves the final transformed file
+        Saves the final transformed file along with the fitted feature transformer
     """
+    version = '5'
     
-    def __init__(self, data_folder):
+    def __init__(self, data_folder, velocity=False, one_hot=None):
         """ Initializes the Data Pipeline Class
 
         Parameters
@@ -48,14 +70,38 @@ class ETL_Pipeline:
             The name of the source file
         data_folder : str
             The folder with the source file is kept
+        velocity : bool
+            Whether to add the count, amount and distinct merchants of the transactions of the same card over
+            the last 1 hour, 24 hours and 7 days to the features
+        one_hot : list
+            The high cardinality columns (out of job and merchant) that process_sparse() one hot encodes
 
         """
         self._data_folder = data_folder
         self.source_df = None
         self.transformed_df = None
+        self.feature_transformer = None
+        self.velocity = velocity
+        self.one_hot = [] if one_hot is None else list(one_hot)
+        self._cache = Feature_Cache(data_folder, 'transformed_data', ETL_Pipeline.version,
+                                    {'velocity': Velocity_Store.windows} if velocity else None)
+        self._sparse_cache = Feature_Cache(data_folder, 'transformed_sparse_data', ETL_Pipeline.version,
+                                           {'velocity': Velocity_Store.windows if velocity else None, 'one_hot': self.one_hot})
+        self._cache_key = None
     
-    def process(self, source_file):
+    def process(self, source_file, chunk_size=None):
         """ Executes the Pipeline to return transformed dataset 
+
+        The transformed file is only reused when the fitted feature transformer saved with it is present 
+        as well, since without it new transactions cannot be transformed the same way
+
+        Parameters
+        ----------
+        source_file : str
+            The name of the source file
+        chunk_size : int
+            When provided the source is streamed this many rows at a time instead of being read whole 
+            (use it for source files larger than memory)
         
         Returns
         -------
@@ -63,16 +109,92 @@ class ETL_Pipeline:
             The dataset (Pandas Dataframe) equivalent of the transformed file
 
         """
-        try:
-            transformed_df = pd.read_csv(self._data_folder + "transformed_data.csv")
-        except Exception:
-            print("Did not find the transformed_data.csv")
-            source_df = self.extract(source_file)
-            transformed_df = self.transform(source_df)
-            self.load()   
+        self._cache_key = self._cache.fingerprint([self._data_folder + source_file])
+        transformed_df = self._cache.read(self._cache_key)
+
+        if transformed_df is not None:
+            try:
+                self.feature_transformer = Feature_Transformer.load(self._data_folder + "feature_transformers.json")
+            except Exception:
+                transformed_df = None
+
+        if transformed_df is None:
+            print("Did not find an up to date transformed_data.feather and feature_transformers.json")
+            if chunk_size is None:
+                source_df = self.extract(source_file)
+                transformed_df = self.transform(source_df)
+                self.load()   
+            else:
+                self.stream(source_file, chunk_size)
+                transformed_df = self._cache.read(self._cache_key)
         
         return transformed_df
 
+    def process_sparse(self, source_file, chunk_size=None):
+        """ Executes the Pipeline to return the transformed dataset as a sparse matrix with the one hot encoded 
+        high cardinality columns, along with the class labels
+
+        The matrix is cached as transformed_sparse_data.npz along with its fitted feature transformer 
+        (sparse_feature_transformers.json), apart from the dense transformed data so that both can be used
+
+        Parameters
+        ----------
+        source_file : str
+            The name of the source file
+        chunk_size : int
+            When provided the source is read this many rows at a time and the matrix is built chunk by chunk, so
+            that only the sparse matrix and a single chunk are held in memory
+
+        Returns
+        -------
+        X
+            The CSR matrix of float32 features, see Feature_Transformer.transform_matrix()
+        y
+            The uint8 array of class labels
+
+        """
+        transformer_file = self._data_folder + 'sparse_feature_transformers.json'
+        cache_key = self._sparse_cache.fingerprint([self._data_folder + source_file])
+        X, y = self._sparse_cache.read_matrix(cache_key)
+
+        if X is not None:
+            try:
+                self.feature_transformer = Feature_Transformer.load(transformer_file)
+            except Exception:
+                X = None
+
+        if X is None:
+            print("Did not find an up to date transformed_sparse_data.npz and sparse_feature_transformers.json")
+            self.feature_transformer = Feature_Transformer(velocity_windows=self._velocity_windows(), one_hot=self.one_hot)
+            if chunk_size is None:
+                source_df = self.extract(source_file)
+                trimmed_df = self._derive(source_df)
+                self.feature_transformer.fit(trimmed_df)
+                X = self.feature_transformer.transform_matrix(trimmed_df)
+                y = trimmed_df['is_fraud'].to_numpy(dtype=np.uint8)
+                self._warm(source_df)
+            else:
+                # First pass to fit the scaling and encoding state, second pass to transform each chunk
+                velocity_store = Velocity_Store() if self.velocity else None
+                for source_chunk_df in pd.read_csv(self._data_folder + source_file, chunksize=chunk_size):
+                    self.feature_transformer.partial_fit(self._derive(source_chunk_df, velocity_store))
+
+                X_chunks, y_chunks = [], []
+                velocity_store = Velocity_Store() if self.velocity else None
+                for source_chunk_df in pd.read_csv(self._data_folder + source_file, chunksize=chunk_size):
+                    trimmed_df = self._derive(source_chunk_df, velocity_store)
+                    X_chunks.append(self.feature_transformer.transform_matrix(trimmed_df))
+                    y_chunks.append(trimmed_df['is_fraud'].to_numpy(dtype=np.uint8))
+                X, y = sparse.vstack(X_chunks, format='csr'), np.concatenate(y_chunks)
+
+                # The store of the last pass holds the activity of every card at the end of the history
+                self.feature_transformer.velocity_store = velocity_store
+
+            self.feature_transformer.save(transformer_file)
+            self._sparse_cache.write_matrix(X, y, cache_key)
+
+        return X, y
+
     def extract(self, source_file):
         """ Reads the source to return source dataset 
         
@@ -85,14 +207,97 @@ class ETL_Pipeline:
         self.source_df = pd.read_csv(self._data_folder + source_file)
         return self.source_df
 
-    def transform(self, source_df):
+    def transform(self, source_df, fit=True):
         """ Transforms the source to return transformed dataset 
+
+        Parameters
+        ----------
+        source_df : df
+            The dataset (Pandas Dataframe) with the source transactions
+        fit : bool
+            Whether to fit the scaling and encoding on this data (default) or reuse the already fitted 
+            feature transformer
         
         Returns
         -------
         transformed_df
             The dataset (Pandas Dataframe) after performing transformations on the source data
 
+        """
+        # Derive the attributes and drop the columns we do not need
+        trimmed_df = self._derive(source_df)
+
+        # Get the class df, the class label is 0 or 1
+        class_df = trimmed_df[['is_fraud']].astype(np.uint8)
+
+        # Fit the scaling and encoding state unless we are reusing an already fitted one
+        if (fit) | (self.feature_transformer is None):
+            self.feature_transformer = Feature_Transformer(velocity_windows=self._velocity_windows())
+            self.feature_transformer.fit(trimmed_df)
+            self._warm(source_df)
+
+        # Apply scaling to numeric columns and encoding to categorical columns
+        fraud_features_df = self.feature_transformer.transform_frame(trimmed_df)
+
+        # Generate Final features 
+        self.transformed_df = pd.concat([fraud_features_df, class_df], axis=1)
+        return self.transformed_df
+
+    def stream(self, source_file, chunk_size=100000):
+        """ Transforms the source file in chunks and writes the transformed file chunk by chunk
+
+        The first pass over the source only fits the scaling and encoding state (min and max of numeric columns,
+        vocabulary of jobs). The second pass transforms every chunk with that state and appends it to the 
+        transformed file, so that at most one chunk is held in memory at any time
+
+        Velocity features are computed by adding the transactions to a Velocity_Store in the order of the file
+        across chunks, which gives the same features as transform() when the file is in time order. The store of 
+        the second pass then becomes the one of the feature transformer, holding the activity of every card
+
+        Parameters
+        ----------
+        source_file : str
+            The name of the source file
+        chunk_size : int
+            The number of rows read at a time
+
+        """
+        # First pass to fit the scaling and encoding state
+        self.feature_transformer = Feature_Transformer(velocity_windows=self._velocity_windows())
+        velocity_store = Velocity_Store() if self.velocity else None
+        for source_chunk_df in pd.read_csv(self._data_folder + source_file, chunksize=chunk_size):
+            self.feature_transformer.partial_fit(self._derive(source_chunk_df, velocity_store))
+
+        # Second pass to transform and write each chunk
+        velocity_store = Velocity_Store() if self.velocity else None
+        def transformed_chunks():
+            for source_chunk_df in pd.read_csv(self._data_folder + source_file, chunksize=chunk_size):
+                trimmed_df = self._derive(source_chunk_df, velocity_store)
+                yield pd.concat([self.feature_transformer.transform_frame(trimmed_df), trimmed_df[['is_fraud']].astype(np.uint8)], axis=1)
+
+        self._cache.write_chunks(transformed_chunks(), self._cache_key)
+
+        # The store of the second pass holds the activity of every card at the end of the history
+        if self.velocity:
+            self.feature_transformer.velocity_store = velocity_store
+        self.feature_transformer.save(self._data_folder + 'feature_transformers.json')
+
+    def _derive(self, source_df, velocity_store=None):
+        """ Creates the derived attributes and removes the columns not needed 
+        
+        Parameters
+        ----------
+        source_df : df
+            The dataset (Pandas Dataframe) with the source transactions
+        velocity_store : Velocity_Store
+            When provided the velocity features are computed by adding the transactions to it one by one 
+            (for chunks of a file) instead of scanning the whole dataset
+
+        Returns
+        -------
+        trimmed_df
+            The dataset (Pandas Dataframe) with the attributes needed for the final features and the class label
+
         """
         # Let's convert transaction date and time and dob to date-time
         source_df["dob_dt"] = pd.to_datetime(source_df['dob'], format='%Y-%m-%d', errors='coerce')
@@ -102,7 +307,7 @@ class ETL_Pipeline:
         source_df['txn_weekday'] = source_df['txn_dt'].dt.day_name()
 
         # Compute age from date of birth 
-        source_df['age'] = source_df['dob'].apply(ETL_Pipeline.age) 
+        source_df['age'] = ETL_Pipeline.age_vectorize(source_df['dob_dt'])
 
         # Compute hour from transaction date
         source_df['txn_hour'] = source_df['txn_dt'].dt.hour
@@ -115,20 +320,34 @@ class ETL_Pipeline:
         # Compute month from transaction date
         source_df['txn_month'] = source_df['txn_dt'].dt.month_name()
 
-        # Compute distance between customer's location and merchant location 
-        source_df['distance_from_merchant'] = self.haversine_vectorize(source_df['lat'],source_df['long'],
+        # Compute distance between customer's location and merchant location, kept as float32
+        source_df['distance_from_merchant'] = Distance_Cache.distances(source_df['lat'],source_df['long'],
                                                                        source_df['merch_lat'],source_df['merch_long'])
 
         # Create derived attribute to indicate if the transaction is physical or on the internet
-        source_df['is_internet'] = source_df.apply(lambda x: self.is_txn_internet(x['category']),axis=1)
-
-        # Create derived attribute to reduce the categories into more bubbled up ones
-        source_df['normalized_category'] = source_df.apply(lambda x: self.normalize_category(x['category']),axis=1)   
-
-        # Drop the above columns
+        source_df['is_internet'] = source_df['category'].str.endswith('_net').astype(int)
+
+        # Create derived attribute to reduce the categories into more bubbled up ones. There are only a handful of 
+        # distinct categories so normalize each once and map the rest through the lookup table
+        category_lookup = {category: self.normalize_category(category) for category in source_df['category'].unique()}
+        source_df['normalized_category'] = source_df['category'].map(category_lookup)
+
+        # Count the recent transactions of the same card, amount and merchants over every velocity window
+        if self.velocity:
+            if velocity_store is None:
+                velocity_df = Velocity_Store.scan(source_df['cc_num'], source_df['unix_time'], source_df['amt'],
+                                                  source_df['merchant'])
+            else:
+                velocity_df = pd.DataFrame([velocity_store.update(*transaction) for transaction in 
+                                            zip(source_df['cc_num'], source_df['unix_time'], source_df['amt'], source_df['merchant'])],
+                                           columns=Velocity_Store.column_names(), index=source_df.index)
+            source_df[velocity_df.columns] = velocity_df
+
+        # Drop the above columns, keeping the merchant when it is one hot encoded
         cols_to_drop = ['cc_num','person','first','last','dob','sex','street','city','state','zip','person_loc',
                 'merchant_loc','lat','long','trans_num','trans_date_trans_time','unix_time',
                 'dob_dt','txn_dt','txn_hour','address','category','merch_lat','merch_long','normalized_job', 'merchant']
+        cols_to_drop = [col for col in cols_to_drop if col not in self.one_hot]
         trimmed_df = source_df.drop(columns=cols_to_drop,errors='ignore')
 
         # Drop the column with the serial number
@@ -137,109 +356,21 @@ class ETL_Pipeline:
             if idx == 0:
                 trimmed_df = trimmed_df.drop(columns=source_df.columns[idx])
 
-        # Get the class df
-        class_df = trimmed_df[['is_fraud']].copy()
-
-        # Apply scaling to all numeric columns
-        fraud_numeric_features_df = self._apply_scaling(trimmed_df) 
-
-        # Apply Encoding to categorical columns
-        fraud_cat_features_df = self._apply_encoding(trimmed_df)
-
-        # Generate Final features 
-        self.transformed_df = pd.concat([fraud_cat_features_df, fraud_numeric_features_df, class_df], axis=1)
-        return self.transformed_df
-
-    def _apply_scaling(self, trimmed_df):
-        """ Applies Scaling to the numeric data elements
-
-        Parameters
-        ----------
-        trimmed_df : df
-            The dataset after removing unneeded columns from source
-
-        Returns
-        -------
-        fraud_numeric_features_df
-            The dataset (Pandas Dataframe) containing the transformed numeric elements
+        return trimmed_df
 
+    def _warm(self, source_df):
+        """ Adds the transactions to the activity of the cards of the feature transformer, so that the transactions
+        it transforms next see the same activity as the training data did
         """
-        # Min Max Scaler is a good choice for all these attributes
-        min_max_scaler = preprocessing.MinMaxScaler()
-
-        trimmed_df[['normalized_amt']] = min_max_scaler.fit_transform(trimmed_df[['amt']])
-        trimmed_df[['normalized_city_pop']] = min_max_scaler.fit_transform(trimmed_df[['city_pop']])
-        trimmed_df[['normalized_age']] = min_max_scaler.fit_transform(trimmed_df[['age']])
-        trimmed_df[['normalized_distance_from_merchant']] = min_max_scaler.fit_transform(trimmed_df[['distance_from_merchant']])
-
-        cols_to_drop = ['amt','city_pop','age','distance_from_merchant']
-        trimmed_df = trimmed_df.drop(columns=cols_to_drop,errors='ignore')
-
-        fraud_numeric_features_df = trimmed_df[['normalized_amt','normalized_city_pop','normalized_age','normalized_distance_from_merchant']].copy()
-        return fraud_numeric_features_df
-
-    def _apply_encoding(self, trimmed_df):
-        """ Applies Encoding to the categorical data elements
-
-        Parameters
-        ----------
-        trimmed_df : df
-            The dataset after removing unneeded columns from source
-
-        Returns
-        -------
-        fraud_cat_features_df
-            The dataset (Pandas Dataframe) containing the transformed categorical elements
+        if self.feature_transformer.velocity_store is not None:
+            self.feature_transformer.velocity_store.warm(source_df['cc_num'], source_df['unix_time'], source_df['amt'], 
+                                                         source_df['merchant'])
 
+    def _velocity_windows(self):
+        """ Returns the velocity windows of the feature transformer, None when velocity features are not used
         """
-        categorical_df = trimmed_df[['is_internet','normalized_category','job','txn_weekday','txn_month','part_of_day']].copy()
-
-        # Apply one-hot encoder to category
-        ohc_category = OneHotEncoder(categories=[['Entertainment','Home','Misc','Shopping']])
-        ohe_category= ohc_category.fit_transform(categorical_df['normalized_category'].values.reshape(-1,1)).toarray()
-        df_category = pd.DataFrame(ohe_category, columns = ohc_category.categories_[0])
-
-        # Fix the order for Part of Day
-        ordered_part_of_day = ['Late Night','Early Morning', 'Morning','Afternoon','Evening','Night']
+        return Velocity_Store.windows if self.velocity else None
 
-        # Create the Ordinal Encoder
-        oe_daypart = OrdinalEncoder(categories=[ordered_part_of_day])
-
-        part_of_day_df = categorical_df[['part_of_day']].copy()
-        part_of_day_df[['part_of_day']] = oe_daypart.fit_transform(part_of_day_df[['part_of_day']])
-
-        # Fix the order for months
-        ordered_month = ['January','February', 'March','April','May','June','July','August','September',
-                      'October','November','December']
-
-        # Create the Ordinal Encoder
-        oe_month = OrdinalEncoder(categories=[ordered_month])
-
-        month_df = categorical_df[['txn_month']].copy()
-        month_df[['txn_month']] = oe_month.fit_transform(month_df[['txn_month']])
-
-        # Fix the order for months
-        ordered_weekday = ['Sunday','Monday', 'Tuesday','Wednesday','Thursday','Friday','Saturday']
-
-        # Create the Ordinal Encoder
-        oe_weekday = OrdinalEncoder(categories=[ordered_weekday])
-
-        weekday_df = categorical_df[['txn_weekday']].copy()
-        weekday_df[['txn_weekday']] = oe_weekday.fit_transform(weekday_df[['txn_weekday']])
-
-        # Create instance of labelencoder
-        labelencoder = LabelEncoder()
-
-        job_df = categorical_df[['job']].copy()
-        job_df['job_enc'] = labelencoder.fit_transform(job_df['job'])
-
-        cols_to_drop = ['job']
-        job_df = job_df.drop(columns=cols_to_drop,errors='ignore')
-
-        # Concatenate all features and return
-        fraud_cat_features_df = pd.concat([job_df, df_category, weekday_df, month_df, part_of_day_df], axis=1)
-        return fraud_cat_features_df
-    
     def load(self):
         """ Loads the Transformed Data into File System and returns it 
 
@@ -252,7 +383,8 @@ class ETL_Pipeline:
         if self.transformed_df is None:
             self.transform()
 
-        self.transformed_df.to_csv(self._data_folder + 'transformed_data.csv', index=False)  
+        self.feature_transformer.save(self._data_folder + 'feature_transformers.json')
+        self._cache.write(self.transformed_df, self._cache_key)
 
     @staticmethod
     def age(born): 
@@ -273,6 +405,25 @@ class ETL_Pipeline:
         today = date.today() 
         return today.year - born.year - ((today.month,  today.day) < (born.month,  born.day)) 
 
+    @staticmethod
+    def age_vectorize(born): 
+        """ Computes Age for a whole series of Dates of Birth
+
+        Parameters
+        ----------
+        born : Series
+            The dates of birth already converted to datetime
+
+        Returns
+        -------
+        age
+            The numeric age of the customers, same as applying age() to every date of birth
+
+        """
+        today = date.today() 
+        birthday_not_reached = (born.dt.month > today.month) | ((born.dt.month == today.month) & (born.dt.day > today.day))
+        return today.year - born.dt.year - birthday_not_reached.astype(int)
+
     def haversine_vectorize(self, lon1, lat1, lon2, lat2):
         """ Returns distance, in miles, between one set of longitude/latitude coordinates and another
 
@@ -293,18 +444,10 @@ class ETL_Pipeline:
             The distance between source and destination in miles
 
         """
-        lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
- 
-        newlon = lon2 - lon1
-        newlat = lat2 - lat1
- 
-        haver_formula = np.sin(newlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(newlon/2.0)**2
- 
-        dist = 2 * np.arcsin(np.sqrt(haver_formula ))
-        miles = 3958 * dist #6367 for distance in KM 
-        return miles
+        return Distance_Cache.haversine_vectorize(lon1, lat1, lon2, lat2)
 
-    def is_txn_internet(self, _category): 
+    @staticmethod
+    def is_txn_internet(_category): 
         """ Returns whether the transaction was made on the internet or was at physical location E.g. Point of Sale (POS)
 
         Parameters
@@ -323,7 +466,8 @@ class ETL_Pipeline:
         else:
             return 0
 
-    def normalize_category(self, _category): 
+    @staticmethod
+    def normalize_category(_category): 
         """ Returns a normalized category by clubbing some of the values together
 
         Parameters
@@ -347,3 +491,510 @@ class ETL_Pipeline:
             return 'Entertainment'
         else:
             return 'Misc'
+
+class Feature_Transformer:
+    """
+    A class used to represent the fitted Scaling and Encoding state of the Data Pipeline
+
+    Fitting happens once on the training data. Transforming new transactions then only uses the fitted
+    state (plain numbers and lookup tables) so that online features match the training features and no
+    scikit-learn estimator is created per request
+
+    The features take the smallest types that hold them: uint8 one hot categories, int8 ordinals, int16 job codes
+    (int32 beyond 32,767 jobs) and float32 scaled numerics. The trees of the model compare features as float32 so
+    single transactions are transformed to float32 as well, which gives the same predictions as before in less
+    than half the memory
+
+    High cardinality categorical columns (job and merchant) can be one hot encoded instead of label encoded. The
+    features are then a sparse CSR matrix (transform_matrix()) holding the dense features first followed by one
+    column per job and per merchant seen during fitting, so that only the values that are not zero take memory.
+    Values never seen during fitting have no column set
+
+    ...
+
+    Attributes
+    ----------
+    scaling : dict
+        the min max scaling fitted for every numeric column as a dictionary of data_min, data_max, scale and min
+    job_classes : list
+        the sorted list of jobs seen during fitting. The position in the list is the encoded value of the job
+    merchant_classes : list
+        the sorted list of merchants seen during fitting when merchant is one hot encoded, None otherwise
+    one_hot : list
+        the high cardinality columns (out of job and merchant) that are one hot encoded into sparse features
+    velocity_windows : dict
+        the velocity windows in seconds by name when velocity features are used, None otherwise
+    numeric_cols : list
+        the numeric columns that are scaled, the velocity features included
+    velocity_store : Velocity_Store
+        the recent activity of every card, warmed with the training data by the ETL_Pipeline and added to while 
+        transforming single transactions
+    _job_codes : dict
+        the lookup table from job to its encoded value
+    _one_hot_codes : dict
+        the lookup table from value to its column by one hot encoded column
+    _category_codes : dict
+        the lookup table from transaction category to its one hot encoded normalized category
+    _distance_cache : Distance_Cache
+        the distances of the customer and merchant location pairs seen while transforming single transactions
+
+    Methods
+    -------
+    fit()
+        Fits the scaling and encoding on the trimmed training data
+    partial_fit()
+        Updates the scaling and encoding with one more chunk of the trimmed training data
+    transform_frame()
+        Transforms a trimmed dataset into the final features using the fitted state
+    transform_matrix()
+        Transforms a trimmed dataset into a sparse matrix of final features with the one hot encoded columns
+    feature_names()
+        Provides the names of the final features in order
+    transform()
+        Transforms a single transaction into a row of final features using the fitted state
+    transform_batch()
+        Transforms a list of transactions into rows of final features using the fitted state
+    validate()
+        Checks that a transaction has every attribute the features are made of in the expected format
+    save()
+        Saves the fitted state as a json file, along with the activity of the cards when velocity features are used
+    load()
+        Loads the fitted state from a json file
+    velocity_file()
+        Provides the file the activity of the cards is saved in
+    """
+    categories = ['Entertainment','Home','Misc','Shopping']
+    ordered_part_of_day = ['Late Night','Early Morning', 'Morning','Afternoon','Evening','Night']
+    ordered_month = ['January','February', 'March','April','May','June','July','August','September',
+                     'October','November','December']
+    ordered_weekday = ['Sunday','Monday', 'Tuesday','Wednesday','Thursday','Friday','Saturday']
+    numeric_cols = ['amt','city_pop','age','distance_from_merchant']
+    one_hot_cols = ['job','merchant']
+    required_cols = ['trans_date_trans_time', 'category', 'amt', 'city_pop', 'job', 'dob', 'lat', 'long', 'merch_lat', 
+                     'merch_long']
+    feature_cols = ['job_enc'] + categories + ['txn_weekday','txn_month','part_of_day',
+                    'normalized_amt','normalized_city_pop','normalized_age','normalized_distance_from_merchant']
+
+    def __init__(self, scaling=None, job_classes=None, velocity_windows=None, one_hot=None, merchant_classes=None):
+        """ Initializes the Feature Transformer Class
+
+        Parameters
+        ----------
+        scaling : dict
+            The min max scaling by numeric column (when restoring an already fitted state)
+        job_classes : list
+            The sorted list of jobs (when restoring an already fitted state)
+        velocity_windows : dict
+            The velocity windows in seconds by name when velocity features are used
+        one_hot : list
+            The high cardinality columns (out of job and merchant) to one hot encode into sparse features
+        merchant_classes : list
+            The sorted list of merchants (when restoring an already fitted state with merchant one hot encoded)
+
+        """
+        one_hot = [] if one_hot is None else list(one_hot)
+        unknown_cols = set(one_hot) - set(Feature_Transformer.one_hot_cols)
+        if len(unknown_cols) > 0:
+            raise ValueError(f'Only {Feature_Transformer.one_hot_cols} can be one hot encoded, not {sorted(unknown_cols)}')
+
+        self.scaling = scaling
+        self.job_classes = job_classes
+        self.merchant_classes = merchant_classes
+        self.one_hot = [col for col in Feature_Transformer.one_hot_cols if col in one_hot]
+        self.velocity_windows = velocity_windows
+        self.numeric_cols = list(Feature_Transformer.numeric_cols)
+        self.velocity_store = None
+        if velocity_windows is not None:
+            self.numeric_cols += Velocity_Store.column_names(velocity_windows)
+            self.velocity_store = Velocity_Store(velocity_windows)
+        self._job_codes = None
+        self._one_hot_codes = {}
+        self._category_codes = {}
+        self._scalers = None
+        self._jobs = None
+        self._distance_cache = Distance_Cache()
+
+        if (scaling is not None) & (job_classes is not None):
+            self._compile()
+
+    def fit(self, trimmed_df):
+        """ Fits the scaling and encoding state
+
+        Parameters
+        ----------
+        trimmed_df : df
+            The dataset after removing unneeded columns from source
+
+        """
+        self._scalers = None
+        self._jobs = None
+        self._merchants = None
+        self.partial_fit(trimmed_df)
+
+    def partial_fit(self, trimmed_df):
+        """ Updates the scaling and encoding state with one more chunk of data
+
+        Parameters
+        ----------
+        trimmed_df : df
+            A chunk of the dataset after removing unneeded columns from source
+
+        """
+        if self._scalers is None:
+            # Min Max Scaler is a good choice for all these attributes
+            self._scalers = {col: preprocessing.MinMaxScaler() for col in self.numeric_cols}
+            self._jobs = set()
+            self._merchants = set()
+
+        self.scaling = {}
+        for col, min_max_scaler in self._scalers.items():
+            min_max_scaler.partial_fit(trimmed_df[[col]].astype(np.float64))
+            self.scaling[col] = {'data_min': float(min_max_scaler.data_min_[0]), 
+                                 'data_max': float(min_max_scaler.data_max_[0]),
+                                 'scale': float(min_max_scaler.scale_[0]), 
+                                 'min': float(min_max_scaler.min_[0])}
+
+        # Label Encode the job the same way as LabelEncoder by using the sorted vocabulary
+        self._jobs.update(trimmed_df['job'].unique())
+        self.job_classes = sorted(self._jobs)
+
+        # One hot encoded merchants use the sorted vocabulary as well
+        if 'merchant' in self.one_hot:
+            self._merchants.update(trimmed_df['merchant'].unique())
+            self.merchant_classes = sorted(self._merchants)
+
+        self._compile()
+
+    def _compile(self):
+        """ Builds the lookup tables used while transforming from the fitted state
+        """
+        self._job_codes = {job: code for code, job in enumerate(self.job_classes)}
+        self._job_dtype = np.int16 if len(self.job_classes) <= np.iinfo(np.int16).max else np.int32
+        self._weekday_codes = {day: code for code, day in enumerate(Feature_Transformer.ordered_weekday)}
+        self._month_codes = {month: code for code, month in enumerate(Feature_Transformer.ordered_month)}
+        self._part_of_day_codes = {part: code for code, part in enumerate(Feature_Transformer.ordered_part_of_day)}
+        self._scales = [(self.scaling[col]['scale'], self.scaling[col]['min']) for col in self.numeric_cols]
+        self._category_codes = {}
+
+        # The one hot columns follow the dense features, a block of columns for every one hot encoded column
+        classes = {'job': self.job_classes, 'merchant': self.merchant_classes}
+        self._dense_cols = [col for col in self.feature_names(dense=True) if (col != 'job_enc') | ('job' not in self.one_hot)]
+        self._one_hot_codes = {}
+        offset = len(self._dense_cols)
+        for col in self.one_hot:
+            self._one_hot_codes[col] = {value: offset + code for code, value in enumerate(classes[col])}
+            offset += len(classes[col])
+        self._n_features = offset
+
+    def transform_frame(self, trimmed_df):
+        """ Applies the fitted Scaling and Encoding to a trimmed dataset
+
+        Parameters
+        ----------
+        trimmed_df : df
+            The dataset after removing unneeded columns from source
+
+        Returns
+        -------
+        fraud_features_df
+            The dataset (Pandas Dataframe) containing the encoded categorical and scaled numeric elements in 
+            compact types
+
+        """
+        fraud_features_df = pd.DataFrame(index=trimmed_df.index)
+
+        # Encode the job using the fitted labels and mark jobs never seen as -1
+        fraud_features_df['job_enc'] = trimmed_df['job'].map(self._job_codes).fillna(-1).astype(self._job_dtype)
+
+        # One-hot encode the normalized category
+        for category in Feature_Transformer.categories:
+            fraud_features_df[category] = (trimmed_df['normalized_category'] == category).astype(np.uint8)
+
+        # Ordinal encode weekday, month and part of day using their natural order, -1 when the date is not valid
+        fraud_features_df['txn_weekday'] = trimmed_df['txn_weekday'].astype(object).map(self._weekday_codes).fillna(-1).astype(np.int8)
+        fraud_features_df['txn_month'] = trimmed_df['txn_month'].astype(object).map(self._month_codes).fillna(-1).astype(np.int8)
+        fraud_features_df['part_of_day'] = trimmed_df['part_of_day'].astype(object).map(self._part_of_day_codes).fillna(-1).astype(np.int8)
+
+        # Apply the fitted min max scaling to all numeric columns, scaling in float64 and keeping the result as float32
+        for col, (scale, min_) in zip(self.numeric_cols, self._scales):
+            fraud_features_df['normalized_' + col] = (trimmed_df[col].to_numpy(dtype=np.float64) * scale + min_).astype(np.float32)
+
+        return fraud_features_df
+
+    def transform_matrix(self, trimmed_df):
+        """ Applies the fitted Scaling and Encoding to a trimmed dataset one hot encoding the high cardinality 
+        columns into a sparse matrix, without ever holding the one hot columns dense
+
+        Parameters
+        ----------
+        trimmed_df : df
+            The dataset after removing unneeded columns from source (with the merchant when it is one hot encoded)
+
+        Returns
+        -------
+        X
+            The CSR matrix of float32 final features in the order of feature_names(), only the dense features
+            when no column is one hot encoded
+
+        """
+        # Only the dense features that are not zero are stored
+        dense_X = sparse.csr_matrix(self.transform_frame(trimmed_df)[self._dense_cols].to_numpy(dtype=np.float32))
+        if len(self.one_hot) == 0:
+            return dense_X
+
+        # A single 1 per row for every one hot encoded column, nothing for values never seen
+        rows, cols = [], []
+        for col in self.one_hot:
+            codes = trimmed_df[col].map(self._one_hot_codes[col]).to_numpy(dtype=np.float64)
+            seen = ~np.isnan(codes)
+            rows.append(np.flatnonzero(seen))
+            cols.append(codes[seen].astype(np.int32))
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        one_hot_X = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols - len(self._dense_cols))),
+                                      shape=(len(trimmed_df), self._n_features - len(self._dense_cols)))
+
+        return sparse.hstack([dense_X, one_hot_X], format='csr', dtype=np.float32)
+
+    def feature_names(self, dense=False):
+        """ Provides the names of the final features in the order they are produced
+
+        Parameters
+        ----------
+        dense : bool
+            Whether to only name the features of transform_frame() (with the label encoded job)
+
+        Returns
+        -------
+        feature_names
+            The list of feature names, one hot encoded values are named column=value
+
+        """
+        if dense:
+            return Feature_Transformer.feature_cols + ['normalized_' + col for col in self.numeric_cols[len(Feature_Transformer.numeric_cols):]]
+
+        names = list(self._dense_cols)
+        for col in self.one_hot:
+            names += [f'{col}={value}' for value in sorted(self._one_hot_codes[col], key=self._one_hot_codes[col].get)]
+        return names
+
+    def transform(self, transaction_details, record=True):
+        """ Transforms a single transaction to the final features without building any dataframe
+
+        Parameters
+        ----------
+        transaction_details : dictionary
+            Dictionary of transaction attributes 
+        record : bool
+            Whether the transaction is added to the activity of its card when velocity features are used. 
+            Transactions of the past (such as labeled ones) are only looked up
+
+        Returns
+        -------
+        X_predict
+            A 1 x n float32 array with the final features in the same order as the transformed data (dense, 
+            with the one hot encoded columns as well when there are any)
+
+        """
+        with instrumentation.span('feature_transform'):
+            return self._to_array(self._transform_rows([transaction_details], record), [transaction_details])
+
+    def transform_batch(self, transactions, record=True):
+        """ Transforms a list of transactions to the final features without building any dataframe
+
+        Parameters
+        ----------
+        transactions : list
+            List of dictionaries of transaction attributes 
+        record : bool
+            Whether the transactions are added to the activity of their card when velocity features are used. 
+            They are only added once every transaction has been parsed, so that when one of them cannot be 
+            transformed none of them is added
+
+        Returns
+        -------
+        X_predict
+            A len(transactions) x n float32 array with the final features in the same order as the transformed data
+
+        """
+        with instrumentation.span('feature_transform'):
+            return self._to_array(self._transform_rows(transactions, record), transactions)
+
+    def validate(self, transaction_details):
+        """ Checks that a transaction has every attribute the features are made of in the expected format, so that
+        a malformed transaction is rejected on its own before it is transformed along with others
+
+        Parameters
+        ----------
+        transaction_details : dictionary
+            Dictionary of transaction attributes 
+
+        Raises
+        ------
+        ValueError
+            When the transaction is not a dictionary, misses attributes or has attributes in the wrong format
+
+        """
+        if not isinstance(transaction_details, dict):
+            raise ValueError('A transaction needs to be a JSON object of transaction attributes')
+
+        required_cols = list(Feature_Transformer.required_cols)
+        if self.velocity_store is not None:
+            required_cols += ['cc_num', 'unix_time', 'merchant']
+        if 'merchant' in self.one_hot:
+            required_cols += ['merchant']
+        missing_cols = [col for col in dict.fromkeys(required_cols) if col not in transaction_details]
+        if len(missing_cols) > 0:
+            raise ValueError(f"Transaction is missing {', '.join(missing_cols)}")
+
+        # Parse the attributes the way the features are made of them
+        col = None
+        try:
+            for col in ['category', 'job'] + (['merchant'] if 'merchant' in required_cols else []):
+                if not isinstance(transaction_details[col], str):
+                    raise TypeError()
+            col = 'trans_date_trans_time'
+            datetime.strptime(transaction_details[col], '%Y-%m-%d %H:%M:%S')
+            col = 'dob'
+            datetime.strptime(transaction_details[col], '%Y-%m-%d')
+            for col in ['amt', 'city_pop', 'lat', 'long', 'merch_lat', 'merch_long']:
+                float(transaction_details[col])
+            if self.velocity_store is not None:
+                col = 'unix_time'
+                int(transaction_details[col])
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f'Transaction attribute {col} is not in the expected format')
+
+    def _to_array(self, rows, transactions):
+        """ Returns the rows of final features as a float32 array, setting the one hot encoded columns if any
+        """
+        if len(self.one_hot) == 0:
+            return np.array(rows, dtype=np.float32)
+
+        # Few transactions are transformed at a time so the one hot columns are set in a dense array
+        X_predict = np.zeros((len(rows), self._n_features), dtype=np.float32)
+        dense_X = np.array(rows, dtype=np.float32)
+        X_predict[:, :len(self._dense_cols)] = dense_X[:, 1:] if 'job' in self.one_hot else dense_X
+        for i, transaction_details in enumerate(transactions):
+            for col in self.one_hot:
+                code = self._one_hot_codes[col].get(transaction_details[col])
+                if code is not None:
+                    X_predict[i, code] = 1.0
+
+        return X_predict
+
+    def _transform_rows(self, transactions, record=True):
+        """ Returns the lists of final features of the transactions, adding them to the activity of their card only 
+        once all of them are parsed
+        """
+        rows = [self._parse_row(transaction_details) for transaction_details in transactions]
+
+        # Add the velocity features, which cannot fail now that their attributes are parsed
+        if self.velocity_store is not None:
+            velocity = self.velocity_store.update if record else self.velocity_store.peek
+            for _, numeric_values, card_activity in rows:
+                numeric_values += velocity(*card_activity)
+
+        return [[*encoded, *[value * scale + min_ for value, (scale, min_) in zip(numeric_values, self._scales)]]
+                for encoded, numeric_values, _ in rows]
+
+    def _parse_row(self, transaction_details):
+        """ Returns the encoded values, the numeric values to scale and the parsed attributes of the card activity
+        (None without velocity features) of a single transaction
+        """
+        txn_dt = datetime.strptime(transaction_details['trans_date_trans_time'], '%Y-%m-%d %H:%M:%S')
+
+        # Encode the categorical values
+        job_enc = self._job_codes.get(transaction_details['job'], -1)
+        category_enc = self._encode_category(transaction_details['category'])
+        weekday_enc = float((txn_dt.weekday() + 1) % 7)
+        month_enc = float(txn_dt.month - 1)
+        part_of_day_enc = float(bisect_left([4,8,12,16,21], txn_dt.hour))
+
+        # Parse the numeric values, they are scaled once the velocity features are added
+        numeric_values = [float(transaction_details['amt']), float(transaction_details['city_pop']),
+                          ETL_Pipeline.age(transaction_details['dob']),
+                          self._distance_cache.distance(float(transaction_details['lat']), float(transaction_details['long']),
+                                                        float(transaction_details['merch_lat']), float(transaction_details['merch_long']))]
+
+        # Parse the attributes the activity of the card is kept by
+        card_activity = None
+        if self.velocity_store is not None:
+            card_activity = (Velocity_Store.card_key(transaction_details['cc_num']), int(transaction_details['unix_time']),
+                             float(transaction_details['amt']), transaction_details['merchant'])
+
+            # The merchants of a card are counted by dictionary keys
+            hash(transaction_details['merchant'])
+
+        return [job_enc, *category_enc, weekday_enc, month_enc, part_of_day_enc], numeric_values, card_activity
+
+    def _encode_category(self, category):
+        """ Returns the one hot encoded normalized category, remembering it for the next time
+
+        Parameters
+        ----------
+        category : str
+            Transaction Category
+
+        """
+        category_enc = self._category_codes.get(category)
+        if category_enc is None:
+            normalized_category = ETL_Pipeline.normalize_category(category)
+            category_enc = tuple(float(c == normalized_category) for c in Feature_Transformer.categories)
+            self._category_codes[category] = category_enc
+        return category_enc
+
+    def save(self, file_path):
+        """ Saves the fitted state 
+
+        Parameters
+        ----------
+        file_path : str
+            The full path to the json file
+
+        """
+        with open(file_path, 'w') as f:
+            json.dump({'scaling': self.scaling, 'job_classes': self.job_classes, 
+                       'velocity_windows': self.velocity_windows, 'one_hot': self.one_hot,
+                       'merchant_classes': self.merchant_classes}, f)
+
+        # The activity of the cards is saved next to it so that the velocity features go on from where they were
+        if self.velocity_store is not None:
+            self.velocity_store.save(Feature_Transformer.velocity_file(file_path))
+
+    @staticmethod
+    def load(file_path):
+        """ Loads a fitted state saved earlier
+
+        Parameters
+        ----------
+        file_path : str
+            The full path to the json file
+
+        Returns
+        -------
+        feature_transformer
+            The Feature_Transformer ready to transform
+
+        """
+        with open(file_path, 'r') as f:
+            state = json.load(f)
+        feature_transformer = Feature_Transformer(state['scaling'], state['job_classes'], state.get('velocity_windows'),
+                                                  state.get('one_hot'), state.get('merchant_classes'))
+
+        # Without the activity of the cards the velocity features would all start from nothing
+        if feature_transformer.velocity_store is not None:
+            feature_transformer.velocity_store = Velocity_Store.load(Feature_Transformer.velocity_file(file_path))
+
+        return feature_transformer
+
+    @staticmethod
+    def velocity_file(file_path):
+        """ Provides the npz file the activity of the cards is saved in next to the json file of the fitted state
+
+        Parameters
+        ----------
+        file_path : str
+            The full path to the json file
+
+        """
+        return file_path[:-len('.json')] + '.velocity.npz' if file_path.endswith('.json') else file_path + '.velocity.npz'
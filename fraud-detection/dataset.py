@@ -1,24 +1,28 @@
-from sklearn.model_selection import StratifiedKFold
-from sklearn.model_selection import train_test_split
+import numpy as np
+from scipy import sparse
+from folds import Dataset_Folds
 
 class Fraud_Dataset:
     """
     A class used to represent the Fraud Dataset 
 
+    The folds only hold row indices into X and y, the rows of a fold are copied out when they are asked for
+
+    The features are gathered once into a C contiguous float32 matrix, the type the trees of the model split on, so
+    that neither fitting nor copying out the rows of a fold needs to convert them again
+
     ...
 
     Attributes
     ----------
-    X : object
-        an array holding the feature values
-    y : object
-        an array holding the class label values
+    X : ndarray
+        the float32 array holding the feature values, one row per transaction
+    y : ndarray
+        the array holding the class label values
     _df : df
         the dataframe representing the fraud dataset
-    _training_sets : dict
-        the dictionary holding training data sets by fold as key
-    _testing_sets : dict
-        the dictionary holding testing data sets by fold as key
+    _folds : Dataset_Folds
+        the row indices of the training, testing and validation data sets of every fold
 
     Methods
     -------
@@ -28,9 +32,13 @@ class Fraud_Dataset:
         Get Testing data for the specified fold 
     get_validation_dataset()
         Get Validation data for the specified fold 
+    get_fold_indices()
+        Get the row indices of the training and testing data for the specified fold
+    feature_matrix()
+        Gathers the feature columns into a single float32 matrix
     """
     
-    def __init__(self, transformed_df, class_label_col, n_folds=5):
+    def __init__(self, transformed_df, class_label_col, n_folds=5, cache_size=1, memmap_folder=None):
         """ Initializes the Fraud_Dataset Class
 
         Parameters
@@ -41,29 +49,20 @@ class Fraud_Dataset:
             The name of the column that holds the class label 
         n_folds : int
             The number of folds needed from the data
+        cache_size : int
+            The number of recently used data sets kept after being copied out, 0 turns caching off
+        memmap_folder : str
+            When provided the feature and class label values are memory mapped from files in this folder
 
         """
         self._df = transformed_df
-        self.X = self._df.loc[:, self._df.columns != class_label_col].values
-        self.y = self._df[class_label_col].values.ravel()
-
-        # Perform a K Fold 
-        skf = StratifiedKFold(n_splits=n_folds)
-
-        # Initialize the training and testing sets
-        self._training_sets = {}
-        self._testing_sets = {}
-
-        # Perform K Fold and build the dictionary
-        for i, (train_index, test_index) in enumerate(skf.split(self.X, self.y)):
-            #print(f"Fold {i}:")
-            #print(f"  Train: index={train_index}")
-            training_tuple = (self.X[train_index], self.y[train_index])
-            testing_tuple = (self.X[test_index], self.y[test_index])
-            self._training_sets[i] = training_tuple
-            self._testing_sets[i] = testing_tuple
-
-        #print(self._training_sets)
+        X = Fraud_Dataset.feature_matrix(self._df, self._df.columns[self._df.columns != class_label_col])
+        y = self._df[class_label_col].values.ravel()
+
+        # Perform a K Fold keeping only the row indices of every fold
+        self._folds = Dataset_Folds(X, y, n_folds, cache_size, memmap_folder, 'fraud')
+        self.X = self._folds.X
+        self.y = self._folds.y
     
     def get_training_dataset(self, fold):
         """ Get the Training Dataset
@@ -74,7 +73,7 @@ class Fraud_Dataset:
             The fold for which training data is desired
 
         """
-        return self._training_sets[fold]
+        return self._folds.get_training_data(fold)
 
     def get_testing_dataset(self, fold):
         """ Get the Testing Dataset
@@ -85,7 +84,7 @@ class Fraud_Dataset:
             The fold for which testing data is desired
 
         """
-        return self._testing_sets[fold]
+        return self._folds.get_testing_data(fold)
     
     def get_validation_dataset(self, fold, val_split=0.3):
         """ Get the Validation Dataset
@@ -96,10 +95,93 @@ class Fraud_Dataset:
             The fold for which validation data is desired
 
         """
-        x_train, y_train = self._training_sets[fold]
-        x_train, x_vals, y_train,y_val  = train_test_split(x_train, y_train , 
-                                                                           test_size = val_split, 
-                                                                           stratify=y_train, random_state=0)
-        return x_vals, y_val
+        return self._folds.get_validation_data(fold, val_split)
+
+    def get_fold_indices(self, fold):
+        """ Get the row indices into X and y of the Training and Testing Datasets
+
+        Parameters
+        ----------
+        fold : int
+            The fold for which the indices are desired
+
+        """
+        return self._folds.get_fold_indices(fold)
        
-    
\ No newline at end of file
+    
+
+    @staticmethod
+    def feature_matrix(df, feature_cols):
+        """ Gathers the feature columns into a single C contiguous float32 matrix, column by column so that the
+        compact columns are converted straight into it without an intermediate float64 copy
+
+        Parameters
+        ----------
+        df : df
+            The dataset (Pandas Dataframe) holding the features
+        feature_cols : list
+            The names of the feature columns in order
+
+        Returns
+        -------
+        X
+            The len(df) x len(feature_cols) float32 array
+        """
+        X = np.empty((len(df), len(feature_cols)), dtype=np.float32)
+        for j, col in enumerate(feature_cols):
+            X[:, j] = df[col].to_numpy()
+
+        return X
+
+class Sparse_Fraud_Dataset(Fraud_Dataset):
+    """
+    A class used to represent the Fraud Dataset with sparse features, such as the one hot encoded jobs and
+    merchants of ETL_Pipeline.process_sparse()
+
+    The folds gather the rows of the CSR matrix without densifying it, so the data sets are CSR matrices as well 
+    which the Random Forest trains on directly
+
+    ...
+
+    Attributes
+    ----------
+    X : csr_matrix
+        the float32 CSR matrix holding the feature values, one row per transaction
+    y : ndarray
+        the array holding the class label values
+    _folds : Dataset_Folds
+        the row indices of the training, testing and validation data sets of every fold
+
+    Methods
+    -------
+    get_training_dataset()
+        Get Training data for the specified fold 
+    get_testing_dataset()
+        Get Testing data for the specified fold 
+    get_validation_dataset()
+        Get Validation data for the specified fold 
+    get_fold_indices()
+        Get the row indices of the training and testing data for the specified fold
+    """
+
+    def __init__(self, X, y, n_folds=5, cache_size=1):
+        """ Initializes the Sparse_Fraud_Dataset Class
+
+        Parameters
+        ----------
+        X : csr_matrix
+            The sparse feature values
+        y : ndarray
+            The class label values
+        n_folds : int
+            The number of folds needed from the data
+        cache_size : int
+            The number of recently used data sets kept after being copied out, 0 turns caching off
+
+        """
+        self._df = None
+
+        # Perform a K Fold keeping only the row indices of every fold
+        self._folds = Dataset_Folds(sparse.csr_matrix(X, dtype=np.float32), np.asarray(y).ravel(), n_folds, cache_size)
+        self.X = self._folds.X
+        self.y = self._folds.y
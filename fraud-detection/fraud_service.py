@@ -1,15 +1,22 @@
 from flask import Flask
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 import sys
 import os
+import json
 
 from data_pipeline import ETL_Pipeline 
-from dataset import Fraud_Dataset
+from dataset import Fraud_Dataset, Sparse_Fraud_Dataset
 from model import Fraud_Detector_Model
 from metrics import Metrics
+from coalescer import Request_Coalescer
+from metrics_cache import Metrics_Cache
+from instrumentation import instrumentation
 
 app = Flask(__name__)
 
+# Time every request by endpoint when the instrumentation environment variable is set
+instrumentation.instrument_app(app)
+
 """
 A class used to provides an REST API to detect if a given transaction is fraudulent or not
 
@@ -19,9 +26,25 @@ As a part of service initialization we will read the training data, clean it, sc
 Methods
 -------
 getStats()
-    Will run the testing data through the model to return the metrics. To execute you use GET http://localhost:8786/stats
+    Will return the metrics of the model on the testing data, computed in the background whenever the model changes. 
+    To execute you use GET http://localhost:8786/stats
 detect_fraud()
     Will determine if the supplied transaction is fraudulent or not. To execute you use POST http://localhost:8786/detect-fraud
+    Concurrent requests are coalesced into batches of up to max-batch-size transactions waiting at most batch-wait-ms
+    The fraud probability is returned as well and it is compared to the fraud-threshold, which a request can override 
+    with ?threshold=<value between 0 and 1>. When velocity-features is set every transaction scored is added to the 
+    recent activity of its card, which is kept in memory for the most recently active cards
+detect_fraud_batch()
+    Will determine for each supplied transaction if it is fraudulent or not. To execute you use POST http://localhost:8786/detect-fraud-batch
+    with a JSON array of transactions or with NDJSON (one transaction per line and Content-Type application/x-ndjson)
+getCoalescerStats()
+    Will provide the batch sizes achieved while coalescing requests. To execute you use GET http://localhost:8786/coalescer-stats
+update_model()
+    Will add trees trained on the supplied labeled transactions to the model while it keeps serving. To execute you use 
+    POST http://localhost:8786/update-model with a JSON array of transactions that include is_fraud, and GET for the updates so far
+getMetrics()
+    Will provide the request latency per endpoint and the time spent parsing, transforming, scoring and serializing as 
+    Prometheus metrics when the instrumentation environment variable is set. To execute you use GET http://localhost:8786/metrics
 
     Sample JSON as body below
 
@@ -77,6 +100,11 @@ def getStats():
         A good metric for this model as it measures optimality with precision and recall
     Average Precision Score : float
         A good alternatives for ROC AUC if imbalance is high
+    status : dict
+        The freshness of the metrics. state is fresh when they are for the current model version, stale while 
+        the metrics of a newer version are computed and pending before the first ones are ready. When testing 
+        fails error holds the error and failed_version the model version, which is not tested again until the 
+        model changes
 
     Sample JSON Below
 
@@ -89,9 +117,41 @@ def getStats():
         "ROC AUC Score": 0.8121015145716798,
         "Recall": 0.6246632124352332,
         "Sensitivity": 0.6246632124352332,
-        "Specificity": 0.9995398167081265
+        "Specificity": 0.9995398167081265,
+        "status": {
+            "compute_seconds": 1.92,
+            "computed_at": "2024-01-02T10:15:00",
+            "computing": false,
+            "error": null,
+            "failed_version": null,
+            "metrics_version": 1,
+            "model_version": 1,
+            "state": "fresh"
+        }
     }
 
+    """
+    # Return the cached metrics, which are refreshed in the background when the model changed
+    statistics, status = metrics_cache.get()
+    response = dict(statistics) if statistics is not None else {}
+    response['status'] = status
+
+    return jsonify(response)
+
+def get_statistics(X_test, y_test):
+    """ Runs the testing data through the model to compute its metrics
+
+    Parameters
+    ----------
+    X_test : ndarray
+        Data used for testing the model specifically the features
+    y_test : ndarray
+        Data used for testing the model specifically the class labels
+
+    Returns
+    ----------
+    statistics : dict
+        The metrics by the names returned from /stats
     """
     # Obtain the metrics 
     acc, acc_bal, specificity, sensitivity, prec, recall, f1, roc_auc, avg_prec = model.test(X_test, y_test)
@@ -108,8 +168,28 @@ def getStats():
     statistics['ROC AUC Score'] = roc_auc
     statistics['Average Precision Score'] = avg_prec
 
-    # Return the statistics encoded as Json
-    return jsonify(statistics)
+    return statistics
+
+def get_threshold():
+    """ Reads the decision threshold of the request, falling back to the fraud-threshold of the service
+
+    Returns
+    ----------
+    threshold : float
+        The fraud probability from which a transaction is fraud, None to pick the most probable class
+    """
+    threshold = request.args.get('threshold')
+    if threshold is None:
+        return fraud_threshold
+
+    try:
+        threshold = float(threshold)
+    except ValueError:
+        raise ValueError(f"Threshold {threshold} is not a number")
+    if not (0.0 <= threshold <= 1.0):
+        raise ValueError(f"Threshold {threshold} is not between 0 and 1")
+
+    return threshold
 
 @app.route('/detect-fraud', methods=['POST'])
 def detect_fraud():
@@ -162,6 +242,14 @@ def detect_fraud():
     merch_long : str
         Longitude of merchant/vendor
 
+    The query parameter threshold (between 0 and 1) overrides the fraud-threshold for this request
+
+    Returns
+    ----------
+    Json with is_fraud, the fraud probability as fraud_score and the threshold it was compared to (null when the 
+    most probable class is picked), or error with status 400 when the threshold or the transaction is not valid 
+    (missing attributes or attributes in the wrong format)
+
     Sample JSON Below
 
     {
@@ -189,62 +277,389 @@ def detect_fraud():
     }
 
     """
+    # Obtain the threshold for this request
+    try:
+        threshold = get_threshold()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     # Obtain request payload as a dictionary
-    transaction_details = request.json
+    with instrumentation.span('json_parse'):
+        transaction_details = request.json
+
+    # Pass dictionary data to model's scoring to get the fraud probability. The coalescer scores it along with
+    # other transactions that arrive at the same time, so it is validated first to keep a malformed transaction
+    # from failing the others
+    try:
+        model.feature_transformer.validate(transaction_details)
+        fraud_score = coalescer.predict(transaction_details)
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Pass dictionary data to model's prediction to detect if fraud or not
-    is_fraud = model.predict(transaction_details)
+    # Decide if its fraud for the threshold of this request
+    is_fraud = bool(Fraud_Detector_Model.decide(fraud_score, threshold))
 
     # Return the result as Json
-    return jsonify({"is_fraud":is_fraud})
+    with instrumentation.span('serialization'):
+        return jsonify({"is_fraud":is_fraud, "fraud_score":fraud_score, "threshold":threshold})
 
-if __name__ == "__main__":
+@app.route('/detect-fraud-batch', methods=['POST'])
+def detect_fraud_batch():
+    """ Detects for each transaction in a batch if it is fraudulent or not
+        
+    Parameters 
+    ----------
+    Either a JSON array of transactions or NDJSON with one transaction per line (Content-Type application/x-ndjson). 
+    Every transaction has the same mandatory attributes as for /detect-fraud. The query parameter threshold applies as 
+    for /detect-fraud
+
+    Returns
+    ----------
+    For a JSON array, a JSON array with is_fraud and fraud_score for each transaction in the same order
+
+    [
+        {"is_fraud": false, "fraud_score": 0.02},
+        {"is_fraud": true, "fraud_score": 0.91}
+    ]
+
+    For NDJSON, NDJSON with is_fraud and fraud_score for each transaction in the same order, streamed back 
+    max-batch-size transactions at a time
+
+    A JSON array with a transaction that is not valid returns error with status 400 (naming the transaction by its 
+    position). As NDJSON is streamed back before it is read to the end, a line that is not a valid transaction ends 
+    the response with a line holding the error instead
+
+    """
+    # Obtain the threshold for this request
+    try:
+        threshold = get_threshold()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def predictions(transactions):
+        # Score the transactions with a single call to the model and decide on the scores
+        fraud_score = model.score_batch(transactions)
+        is_fraud = Fraud_Detector_Model.decide(fraud_score, threshold).tolist()
+        return [{"is_fraud":prediction, "fraud_score":score} for prediction, score in zip(is_fraud, fraud_score)]
+
+    def validate(transaction_details, position):
+        # Name the transaction that is not valid by its position in the request
+        try:
+            model.feature_transformer.validate(transaction_details)
+        except ValueError as e:
+            raise ValueError(f'Transaction {position}: {e}')
+
+    if request.mimetype != 'application/x-ndjson':
+        # Predict the whole array with a single call to the model
+        with instrumentation.span('json_parse'):
+            transactions = request.json
+        try:
+            if not isinstance(transactions, list):
+                raise ValueError('Provide a JSON array of transactions')
+            for position, transaction_details in enumerate(transactions):
+                validate(transaction_details, position)
+            results = predictions(transactions)
+        except (KeyError, ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
+        with instrumentation.span('serialization'):
+            return jsonify(results)
+
+    def generate():
+        # Read the transactions line by line and predict every max-batch-size of them together
+        transactions = []
+        position = 0
+        for line in request.stream:
+            if line.strip():
+                try:
+                    transaction_details = json.loads(line)
+                    validate(transaction_details, position)
+                except ValueError as e:
+                    # The predictions of the transactions before it are still sent
+                    for prediction in (predictions(transactions) if len(transactions) > 0 else []):
+                        yield json.dumps(prediction) + '\n'
+                    yield json.dumps({"error": str(e)}) + '\n'
+                    return
+                transactions.append(transaction_details)
+                position += 1
+            if len(transactions) == max_batch_size:
+                for prediction in predictions(transactions):
+                    yield json.dumps(prediction) + '\n'
+                transactions = []
+
+        if len(transactions) > 0:
+            for prediction in predictions(transactions):
+                yield json.dumps(prediction) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/coalescer-stats', methods=['GET'])
+def getCoalescerStats():
+    """ Provides the batch sizes achieved while coalescing /detect-fraud requests
+        
+    Returns
+    ----------
+    Json with following attributes
+
+    max_batch_size : int
+        The maximum number of requests predicted together
+    max_wait_ms : float
+        The maximum time in milliseconds the first request of a batch waits for others to join
+    batches : int
+        The number of batches predicted
+    requests : int
+        The number of requests predicted
+    mean_batch_size : float
+        The average number of requests per batch
+    batch_size_histogram : dict
+        The number of batches for every achieved batch size
+
+    Sample JSON Below
+
+    {
+        "batch_size_histogram": {"1": 120, "2": 31, "7": 4},
+        "batches": 155,
+        "max_batch_size": 32,
+        "max_wait_ms": 2.0,
+        "mean_batch_size": 1.36,
+        "requests": 210
+    }
+
+    """
+    return jsonify(coalescer.get_stats())
+
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    """ Provides the timings of the service in the Prometheus text format
+        
+    Returns
+    ----------
+    Histograms of the request latency by endpoint (http_request_duration_seconds) and of the time spent in every step 
+    of the hot path (span_duration_seconds with span json_parse, feature_transform, inference, coalescer_wait, 
+    serialization and at startup etl and training), along with the requests by endpoint and status (http_requests_total). 
+    Status 404 when the instrumentation environment variable is not set. With several gunicorn workers every worker 
+    reports its own requests
+
+    Sample Text Below
+
+    # HELP span_duration_seconds Time spent in every step of the hot path
+    # TYPE span_duration_seconds histogram
+    span_duration_seconds_bucket{span="inference",le="0.0005"} 1520
+    ...
+    span_duration_seconds_bucket{span="inference",le="+Inf"} 1536
+    span_duration_seconds_sum{span="inference"} 0.512
+    span_duration_seconds_count{span="inference"} 1536
+
+    """
+    if not instrumentation.enabled:
+        return jsonify({"error": "Instrumentation is disabled, set the instrumentation environment variable to true"}), 404
+
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/update-model', methods=['GET', 'POST'])
+def update_model():
+    """ Adds trees trained on new labeled transactions to the model, which is swapped in once they are trained
+        
+    Parameters 
+    ----------
+    For POST, a JSON array of transactions with the same mandatory attributes as for /detect-fraud plus is_fraud 
+    (0 or 1). Both fraudulent and valid transactions need to be present. The number of trees added per update is update-trees 
+    and the forest keeps at most max-trees, evicting the oldest trees first
+
+    Returns
+    ----------
+    For POST, Json with following attributes (or error with status 400 when the transactions cannot be used)
+
+    version : int
+        The version of the model after the update
+    rows : int
+        The number of transactions the new trees were trained on
+    trees_added : int
+        The number of trees trained on the transactions
+    trees_evicted : int
+        The number of oldest trees removed to stay within max-trees
+    n_estimators : int
+        The number of trees in the model after the update
+    fit_time : float
+        The time in seconds taken to train the new trees
+
+    For GET, a JSON array with the above for every update so far
+
+    Sample JSON Below
+
+    {
+        "fit_time": 0.41,
+        "n_estimators": 210,
+        "rows": 5000,
+        "trees_added": 10,
+        "trees_evicted": 0,
+        "version": 2
+    }
+
+    """
+    if request.method == 'GET':
+        return jsonify(model.update_history)
+
+    # Transform the labeled transactions with the scaling and encoding fitted on the training data. They happened in 
+    # the past so they are not added to the recent activity of their cards
+    transactions = request.json
+    try:
+        # Check every transaction and its label before training, naming the first one that cannot be used
+        if not isinstance(transactions, list):
+            raise ValueError('Provide a JSON array of labeled transactions')
+        if len(transactions) == 0:
+            raise ValueError('Provide at least one labeled transaction')
+        for position, transaction_details in enumerate(transactions):
+            try:
+                model.feature_transformer.validate(transaction_details)
+            except ValueError as e:
+                raise ValueError(f'Transaction {position}: {e}')
+            if 'is_fraud' not in transaction_details:
+                raise ValueError(f'Transaction {position}: Transaction is missing is_fraud')
+            if (not isinstance(transaction_details['is_fraud'], int)) or (transaction_details['is_fraud'] not in [0, 1]):
+                raise ValueError(f'Transaction {position}: is_fraud needs to be 0 or 1')
+
+        X_new = model.feature_transformer.transform_batch(transactions, record=False)
+        y_new = [int(transaction_details['is_fraud']) for transaction_details in transactions]
+        update = model.update(X_new, y_new, update_trees, max_trees)
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    print(f"Updated Fraud Model to version {update['version']} with {update['rows']} transactions in {update['fit_time']:.2f} s")
+
+    # Start testing the updated model in the background
+    metrics_cache.refresh()
+
+    return jsonify(update)
+
+def initialize(args, preload=False):
     """ Initializes the Fraud Service Class
 
     It does the following as a part of initialization
 
+    When started with --model-artifact <folder> (or the model-artifact environment variable) and the folder holds a 
+    saved model, the model and its metrics are loaded from it and steps 1 to 4 are skipped. Otherwise the steps run 
+    and the trained model is saved to the folder
+
     1. Initialize the ETL_Pipeline and use it to process the training data to get the features we need
     2. Initialize Fraud_Dataset to get the training data split
     3. Initialize the Metrics class used to generate and provide latest statistics
     4. Initialize the Fraud_Detector_Model to train the classifier on the training data  
+    5. Initialize the Request_Coalescer that batches concurrent /detect-fraud requests
+
+    Afterwards the model can be updated with new labeled transactions through /update-model
+
+    Parameters
+    ----------
+    args : list
+        The command line arguments without the script name, the environment variables are used when there are none
+    preload : bool
+        True when the service is loaded in the gunicorn master before the workers are forked. The model is then 
+        tested by every worker on its first /stats request instead of holding up the start
     """
-    flaskPort = 8786
+    global model, coalescer, metrics_cache, max_batch_size, fraud_threshold, update_trees, max_trees
 
-    # Get command line arguments
-    if (len(sys.argv)>1):
-        data_folder                 = sys.argv[1]
-        fraud_training_data_file    = sys.argv[2]
-    else: 
-        data_folder = os.environ['data-folder']
-        fraud_training_data_file = os.environ['training-data-file']
+    # Get the batching knobs
+    max_batch_size = int(os.environ.get('max-batch-size', 32))
+    batch_wait_ms = float(os.environ.get('batch-wait-ms', 2.0))
+
+    # Fraud probability from which a transaction is fraud, the most probable class is picked when not set
+    fraud_threshold = float(os.environ['fraud-threshold']) if 'fraud-threshold' in os.environ else None
+
+    # Trees added by every update of the model and the most trees it keeps
+    update_trees = int(os.environ.get('update-trees', 10))
+    max_trees = int(os.environ.get('max-trees', 300))
 
-    # Process the Data needed to train the model
-    print(f'Start an ETL_Pipeline to load training data with shared folder = {data_folder} and training data file = {fraud_training_data_file}')
-    dp = ETL_Pipeline(data_folder)
-    df = dp.process(fraud_training_data_file)
+    # Add the recent activity of the card (count, amount and merchants over 1h, 24h and 7d) to the features
+    velocity = os.environ.get('velocity-features', 'false').lower() in ['1', 'true', 'yes']
 
-    # Initialize the metrics
-    print('Successfully processed and created feature data and initialized metrics')
-    metrics = Metrics()
+    # One hot encode these high cardinality columns (job, merchant or both separated by a comma) into sparse features
+    one_hot = [col.strip() for col in os.environ.get('one-hot', '').split(',') if col.strip() != '']
 
-    # Create a fraud dataset with single fold
-    fd = Fraud_Dataset(df,'is_fraud',2)
-    print('Successfully created Fraud Dataset')
+    # Stream the training data in chunks of this many rows when it is too large to be read whole
+    chunk_size = int(os.environ['chunk-size']) if 'chunk-size' in os.environ else None
 
-    # Obtain the training data
-    X_train, y_train = fd.get_training_dataset(0)
-    X_test, y_test = fd.get_testing_dataset(0)
-    X_val, y_val = fd.get_validation_dataset(0)
-    print('Successfully created training and testing data using K-Fold')
+    # Get command line arguments, --model-artifact <folder> can be given along with them
+    args = list(args)
+    model_artifact = os.environ.get('model-artifact')
+    if '--model-artifact' in args:
+        i = args.index('--model-artifact')
+        model_artifact = args[i + 1]
+        del args[i:i + 2]
 
-    # Train the Model
-    model = Fraud_Detector_Model()
-    print('Successfully created Fraud Data Model')
+    if (len(args)>0):
+        data_folder                 = args[0]
+        fraud_training_data_file    = args[1]
+    else: 
+        data_folder = os.environ.get('data-folder')
+        fraud_training_data_file = os.environ.get('training-data-file')
+
+    if (model_artifact is not None) and Fraud_Detector_Model.has_artifact(model_artifact):
+        # Serve the saved model without processing the training data or training
+        print(f'Loading Fraud Model from {model_artifact}')
+        model, statistics = Fraud_Detector_Model.load(model_artifact)
+        print(f'Successfully loaded Fraud Model version {model.version}')
+
+        # The testing data is not at hand so the metrics saved with the model are served as they are
+        metrics_cache = Metrics_Cache(None, lambda: model.version)
+        metrics_cache.put(model.version, statistics)
+    else:
+        # Process the Data needed to train the model
+        print(f'Start an ETL_Pipeline to load training data with shared folder = {data_folder} and training data file = {fraud_training_data_file}')
+        dp = ETL_Pipeline(data_folder, velocity, one_hot)
+        with instrumentation.span('etl'):
+            if len(one_hot) > 0:
+                X, y = dp.process_sparse(fraud_training_data_file, chunk_size)
+            else:
+                df = dp.process(fraud_training_data_file, chunk_size)
+
+        # Initialize the metrics
+        print('Successfully processed and created feature data and initialized metrics')
+        metrics = Metrics()
+
+        # Create a fraud dataset with single fold, the sparse features stay sparse through training
+        fd = Sparse_Fraud_Dataset(X, y, 2) if len(one_hot) > 0 else Fraud_Dataset(df,'is_fraud',2)
+        print('Successfully created Fraud Dataset')
+
+        # Obtain the training data
+        X_train, y_train = fd.get_training_dataset(0)
+        X_test, y_test = fd.get_testing_dataset(0)
+        X_val, y_val = fd.get_validation_dataset(0)
+        print('Successfully created training and testing data using K-Fold')
+
+        # Train the Model
+        model = Fraud_Detector_Model(feature_transformer=dp.feature_transformer)
+        print('Successfully created Fraud Data Model')
+
+        with instrumentation.span('training'):
+            model.train(X_train, y_train, X_val, y_val)
+        print('Successfully trained Fraud Model')
+
+        # Compile the forest for fast single transaction predictions, checked against the testing data
+        if model.compile(X_test):
+            print('Successfully compiled Fraud Model')
+
+        # Test the model in the background, /stats returns the metrics from then on
+        metrics_cache = Metrics_Cache(lambda: get_statistics(X_test, y_test), lambda: model.version)
+        if not preload:
+            metrics_cache.refresh()
+
+        # Save the model with its metrics so that the next start skips training, this waits for the model to be tested
+        if model_artifact is not None:
+            model.save(model_artifact, metrics_cache.wait(), X_test[:1000])
+            print(f'Successfully saved Fraud Model to {model_artifact}')
+
+    # Coalesce concurrent single transaction requests into batches, the fraud probabilities are decided on per request.
+    # A batch is transformed (and added to the activity of the cards) once, and scored again row by row if it fails
+    coalescer = Request_Coalescer(lambda X_predict: model.score_features(X_predict).tolist(), max_batch_size,
+                                  batch_wait_ms, model.feature_transformer.transform_batch)
+    print(f'Successfully created Request Coalescer with max batch size = {max_batch_size} and wait window = {batch_wait_ms} ms')
 
-    model.train(X_train, y_train, X_val, y_val)
-    print('Successfully trained Fraud Model')
+if __name__ == "__main__":
+    flaskPort = 8786
+
+    # Initialize the service from the command line arguments
+    initialize(sys.argv[1:])
 
     # Now that all the setup has been done start the service
     print('Starting Server...')
-    app.run(host = '0.0.0.0', port = flaskPort)
-
+    app.run(host = '0.0.0.0', port = flaskPort, threaded = True)
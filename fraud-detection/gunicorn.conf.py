@@ -0,0 +1,40 @@
+import gc
+import os
+
+"""
+Gunicorn settings for serving the service in production
+
+    python -m gunicorn -c gunicorn.conf.py wsgi:app
+
+The application (data, model) is loaded once in the master process and the worker processes are forked from it, so
+they share its memory copy on write instead of each loading their own copy. Every worker serves requests with a
+pool of threads
+
+Environment variables
+---------------------
+workers : int
+    The number of worker processes (defaults to the number of CPUs)
+threads : int
+    The number of threads serving requests in every worker (defaults to 4)
+port : int
+    The port to listen on (defaults to 8786 like the development server)
+worker-timeout : int
+    The seconds a request may take before its worker is restarted (defaults to 120)
+"""
+
+bind = '0.0.0.0:' + os.environ.get('port', '8786')
+workers = int(os.environ.get('workers', os.cpu_count()))
+threads = int(os.environ.get('threads', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('worker-timeout', 120))
+
+# Load the application in the master before forking the workers
+preload_app = True
+
+def when_ready(server):
+    """ Called in the master once the application is loaded and before the workers are forked
+    """
+    # Keep the garbage collector of the workers away from the objects loaded so far. Collecting them would write
+    # to their pages and turn the shared memory into a private copy in every worker
+    gc.collect()
+    gc.freeze()
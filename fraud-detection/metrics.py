@@ -1,12 +1,4 @@
 import numpy as np
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
-from sklearn.metrics import f1_score
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import average_precision_score
-from sklearn.metrics import accuracy_score
-from sklearn.metrics import balanced_accuracy_score
 
 class Metrics:
     """
@@ -29,6 +21,17 @@ class Metrics:
         7. F1 Score
         8. ROC AUC Score
         9. Average Precision Score
+    confusion()
+        Counts true negatives, false positives, false negatives and true positives in a single pass
+    ranking()
+        Counts positives and negatives above every distinct score with a single sort
+    from_counts()
+        Derives all metrics from the confusion matrix and the ranking counts
+    threshold_sweep()
+        Precision, recall, alert rate and cost of deciding at every distinct score with a single sort
+
+    All metrics match the ones of sklearn (including ties between scores for ROC AUC and Average Precision)
+    for binary class labels 0 and 1
 
     """
     def __init__(self):
@@ -96,8 +99,8 @@ class Metrics:
 
         f.close() 
 
-    def run(self, y_val, y_pred, dataset='Testing'):
-        """ Calculates the various metrics
+    def run(self, y_val, y_pred, dataset='Testing', y_score=None):
+        """ Calculates the various metrics from one confusion matrix and one ranking
 
         Parameters
         ----------
@@ -107,6 +110,9 @@ class Metrics:
             The predicted values for the observations
         dataset : str
             The type of dataset. Defaults to 'Testing'
+        y_score : ndarray
+            The scores (such as fraud probabilities) used for ROC AUC and Average Precision. Defaults to the 
+            predicted values
 
         Returns
         ----------
@@ -129,18 +135,281 @@ class Metrics:
         Average Precision Score : float
             A good alternatives for ROC AUC if imbalance is high
         """
-        # Get the core metrics from confusion matrix
-        tn, fp, fn, tp = confusion_matrix(y_val, y_pred).ravel()
-
-        # Initialize Metric Arrays 
-        acc             = accuracy_score(y_val, y_pred) 
-        balanced_acc    = balanced_accuracy_score(y_val, y_pred) 
-        specificity     = tn / (tn + fp)
-        sensitivity     = tp / (tp + fn)
-        precision       = precision_score(y_val, y_pred)
-        recall          = recall_score(y_val, y_pred)
-        f1              = f1_score(y_val, y_pred)
-        roc_auc         = roc_auc_score(y_val, y_pred)
-        avg_prec_score  = average_precision_score(y_val, y_pred)
-
-        return (acc, balanced_acc, specificity, sensitivity, precision, recall, f1, roc_auc, avg_prec_score)
\ No newline at end of file
+        # Count the confusion matrix once and derive every metric from it
+        counts = Metrics.confusion(y_val, y_pred)
+
+        # Rank by the scores when given, otherwise by the predicted classes which needs no sorting
+        if y_score is None:
+            tn, fp, fn, tp = counts
+            tps = np.array([tp, tp + fn])
+            fps = np.array([fp, fp + tn])
+            keep = (tps + fps) > 0
+            ranking = (tps[keep], fps[keep])
+        else:
+            ranking = Metrics.ranking(y_val, y_score)
+
+        return Metrics.from_counts(*counts, *ranking)
+
+    @staticmethod
+    def confusion(y_val, y_pred):
+        """ Counts the confusion matrix of binary class labels with a single bincount
+
+        Parameters
+        ----------
+        y_val : ndarray
+            The ground truth for the data (0 or 1)
+        y_pred : ndarray
+            The predicted values for the observations (0 or 1)
+
+        Returns
+        ----------
+        counts : tuple
+            The number of true negatives, false positives, false negatives and true positives
+        """
+        y_val = np.asarray(y_val)
+        y_pred = np.asarray(y_pred)
+        if len(y_val) != len(y_pred):
+            raise ValueError(f'Found {len(y_val)} labels but {len(y_pred)} predictions')
+
+        # Both arrays need to be binary for the cell numbers below to be right
+        for y in [y_val, y_pred]:
+            if (len(y) > 0) and ((y.min() < 0) or (y.max() > 1)):
+                raise ValueError('Only binary class labels 0 and 1 are supported')
+
+        # Cell number 2 * truth + prediction is 0 for TN, 1 for FP, 2 for FN and 3 for TP
+        cells = y_val.astype(np.uint8) << 1
+        cells |= y_pred.astype(np.uint8)
+        tn, fp, fn, tp = np.bincount(cells, minlength=4)
+
+        return int(tn), int(fp), int(fn), int(tp)
+
+    @staticmethod
+    def ranking(y_val, y_score, return_thresholds=False):
+        """ Counts true and false positives above every distinct score with a single sort, tied scores together
+
+        Parameters
+        ----------
+        y_val : ndarray
+            The ground truth for the data (0 or 1)
+        y_score : ndarray
+            The scores for the observations, higher meaning more likely to be 1
+        return_thresholds : bool
+            Whether the distinct scores are returned as well
+
+        Returns
+        ----------
+        tps : ndarray
+            The number of true positives at or above every distinct score, from the highest score down
+        fps : ndarray
+            The number of false positives at or above every distinct score, from the highest score down
+        thresholds : ndarray
+            The distinct scores from the highest down, only when return_thresholds is True
+        """
+        y_val = np.asarray(y_val)
+        y_score = np.asarray(y_score)
+
+        # Sort by decreasing score and keep the last position of every run of tied scores
+        order = np.argsort(y_score, kind='mergesort')[::-1]
+        y_score = y_score[order]
+        threshold_idxs = np.r_[np.flatnonzero(np.diff(y_score)), len(y_score) - 1]
+
+        tps = np.cumsum(y_val[order], dtype=np.int64)[threshold_idxs]
+        fps = 1 + threshold_idxs - tps
+
+        if return_thresholds:
+            return tps, fps, y_score[threshold_idxs]
+        return tps, fps
+
+    @staticmethod
+    def threshold_sweep(y_val, y_score, cost_fp=1.0, cost_fn=10.0):
+        """ Evaluates deciding fraud at every distinct score (score >= threshold) with a single sort
+
+        Parameters
+        ----------
+        y_val : ndarray
+            The ground truth for the data (0 or 1)
+        y_score : ndarray
+            The fraud probabilities of the observations
+        cost_fp : float
+            The cost of a false alert (a valid transaction flagged as fraud)
+        cost_fn : float
+            The cost of a missed fraud
+
+        Returns
+        ----------
+        sweep : dict
+            Arrays of threshold, tp, fp, fn, tn, precision, recall, alert_rate and cost with one entry per
+            distinct score from the highest down, preceded by an infinite threshold that flags nothing
+        """
+        y_val = np.asarray(y_val)
+        n = len(y_val)
+        n_pos = int(np.count_nonzero(y_val))
+        n_neg = n - n_pos
+
+        tps, fps, thresholds = Metrics.ranking(y_val, y_score, return_thresholds=True)
+        tps = np.r_[0, tps]
+        fps = np.r_[0, fps]
+        alerts = tps + fps
+
+        return {'threshold': np.r_[np.inf, thresholds],
+                'tp': tps,
+                'fp': fps,
+                'fn': n_pos - tps,
+                'tn': n_neg - fps,
+                'precision': np.divide(tps, alerts, out=np.zeros(len(tps)), where=alerts > 0),
+                'recall': tps / n_pos if n_pos > 0 else np.zeros(len(tps)),
+                'alert_rate': alerts / n if n > 0 else np.zeros(len(tps)),
+                'cost': cost_fp * fps + cost_fn * (n_pos - tps)}
+
+    @staticmethod
+    def from_counts(tn, fp, fn, tp, tps, fps):
+        """ Derives all metrics from the confusion matrix and the ranking counts
+
+        Parameters
+        ----------
+        tn, fp, fn, tp : int
+            The confusion matrix as returned by confusion()
+        tps, fps : ndarray
+            The true and false positives above every distinct score as returned by ranking()
+
+        Returns
+        ----------
+        metrics : tuple
+            The same metrics in the same order as run()
+        """
+        n = tn + fp + fn + tp
+        n_pos = tp + fn
+        n_neg = tn + fp
+
+        acc             = (tn + tp) / n if n > 0 else 0.0
+        specificity     = tn / n_neg if n_neg > 0 else np.nan
+        sensitivity     = tp / n_pos if n_pos > 0 else np.nan
+        precision       = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+        recall          = tp / n_pos if n_pos > 0 else 0.0
+        f1              = 2 * tp / (2 * tp + fp + fn) if (2 * tp + fp + fn) > 0 else 0.0
+
+        # Balanced accuracy averages the recall of the classes present in the ground truth
+        class_recalls   = [r for r in [specificity, sensitivity] if not np.isnan(r)]
+        balanced_acc    = float(np.mean(class_recalls)) if len(class_recalls) > 0 else 0.0
+
+        # ROC AUC is the area under the curve through every distinct score, starting at (0, 0)
+        if (n_pos > 0) and (n_neg > 0):
+            tpr = np.r_[0, tps] / n_pos
+            fpr = np.r_[0, fps] / n_neg
+            roc_auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1])) / 2)
+        else:
+            roc_auc = np.nan
+
+        # Average precision weighs the precision at every distinct score by the recall it adds
+        if n_pos > 0:
+            precisions = tps / (tps + fps)
+            avg_prec_score = float(np.sum(np.diff(np.r_[0, tps / n_pos]) * precisions))
+        else:
+            avg_prec_score = 0.0
+
+        return (acc, balanced_acc, specificity, sensitivity, precision, recall, f1, roc_auc, avg_prec_score)
+
+class Metrics_Accumulator:
+    """
+    A class used to accumulate the Metrics over batches of predictions
+
+    Only the confusion matrix and the number of positives and negatives for every distinct score are kept, so
+    predictions can be added batch by batch without holding them all. The result is the same as Metrics.run
+    on all the batches together. When the scores take too many distinct values to keep, n_bins rounds scores
+    between 0 and 1 down to that many bins, which bounds memory but makes ROC AUC and Average Precision
+    approximate
+
+    ...
+
+    Attributes
+    ----------
+    counts : ndarray
+        the number of true negatives, false positives, false negatives and true positives so far
+    n_bins : int
+        the number of bins scores are rounded to, None to keep every distinct score
+    _scores : ndarray
+        the distinct scores seen so far in increasing order
+    _positives : ndarray
+        the number of positives for every distinct score
+    _negatives : ndarray
+        the number of negatives for every distinct score
+
+    Methods
+    -------
+    update()
+        Adds a batch of predictions
+    result()
+        Returns the metrics of all batches added so far in the same order as Metrics.run
+    """
+
+    def __init__(self, n_bins=None):
+        """ Initializes the Metrics Accumulator
+
+        Parameters
+        ----------
+        n_bins : int
+            The number of bins scores between 0 and 1 are rounded down to, None to keep every distinct score
+
+        """
+        self.n_bins = n_bins
+        self.counts = np.zeros(4, dtype=np.int64)
+        self._scores = np.empty(0)
+        self._positives = np.empty(0, dtype=np.int64)
+        self._negatives = np.empty(0, dtype=np.int64)
+        self._has_scores = None
+
+    def update(self, y_val, y_pred, y_score=None):
+        """ Adds a batch of predictions
+
+        Parameters
+        ----------
+        y_val : ndarray
+            The ground truth for the batch
+        y_pred : ndarray
+            The predicted values for the batch
+        y_score : ndarray
+            The scores for the batch, either given for every batch or for none of them
+
+        """
+        if (self._has_scores is not None) and (self._has_scores != (y_score is not None)):
+            raise ValueError('Scores need to be given for every batch or for none of them')
+        self._has_scores = y_score is not None
+
+        self.counts += Metrics.confusion(y_val, y_pred)
+
+        # Count positives and negatives for every distinct score of the batch
+        scores = np.asarray(y_pred if y_score is None else y_score)
+        if self.n_bins is not None:
+            scores = np.minimum(np.floor(scores * self.n_bins), self.n_bins - 1) / self.n_bins
+        scores, inverse = np.unique(scores, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), minlength=len(scores))
+        positives = np.bincount(inverse.ravel(), weights=np.asarray(y_val), minlength=len(scores)).astype(np.int64)
+
+        # Merge them with the counts of the earlier batches
+        merged = np.union1d(self._scores, scores)
+        merged_positives = np.zeros(len(merged), dtype=np.int64)
+        merged_negatives = np.zeros(len(merged), dtype=np.int64)
+        old = np.searchsorted(merged, self._scores)
+        new = np.searchsorted(merged, scores)
+        merged_positives[old] += self._positives
+        merged_negatives[old] += self._negatives
+        merged_positives[new] += positives
+        merged_negatives[new] += totals - positives
+
+        self._scores = merged
+        self._positives = merged_positives
+        self._negatives = merged_negatives
+
+    def result(self):
+        """ Returns the metrics of all batches so far
+
+        Returns
+        ----------
+        metrics : tuple
+            The same metrics in the same order as Metrics.run
+        """
+        # Positives and negatives at or above every distinct score, from the highest score down
+        tps = np.cumsum(self._positives[::-1])
+        fps = np.cumsum(self._negatives[::-1])
+
+        return Metrics.from_counts(*self.counts.tolist(), tps, fps)
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+import weakref
+from datetime import datetime
+
+class Metrics_Cache:
+    """
+    A class used to cache the test metrics of a model by model version
+
+    The metrics are computed by a background thread whenever the model version differs from the version of the
+    cached metrics, so that asking for them never waits on the model being tested. Until the new metrics are
+    ready the previous ones are served and marked as stale. When computing the metrics of a model version fails
+    they are not computed again until the model version changes, so that an error that persists does not start
+    a new test run on every request
+
+    ...
+
+    Attributes
+    ----------
+    metrics : dict
+        the cached metrics, None until they are first computed or stored
+    metrics_version : int
+        the model version the cached metrics were computed for
+    computed_at : str
+        the time the cached metrics were computed or stored
+    compute_seconds : float
+        the time taken to compute the cached metrics, None when they were stored
+    error : str
+        the error of the last computation that failed, None when it succeeded
+    failed_version : int
+        the model version whose metrics failed to compute, None when the last computation succeeded
+
+    Methods
+    -------
+    get()
+        Returns the cached metrics with their status, starting a refresh when the model changed
+    refresh()
+        Starts computing the metrics in the background if the model changed
+    wait()
+        Waits for the metrics of the current model version and returns them
+    put()
+        Stores metrics computed elsewhere for a model version
+    get_status()
+        Provides the freshness of the cached metrics and how long they took to compute
+    """
+
+    def __init__(self, compute, get_version):
+        """ Initializes the Metrics Cache
+
+        Parameters
+        ----------
+        compute : function
+            Function without parameters that tests the current model and returns its metrics as a dictionary,
+            None when the metrics cannot be computed again (they can only be stored)
+        get_version : function
+            Function without parameters that returns the current model version
+
+        """
+        self._compute = compute
+        self._get_version = get_version
+
+        self.metrics = None
+        self.metrics_version = None
+        self.computed_at = None
+        self.compute_seconds = None
+        self.error = None
+        self.failed_version = None
+
+        self._lock = threading.Condition()
+        self._computing = False
+        self._requested = threading.Event()
+        self._thread = None
+
+        # Threads do not survive a fork, the child starts its own thread from fresh locks the first time it is needed
+        after_fork = weakref.WeakMethod(self._after_fork)
+        os.register_at_fork(after_in_child=lambda: after_fork() and after_fork()())
+
+    def get(self):
+        """ Returns the cached metrics along with their status, starting a refresh when the model changed
+
+        Returns
+        -------
+        metrics
+            The cached metrics (None until first computed)
+        status
+            Dictionary with the freshness of the metrics, see get_status()
+        """
+        self.refresh()
+        with self._lock:
+            return self.metrics, self._status()
+
+    def refresh(self):
+        """ Starts computing the metrics in the background if the model changed since they were computed, unless
+        computing them already failed for this model version
+        """
+        version = self._get_version()
+        if (self._compute is not None) and (self.metrics_version != version) and (self.failed_version != version):
+            self._ensure_started()
+            with self._lock:
+                self._computing = True
+            self._requested.set()
+
+    def wait(self, timeout=None):
+        """ Waits for the metrics of the current model version
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait before giving up (wait forever by default)
+
+        Returns
+        -------
+        metrics
+            The metrics of the current model version, or the latest ones when waiting timed out or failed
+        """
+        self.refresh()
+        with self._lock:
+            self._lock.wait_for(lambda: (self.metrics_version == self._get_version()) or
+                                        ((not self._computing) and (self.error is not None)), timeout)
+            return self.metrics
+
+    def put(self, version, metrics):
+        """ Stores metrics that were computed elsewhere, such as the ones saved with a model
+
+        Parameters
+        ----------
+        version : int
+            The model version the metrics were computed for
+        metrics : dict
+            The metrics
+
+        """
+        with self._lock:
+            self.metrics = metrics
+            self.metrics_version = version
+            self.computed_at = datetime.now().isoformat(timespec='seconds')
+            self.compute_seconds = None
+            self.error = None
+            self.failed_version = None
+            self._lock.notify_all()
+
+    def get_status(self):
+        """ Provides the freshness of the cached metrics and how long they took to compute
+
+        Returns
+        -------
+        status
+            Dictionary with state (fresh, stale or pending), whether a computation is under way, the model version
+            and the version of the metrics, when and how quickly they were computed and the last error along with
+            the model version it happened for
+        """
+        with self._lock:
+            return self._status()
+
+    def _status(self):
+        """ Builds the status, the lock must be held
+        """
+        model_version = self._get_version()
+        if self.metrics is None:
+            state = 'pending'
+        elif self.metrics_version == model_version:
+            state = 'fresh'
+        else:
+            state = 'stale'
+
+        return {'state': state,
+                'computing': self._computing,
+                'model_version': model_version,
+                'metrics_version': self.metrics_version,
+                'computed_at': self.computed_at,
+                'compute_seconds': self.compute_seconds,
+                'error': self.error,
+                'failed_version': self.failed_version}
+
+    def _ensure_started(self):
+        """ Starts the background thread the first time it is needed in this process
+        """
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-cache', daemon=True)
+                self._thread.start()
+
+    def _after_fork(self):
+        """ Forgets the background thread of the parent process in a forked child
+
+        The child only has the thread that forked, so the locks may have been held by a thread that is gone. This
+        lets the cache be created (and the metrics computed) before worker processes are forked
+        """
+        self._lock = threading.Condition()
+        self._requested = threading.Event()
+        self._computing = False
+        self._thread = None
+
+    def _run(self):
+        """ Computes the metrics whenever asked to for as long as the process lives
+        """
+        while True:
+            self._requested.wait()
+            self._requested.clear()
+
+            # The model may change again while testing it, the next request then computes the metrics again
+            version = self._get_version()
+            if (version == self.metrics_version) or (version == self.failed_version):
+                with self._lock:
+                    self._computing = False
+                    self._lock.notify_all()
+                continue
+
+            start = time.perf_counter()
+            try:
+                metrics = self._compute()
+                error = None
+            except Exception as e:
+                metrics = None
+                error = f'{type(e).__name__}: {e}'
+                print(f'Computing metrics for model version {version} failed with {error}')
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                # Still computing when the model changed again meanwhile
+                self._computing = self._requested.is_set() or (version != self._get_version())
+                if error is None:
+                    self.metrics = metrics
+                    self.metrics_version = version
+                    self.computed_at = datetime.now().isoformat(timespec='seconds')
+                    self.compute_seconds = elapsed
+                self.error = error
+                self.failed_version = None if error is None else version
+                self._lock.notify_all()
+
+            if version != self._get_version():
+                self._requested.set()
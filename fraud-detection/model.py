@@ -1,9 +1,21 @@
+import os
+import copy
+import json
+import threading
+import time
+import joblib
+import numpy as np
+from scipy import sparse
+import sklearn
+from datetime import datetime
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.ensemble import AdaBoostClassifier
-from data_pipeline import ETL_Pipeline 
-import pandas as pd
 from metrics import Metrics
+from tree_engine import Compiled_Forest
+from data_pipeline import Feature_Transformer
+from instrumentation import instrumentation
 
 class Fraud_Detector_Model:
     """
@@ -15,6 +27,16 @@ class Fraud_Detector_Model:
     ----------
     cls : RandomForestClassifier
         Classifier used for making prediction on whether a transaction is fraudulent or not
+    feature_transformer : Feature_Transformer
+        The scaling and encoding fitted on the training data, used to transform transactions for prediction
+    engine : Compiled_Forest
+        The compiled Random Forest used to predict a few transactions at a time, None until compiled
+    engine_max_rows : int
+        The largest number of transactions predicted with the engine, sklearn is faster for more
+    version : int
+        The number of times the classifier was trained or updated
+    update_history : list
+        The details of every online update: version, rows, trees added and evicted and fit time
 
     Methods
     -------
@@ -22,9 +44,32 @@ class Fraud_Detector_Model:
         Train the data using training data
     test()
         Predict class for test data and return metrics 
+    compile()
+        Compile the Random Forest into flat node arrays for fast prediction
+    update()
+        Add trees trained on new labeled transactions while the model keeps serving
+    save()
+        Save the model with its feature transformer and test metrics as an artifact folder
+    load()
+        Load a model saved as an artifact folder without training it
+    has_artifact()
+        Whether a folder holds a complete model artifact
+    score()
+        Fraud probability of a single transaction
+    score_batch()
+        Fraud probability of each transaction in a list with a single call to the classifier
+    decide()
+        Decide which fraud probabilities are fraud for a threshold
+    predict()
+        Predict whether a single transaction is fraudulent
+    predict_batch()
+        Predict whether each transaction in a list is fraudulent with a single call to the classifier
 
     """
-    def __init__(self, classifier_code='RF'):
+    # Version of the layout of the artifact folder
+    artifact_format = '1'
+
+    def __init__(self, classifier_code='RF', feature_transformer=None, engine_max_rows=512):
         """ Initializes the Detection Model
 
         Parameters
@@ -35,8 +80,22 @@ class Fraud_Detector_Model:
             1. Random Forest (Default)
             2. Gradient Boosting
             3. ADA Boost
+        feature_transformer : Feature_Transformer
+            The fitted feature transformer from the ETL_Pipeline that produced the training data
+        engine_max_rows : int
+            The largest number of transactions predicted with the compiled forest once compiled
 
         """
+        self.feature_transformer = feature_transformer
+        self.engine = None
+        self.engine_max_rows = engine_max_rows
+        self.version = 0
+        self.update_history = []
+
+        # Predictions read the classifier and engine together under the swap lock, updates run one at a time
+        self._swap_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
         if (classifier_code == "RF"):
             self.cls = RandomForestClassifier(warm_start=True, max_depth=11, 
                                                    n_estimators=100, max_features=12, random_state=42)
@@ -44,7 +103,11 @@ class Fraud_Detector_Model:
             self.cls = GradientBoostingClassifier(n_estimators=100, max_features=12, learning_rate=0.1, 
                                                       max_depth=11, random_state=42)
         elif (classifier_code == "AB"):
-            self.cls = AdaBoostClassifier(n_estimators=100, algorithm="SAMME", learning_rate=0.1, random_state=42)
+            # Newer scikit-learn only implements SAMME and no longer accepts the algorithm parameter
+            if 'algorithm' in AdaBoostClassifier().get_params():
+                self.cls = AdaBoostClassifier(n_estimators=100, algorithm="SAMME", learning_rate=0.1, random_state=42)
+            else:
+                self.cls = AdaBoostClassifier(n_estimators=100, learning_rate=0.1, random_state=42)
         else:
             self.cls = RandomForestClassifier(warm_start=True, max_depth=11, 
                                                    n_estimators=100, max_features=12, random_state=42)
@@ -66,6 +129,9 @@ class Fraud_Detector_Model:
             Additional Optional Data used for training the model specifically the class labels 
             specifically the features (used when training data is huge and needs some splitting)
         """
+        # A compiled forest would no longer match the classifier
+        self._swap(self.cls, None)
+
         self.cls.fit(X_train, y_train)
 
         # If additional data is passed then use that for training
@@ -73,7 +139,9 @@ class Fraud_Detector_Model:
             self.cls.n_estimators += 100
             self.cls.fit(addn_x, addn_y)
 
-    def test(self, X_test, y_test):
+        self.version += 1
+
+    def test(self, X_test, y_test, threshold=None):
         """ Test the Model 
 
         Parameters
@@ -82,42 +150,313 @@ class Fraud_Detector_Model:
             Data used for testing the model specifically the features
         y_test : ndarray
             Data used for testing the model specifically the class labels
+        threshold : float
+            The fraud probability from which a transaction is fraud, see decide()
         """
-        # Find the predicted value
-        y_pred = self.cls.predict(X_test)
+        # Find the fraud probability and decide on it
+        y_score = self.score_features(X_test)
+        y_pred = Fraud_Detector_Model.decide(y_score, threshold)
 
         # Initialize the metrics 
         metrics = Metrics()
 
-        return metrics.run(y_test, y_pred)
+        # Rank by the fraud probability for ROC AUC and Average Precision
+        return metrics.run(y_test, y_pred, y_score=y_score)
 
-    def predict(self, transaction_details):
-        """ Predict whether the transaction is fraud depending on the transaction details
+    def compile(self, X_verify=None):
+        """ Compile the trained Random Forest into flat node arrays for fast prediction of a few transactions
+
+        Parameters
+        ----------
+        X_verify : ndarray
+            Data used to check that the compiled forest gives exactly the same probabilities as the classifier
+
+        Returns
+        -------
+        compiled
+            True when the compiled forest is used for predictions from now on
+        """
+        if not isinstance(self.cls, RandomForestClassifier):
+            print(f'Only Random Forest can be compiled, predicting with {type(self.cls).__name__}')
+            return False
+
+        cls, _ = self._current()
+        engine = Compiled_Forest(cls)
+        if (X_verify is not None) and (not engine.verify(X_verify)):
+            print('Compiled forest does not match the classifier, predicting with sklearn')
+            return False
+
+        self._swap(cls, engine)
+        return True
+
+    def update(self, X_new, y_new, n_estimators=10, max_estimators=300):
+        """ Add trees trained on new labeled transactions to the Random Forest without retraining it
+
+        The new trees are fitted on the new transactions only and appended to the existing ones. When the forest
+        grows beyond max_estimators the oldest trees are evicted. The updated forest (compiled again if the
+        model was compiled) replaces the current one in a single step so that predictions running meanwhile
+        keep using the previous forest
+
+        Parameters
+        ----------
+        X_new : ndarray
+            The features of the new transactions, transformed with the fitted feature transformer
+        y_new : ndarray
+            The class labels of the new transactions, both classes must be present
+        n_estimators : int
+            The number of trees trained on the new transactions
+        max_estimators : int
+            The largest number of trees kept in the forest
+
+        Returns
+        -------
+        update
+            Dictionary with the new version, the rows used, the trees added and evicted and the fit time
+        """
+        if not isinstance(self.cls, RandomForestClassifier):
+            raise ValueError(f'Only Random Forest can be updated, not {type(self.cls).__name__}')
+
+        y_new = np.asarray(y_new)
+        if not np.array_equal(np.unique(y_new), self.cls.classes_):
+            raise ValueError(f'New transactions need to have all classes {self.cls.classes_.tolist()} to update the model')
+
+        with self._update_lock:
+            cls, engine = self._current()
+
+            # Train the new trees on the new transactions only
+            start = time.perf_counter()
+            random_state = cls.random_state + self.version if isinstance(cls.random_state, int) else cls.random_state
+            new_forest = clone(cls).set_params(n_estimators=n_estimators, warm_start=False, random_state=random_state)
+            new_forest.fit(X_new, y_new)
+            fit_time = time.perf_counter() - start
+
+            # Append them, evicting the oldest trees beyond the bound
+            estimators = cls.estimators_ + new_forest.estimators_
+            evicted = max(len(estimators) - max_estimators, 0)
+            updated = copy.copy(cls)
+            updated.estimators_ = estimators[evicted:]
+            updated.n_estimators = len(updated.estimators_)
+
+            if engine is not None:
+                engine = Compiled_Forest(updated)
+
+            self._swap(updated, engine)
+            self.version += 1
+
+            details = {'version': self.version, 'rows': len(y_new), 'trees_added': n_estimators,
+                       'trees_evicted': evicted, 'n_estimators': updated.n_estimators, 'fit_time': fit_time}
+            self.update_history.append(details)
+
+        return details
+
+    def score_features(self, X_predict):
+        """ Fraud probability of transactions that were transformed already
+
+        Parameters
+        ----------
+        X_predict : ndarray
+            The features of the transactions, a CSR matrix for sparse features
+
+        Returns
+        -------
+        fraud_score
+            The array of fraud probabilities in the same order as the transactions
+        """
+        cls, engine = self._current()
+        fraud_col = list(cls.classes_).index(1)
+        with instrumentation.span('inference'):
+            if (engine is not None) and (X_predict.shape[0] <= self.engine_max_rows):
+                return engine.predict_proba(X_predict)[:, fraud_col]
+            else:
+                return cls.predict_proba(X_predict)[:, fraud_col]
+
+    def score(self, transaction_details):
+        """ Fraud probability of the transaction depending on the transaction details
 
         Parameters
         ----------
         transaction_details : dictionary
             Dictionary of transaction attributes 
         """
-        # Putting a dummy is_fraud to leverage the model
-        transaction_details['is_fraud'] = 0
+        # Transform the transaction using the scaling and encoding fitted on the training data
+        X_predict = self.feature_transformer.transform(transaction_details)
+
+        return float(self.score_features(X_predict)[0])
 
-        # Create a dataframe from 
-        input_df = pd.DataFrame.from_dict([transaction_details])
+    def score_batch(self, transactions):
+        """ Fraud probability of each transaction with one vectorized call to the classifier
+
+        Parameters
+        ----------
+        transactions : list
+            List of dictionaries of transaction attributes 
 
-        # Run the data pipeline on the data
-        dp = ETL_Pipeline('')
-        transformed_df = dp.transform(input_df)
+        Returns
+        -------
+        fraud_score
+            List of fraud probabilities in the same order as the transactions
+        """
+        # Transform all the transactions using the scaling and encoding fitted on the training data
+        X_predict = self.feature_transformer.transform_batch(transactions)
+
+        return self.score_features(X_predict).tolist()
+
+    @staticmethod
+    def decide(fraud_score, threshold=None):
+        """ Decide which transactions are fraud from their fraud probability
+
+        Parameters
+        ----------
+        fraud_score : ndarray
+            The fraud probabilities
+        threshold : float
+            Transactions with a fraud probability at or above the threshold are fraud. When None, the most 
+            probable class is picked as the classifier does (fraud above 0.5)
 
-        # Extract the features in order to make the prediction
-        X_predict = transformed_df.loc[:, transformed_df.columns != 'is_fraud'].values
+        Returns
+        -------
+        is_fraud
+            The array of booleans (a boolean for a single fraud probability)
+        """
+        fraud_score = np.asarray(fraud_score)
+        if threshold is None:
+            return fraud_score > 0.5
+        return fraud_score >= threshold
 
-        # Find the predicted value
-        y_pred = self.cls.predict(X_predict)
+    def predict(self, transaction_details, threshold=None):
+        """ Predict whether the transaction is fraud depending on the transaction details
 
+        Parameters
+        ----------
+        transaction_details : dictionary
+            Dictionary of transaction attributes 
+        threshold : float
+            The fraud probability from which a transaction is fraud, see decide()
+        """
         # Decide if its fraud
-        is_fraud = False 
-        if (y_pred == 1):
-            is_fraud = True
+        return bool(Fraud_Detector_Model.decide(self.score(transaction_details), threshold))
+
+    def predict_batch(self, transactions, threshold=None):
+        """ Predict whether each transaction is fraud with one vectorized call to the classifier
+
+        Parameters
+        ----------
+        transactions : list
+            List of dictionaries of transaction attributes 
+        threshold : float
+            The fraud probability from which a transaction is fraud, see decide()
+
+        Returns
+        -------
+        is_fraud
+            List of booleans in the same order as the transactions
+        """
+        return Fraud_Detector_Model.decide(self.score_batch(transactions), threshold).tolist()
+
+    def save(self, artifact_folder, metrics, X_verify=None):
+        """ Save the model as an artifact folder that can be loaded without training
+
+        The folder holds the classifier (classifier.joblib), the feature transformer (feature_transformers.json, 
+        with the activity of the cards in feature_transformers.velocity.npz when velocity features are used),
+        the test metrics (metrics.json), rows to verify the compiled forest with (verify.npy) and a manifest
+        (manifest.json) that is written last, so that a partially written artifact is never loaded
+
+        Parameters
+        ----------
+        artifact_folder : str
+            The folder to save the artifact in, created when missing
+        metrics : dict
+            The test metrics of the model, served without testing it again after loading
+        X_verify : ndarray
+            Rows used to verify the compiled forest after loading (compiled without verification when missing)
+
+        """
+        manifest_file = os.path.join(artifact_folder, 'manifest.json')
+        os.makedirs(artifact_folder, exist_ok=True)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+        cls, engine = self._current()
+        joblib.dump(cls, os.path.join(artifact_folder, 'classifier.joblib'))
+        self.feature_transformer.save(os.path.join(artifact_folder, 'feature_transformers.json'))
+        with open(os.path.join(artifact_folder, 'metrics.json'), 'w') as f:
+            json.dump(metrics, f)
+        if X_verify is not None:
+            X_verify = X_verify.toarray() if sparse.issparse(X_verify) else X_verify
+            np.save(os.path.join(artifact_folder, 'verify.npy'), X_verify)
 
-        return is_fraud
\ No newline at end of file
+        manifest = {'format': Fraud_Detector_Model.artifact_format,
+                    'classifier': type(cls).__name__,
+                    'n_estimators': getattr(cls, 'n_estimators', None),
+                    'version': self.version,
+                    'compiled': engine is not None,
+                    'sklearn_version': sklearn.__version__,
+                    'created': datetime.now().isoformat(timespec='seconds')}
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    @staticmethod
+    def load(artifact_folder):
+        """ Load a model saved as an artifact folder
+
+        The arrays of the classifier are memory mapped from classifier.joblib where sklearn allows it
+
+        Parameters
+        ----------
+        artifact_folder : str
+            The folder the artifact was saved in
+
+        Returns
+        -------
+        model
+            The Fraud_Detector_Model ready to predict
+        metrics
+            The test metrics saved with the model
+        """
+        with open(os.path.join(artifact_folder, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+
+        if manifest['format'] != Fraud_Detector_Model.artifact_format:
+            raise ValueError(f"Model artifact format {manifest['format']} is not supported")
+        if manifest['sklearn_version'] != sklearn.__version__:
+            print(f"Model artifact was saved with scikit-learn {manifest['sklearn_version']} but {sklearn.__version__} is installed")
+
+        feature_transformer = Feature_Transformer.load(os.path.join(artifact_folder, 'feature_transformers.json'))
+        model = Fraud_Detector_Model(feature_transformer=feature_transformer)
+        model._swap(joblib.load(os.path.join(artifact_folder, 'classifier.joblib'), mmap_mode='r'), None)
+        model.version = manifest['version']
+
+        if manifest['compiled']:
+            verify_file = os.path.join(artifact_folder, 'verify.npy')
+            model.compile(np.load(verify_file) if os.path.exists(verify_file) else None)
+
+        with open(os.path.join(artifact_folder, 'metrics.json'), 'r') as f:
+            metrics = json.load(f)
+
+        return model, metrics
+
+    @staticmethod
+    def has_artifact(artifact_folder):
+        """ Whether the folder holds a complete model artifact
+
+        Parameters
+        ----------
+        artifact_folder : str
+            The folder to look in
+
+        """
+        return os.path.exists(os.path.join(artifact_folder, 'manifest.json'))
+
+    def _current(self):
+        """ Returns the classifier and its compiled engine as one consistent pair
+        """
+        with self._swap_lock:
+            return self.cls, self.engine
+
+    def _swap(self, cls, engine):
+        """ Replaces the classifier and its compiled engine together
+        """
+        with self._swap_lock:
+            self.cls = cls
+            self.engine = engine
@@ -0,0 +1,139 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from data_pipeline import ETL_Pipeline
+from dataset import Fraud_Dataset
+from model import Fraud_Detector_Model
+from metrics import Metrics
+
+class Threshold_Sweep:
+    """
+    A class used to choose the decision threshold of the Fraud Detection Model
+
+    The testing transactions are scored once and every distinct fraud probability is evaluated as a threshold
+    from a single sort of the scores, so the alert volume can be tuned without training again
+
+    ...
+
+    Attributes
+    ----------
+    cost_fp : float
+        the cost of a false alert
+    cost_fn : float
+        the cost of a missed fraud
+    sweep_df : DataFrame
+        the counts, precision, recall, alert rate and cost at every threshold from the last run
+
+    Methods
+    -------
+    run()
+        Scores the testing data and evaluates every threshold
+    best_threshold()
+        Provides the threshold with the lowest cost
+    generate_report()
+        Writes the evaluation of every threshold as CSV
+    """
+
+    def __init__(self, cost_fp=1.0, cost_fn=10.0):
+        """ Initializes the Threshold Sweep
+
+        Parameters
+        ----------
+        cost_fp : float
+            The cost of a false alert (a valid transaction flagged as fraud)
+        cost_fn : float
+            The cost of a missed fraud
+
+        """
+        self.cost_fp = cost_fp
+        self.cost_fn = cost_fn
+        self.sweep_df = None
+
+    def run(self, model, X_test, y_test):
+        """ Scores the testing data and evaluates every distinct fraud probability as a threshold
+
+        Parameters
+        ----------
+        model : Fraud_Detector_Model
+            The trained model
+        X_test : ndarray
+            Data used for testing the model specifically the features
+        y_test : ndarray
+            Data used for testing the model specifically the class labels
+
+        Returns
+        -------
+        sweep_df
+            The dataset (Pandas Dataframe) with one row per threshold from the highest down
+        """
+        y_score = model.score_features(X_test)
+        self.sweep_df = pd.DataFrame(Metrics.threshold_sweep(y_test, y_score, self.cost_fp, self.cost_fn))
+
+        return self.sweep_df
+
+    def best_threshold(self):
+        """ Provides the threshold with the lowest cost of the last run, the highest one among equal costs
+
+        Returns
+        -------
+        best
+            The row (Pandas Series) of the threshold
+        """
+        return self.sweep_df.iloc[int(np.argmin(self.sweep_df['cost'].values))]
+
+    def generate_report(self, report_file):
+        """ Writes the evaluation of every threshold of the last run as CSV
+
+        Parameters
+        ----------
+        report_file : str
+            The full path to the file where the results need to be stored
+
+        """
+        self.sweep_df.to_csv(report_file, index=False)
+
+if __name__ == "__main__":
+    # Get command line arguments, --model-artifact <folder> scores with a saved model instead of training one
+    args = sys.argv[1:]
+    model_artifact = os.environ.get('model-artifact')
+    if '--model-artifact' in args:
+        i = args.index('--model-artifact')
+        model_artifact = args[i + 1]
+        del args[i:i + 2]
+
+    if (len(args)>1):
+        data_folder = args[0]
+        file = args[1]
+    else:
+        data_folder = os.environ['data-folder']
+        file = os.environ['training-data-file']
+
+    report_file = args[2] if len(args)>2 else data_folder + 'threshold_sweep.csv'
+    cost_fp = float(os.environ.get('cost-fp', 1.0))
+    cost_fn = float(os.environ.get('cost-fn', 10.0))
+
+    # Perform ETL and build the same testing data as the service
+    velocity = os.environ.get('velocity-features', 'false').lower() in ['1', 'true', 'yes']
+    dp = ETL_Pipeline(data_folder, velocity)
+    df = dp.process(file)
+    fd = Fraud_Dataset(df, 'is_fraud', 2)
+    X_test, y_test = fd.get_testing_dataset(0)
+
+    if (model_artifact is not None) and Fraud_Detector_Model.has_artifact(model_artifact):
+        model, _ = Fraud_Detector_Model.load(model_artifact)
+    else:
+        X_train, y_train = fd.get_training_dataset(0)
+        model = Fraud_Detector_Model(feature_transformer=dp.feature_transformer)
+        model.train(X_train, y_train)
+
+    # Evaluate every threshold
+    sweep = Threshold_Sweep(cost_fp, cost_fn)
+    sweep.run(model, X_test, y_test)
+    sweep.generate_report(report_file)
+
+    best = sweep.best_threshold()
+    print(f"Lowest cost {best['cost']:,.0f} at threshold {best['threshold']:.4f} with precision {best['precision']:.3f}, "
+          f"recall {best['recall']:.3f} and alert rate {best['alert_rate']:.4%}")
+    print(f'Report written to {report_file}')
@@ -0,0 +1,185 @@
+import numpy as np
+from scipy import sparse
+
+class Compiled_Forest:
+    """
+    A class used to represent a trained Random Forest as flat node arrays for fast prediction
+
+    The nodes of all trees are concatenated into one set of arrays (feature, threshold, first child and class
+    probabilities of the node) with the two children of a node next to each other. Leaves point to themselves
+    so that every row can take the same number of steps, which lets all rows walk all trees at once with a handful of NumPy operations per
+    level instead of going through the validation and per tree dispatch of sklearn
+
+    Predictions follow sklearn exactly: features are compared as float32 with <= against the threshold, the
+    leaf probabilities are normalized the same way and the trees are summed in estimator order before being
+    divided by the number of trees, so the probabilities are identical bit for bit
+
+    ...
+
+    Attributes
+    ----------
+    classes_ : ndarray
+        the class labels in the order of the probability columns
+    n_trees : int
+        the number of trees in the forest
+    depth : int
+        the number of levels walked, which is the depth of the deepest tree
+    chunk_size : int
+        the number of rows walked through the trees at a time
+    _roots : ndarray
+        the index of the root node of every tree
+    _feature : ndarray
+        the feature each node splits on (0 for leaves)
+    _threshold : ndarray
+        the threshold each node splits at (infinite for leaves)
+    _children : ndarray
+        the index of the left child of each node, the right child follows it (the node itself for leaves)
+    _missing_left : ndarray
+        whether missing values go to the left child of each node
+    _value : ndarray
+        the class probabilities of each node
+
+    Methods
+    -------
+    predict_proba()
+        Predict the class probabilities of every row
+    predict()
+        Predict the class of every row
+    verify()
+        Checks that the compiled forest gives the same probabilities as the forest it was compiled from
+    """
+
+    def __init__(self, forest, chunk_size=10000):
+        """ Compiles the Random Forest
+
+        Parameters
+        ----------
+        forest : RandomForestClassifier
+            The trained single output forest (any forest averaging DecisionTreeClassifiers works)
+        chunk_size : int
+            The number of rows walked through the trees at a time
+
+        """
+        self._forest = forest
+        self.chunk_size = chunk_size
+        self.classes_ = forest.classes_
+        self.n_trees = len(forest.estimators_)
+
+        features, thresholds, children, missing_lefts, values, roots = [], [], [], [], [], []
+        offset = 0
+        self.depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+
+            # Number the nodes breadth first so that the two children of every node are next to each other
+            order = [0]
+            for node in order:
+                if tree.children_left[node] != -1:
+                    order.extend([tree.children_left[node], tree.children_right[node]])
+            order = np.array(order)
+            position = np.empty(len(order), dtype=np.intp)
+            position[order] = np.arange(len(order))
+
+            left = tree.children_left[order]
+            is_leaf = left == -1
+
+            # Leaves always go left onto themselves, missing values included
+            features.append(np.where(is_leaf, 0, tree.feature[order]))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold[order]))
+            children.append(np.where(is_leaf, np.arange(len(order)), position[left]) + offset)
+            missing_left = getattr(tree, 'missing_go_to_left', None)
+            missing_left = np.zeros(len(order), dtype=bool) if missing_left is None else missing_left[order].astype(bool)
+            missing_lefts.append(missing_left | is_leaf)
+
+            # Normalize the class values of every node as DecisionTreeClassifier.predict_proba does
+            value = tree.value[order, 0, :forest.n_classes_].copy()
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            value /= normalizer
+            values.append(value)
+
+            roots.append(offset)
+            offset += len(order)
+            self.depth = max(self.depth, tree.max_depth)
+
+        self._roots = np.array(roots, dtype=np.int32)
+        self._feature = np.concatenate(features).astype(np.int32)
+        self._threshold = np.concatenate(thresholds)
+        self._children = np.concatenate(children).astype(np.int32)
+        self._missing_left = np.concatenate(missing_lefts)
+        self._value = np.concatenate(values)
+
+    def predict_proba(self, X):
+        """ Predict the class probabilities
+
+        Parameters
+        ----------
+        X : ndarray
+            The feature values, one row per observation. Sparse matrices are densified a chunk of rows at a time
+
+        Returns
+        -------
+        proba
+            The array of class probabilities with one column per class in classes_ order
+        """
+        if sparse.issparse(X):
+            X = sparse.csr_matrix(X)
+            return np.concatenate([self.predict_proba(X[start:start + self.chunk_size].toarray())
+                                   for start in range(0, X.shape[0], self.chunk_size)])
+
+        # Trees split on float32 values
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        # Walk large inputs in chunks so that the per tree node arrays stay small
+        if len(X) > self.chunk_size:
+            return np.concatenate([self.predict_proba(X[start:start + self.chunk_size])
+                                   for start in range(0, len(X), self.chunk_size)])
+
+        row_offsets = np.arange(0, X.size, X.shape[1], dtype=np.int32)[:, np.newaxis]
+        X_flat = X.ravel()
+        has_missing = np.isnan(X_flat).any()
+
+        # Walk every row through every tree one level at a time
+        node = np.broadcast_to(self._roots, (len(X), self.n_trees))
+        for _ in range(self.depth):
+            x = X_flat[row_offsets + self._feature[node]]
+            threshold = self._threshold[node]
+            if has_missing:
+                go_right = ~((x <= threshold) | (np.isnan(x) & self._missing_left[node]))
+            else:
+                go_right = x > threshold
+            node = self._children[node] + go_right
+
+        # Sum the trees in estimator order like sklearn so that the result is identical
+        proba = np.cumsum(self._value[node], axis=1)[:, -1, :]
+        proba /= self.n_trees
+
+        return proba
+
+    def predict(self, X):
+        """ Predict the class of every row as the most probable one
+
+        Parameters
+        ----------
+        X : ndarray
+            The feature values, one row per observation
+
+        """
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    def verify(self, X):
+        """ Checks that the compiled forest gives exactly the probabilities of the forest it was compiled from
+
+        Parameters
+        ----------
+        X : ndarray
+            The feature values to check with
+
+        Returns
+        -------
+        identical
+            True when the probabilities of all rows are identical bit for bit
+        """
+        return np.array_equal(self.predict_proba(X), self._forest.predict_proba(X))
@@ -0,0 +1,425 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, deque
+
+class Velocity_Store:
+    """
+    A class used to keep the recent activity of every card (cc_num) as velocity features
+
+    For every window (1 hour, 24 hours and 7 days by default) the features of a transaction are the number of
+    transactions of its card, their total amount and the number of distinct merchants within the window ending
+    at the transaction, the transaction itself included
+
+    Online, every card keeps its recent transactions in a ring buffer (a deque) holding the longest window, along
+    with the running count, amount and merchants of every window. Adding a transaction expires the oldest ones
+    from the windows and appends it, so that it costs O(1) amortized. Memory is bounded by keeping at most
+    max_cards cards, evicting the least recently active ones, and at most max_events transactions per card
+
+    In batch, scan() computes the same features for a whole dataset from one sort by card and time. Amounts are
+    summed as integer cents in both cases so that the features are identical
+
+    Cards are kept by their cc_num as a string, however it was read (a number from the CSV, a string or a number
+    from JSON). warm() adds the history the model was trained on so that the transactions served next see the same
+    activity as in training, and save() and load() keep that activity along with the model
+
+    ...
+
+    Attributes
+    ----------
+    windows : dict
+        the window length in seconds by window name
+    max_cards : int
+        the number of cards kept, the least recently active ones are evicted first
+    max_events : int
+        the number of transactions kept per card, the windows only hold the latest ones
+    evicted : int
+        the number of cards evicted so far
+    _cards : OrderedDict
+        the state of every card by cc_num, from the least to the most recently active
+
+    Methods
+    -------
+    update()
+        Adds a transaction to its card and returns its velocity features
+    peek()
+        Returns the velocity features of a transaction without adding it
+    scan()
+        Computes the velocity features of every transaction of a dataset at once
+    warm()
+        Adds the history of many cards at once
+    save()
+        Saves the activity of every card kept
+    load()
+        Loads the activity of every card saved earlier
+    card_key()
+        Provides the key a card is kept by
+    column_names()
+        Provides the names of the velocity features
+    get_stats()
+        Provides the number of cards and transactions kept
+    """
+    windows = {'1h': 3600, '24h': 86400, '7d': 604800}
+
+    def __init__(self, windows=None, max_cards=100000, max_events=1000):
+        """ Initializes the Velocity Store
+
+        Parameters
+        ----------
+        windows : dict
+            The window length in seconds by window name, from the shortest to the longest
+        max_cards : int
+            The number of cards kept, the least recently active ones are evicted first
+        max_events : int
+            The number of transactions kept per card
+
+        """
+        self.windows = dict(windows if windows is not None else Velocity_Store.windows)
+        self.max_cards = max_cards
+        self.max_events = max_events
+        self.evicted = 0
+        self._seconds = list(self.windows.values())
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self._seconds != sorted(self._seconds):
+            raise ValueError("Velocity windows must go from the shortest to the longest")
+
+    def update(self, cc_num, unix_time, amt, merchant):
+        """ Adds a transaction to the activity of its card
+
+        Transactions are expected in time order. One older than the latest transaction of its card is counted
+        as if it happened at the time of the latest one
+
+        Parameters
+        ----------
+        cc_num : int
+            The card of the transaction
+        unix_time : int
+            The time of the transaction in seconds
+        amt : float
+            The amount of the transaction
+        merchant : str
+            The merchant of the transaction
+
+        Returns
+        -------
+        features
+            List with the count, amount and distinct merchants of every window, in column_names() order
+        """
+        cc_num = Velocity_Store.card_key(cc_num)
+        with self._lock:
+            card = self._cards.get(cc_num)
+            if card is None:
+                card = _Card_Activity(len(self._seconds))
+                self._cards[cc_num] = card
+
+                # Evict the least recently active card
+                if len(self._cards) > self.max_cards:
+                    self._cards.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._cards.move_to_end(cc_num)
+
+            return card.add(int(unix_time), round(float(amt) * 100), merchant, self._seconds, self.max_events)
+
+    def peek(self, cc_num, unix_time, amt, merchant):
+        """ Returns the velocity features a transaction would have without adding it, such as for transactions
+        of the past. Only the transactions of its card that are still kept and not later than it are counted
+
+        Parameters
+        ----------
+        cc_num : int
+            The card of the transaction
+        unix_time : int
+            The time of the transaction in seconds
+        amt : float
+            The amount of the transaction
+        merchant : str
+            The merchant of the transaction
+
+        Returns
+        -------
+        features
+            List with the count, amount and distinct merchants of every window, in column_names() order
+        """
+        unix_time = int(unix_time)
+        cc_num = Velocity_Store.card_key(cc_num)
+        with self._lock:
+            card = self._cards.get(cc_num)
+            events = [event for event in card.events if event[0] <= unix_time] if card is not None else []
+
+        events = events[max(len(events) - self.max_events + 1, 0):] + [(unix_time, round(float(amt) * 100), merchant)]
+        features = []
+        for seconds in self._seconds:
+            in_window = [event for event in events if unix_time - event[0] < seconds]
+            features.extend([len(in_window), sum(event[1] for event in in_window) / 100,
+                             len(set(event[2] for event in in_window))])
+
+        return features
+
+    @staticmethod
+    def scan(cc_num, unix_time, amt, merchant, windows=None, max_events=1000):
+        """ Computes the velocity features of every transaction of a dataset with one sort by card and time
+
+        The features are the ones update() returns when the transactions are added in time order (transactions
+        at the same time in the order given)
+
+        Parameters
+        ----------
+        cc_num : Series
+            The card of every transaction
+        unix_time : Series
+            The time of every transaction in seconds
+        amt : Series
+            The amount of every transaction
+        merchant : Series
+            The merchant of every transaction
+        windows : dict
+            The window length in seconds by window name, from the shortest to the longest
+        max_events : int
+            The number of transactions kept per card
+
+        Returns
+        -------
+        velocity_df
+            The dataset (Pandas Dataframe) with the column_names() columns in the order of the transactions
+        """
+        windows = windows if windows is not None else Velocity_Store.windows
+        index = cc_num.index if isinstance(cc_num, pd.Series) else None
+        n = len(cc_num)
+        card = pd.factorize(np.asarray(cc_num))[0].astype(np.int64)
+        merchant = pd.factorize(np.asarray(merchant))[0].astype(np.int64)
+        unix_time = np.asarray(unix_time, dtype=np.int64)
+        cents = np.rint(np.asarray(amt, dtype=np.float64) * 100).astype(np.int64)
+
+        # Sort by card then time, the sort is stable so transactions at the same time keep their order
+        order = np.lexsort((unix_time, card))
+        card, merchant, unix_time, cents = card[order], merchant[order], unix_time[order], cents[order]
+        position = np.arange(n)
+
+        # Key ordered like the sorted rows so that the start of every window is found by a binary search
+        time_offset = unix_time - (unix_time.min() if n > 0 else 0)
+        key = card * (int(time_offset.max() if n > 0 else 0) + 1) + time_offset
+        card_start = np.searchsorted(card, card, side='left')
+
+        # Running total of the amounts, the amount of a window is the difference at its ends
+        cumulative_cents = np.r_[0, np.cumsum(cents)]
+
+        # Position of the previous transaction of the card at the same merchant, -1 for the first one
+        pair = card * (int(merchant.max() if n > 0 else 0) + 1) + merchant
+        by_pair = np.argsort(pair, kind='stable')
+        previous = np.full(n, -1, dtype=np.int64)
+        same_pair = np.flatnonzero(pair[by_pair][1:] == pair[by_pair][:-1])
+        previous[by_pair[same_pair + 1]] = by_pair[same_pair]
+
+        features = {}
+        for name, seconds in windows.items():
+            # First transaction of the card within the window and within the latest max_events transactions
+            start = np.searchsorted(key, key - seconds + 1, side='left')
+            start = np.maximum(np.maximum(start, card_start), position - max_events + 1)
+            count = position - start + 1
+
+            # A merchant is counted once, at its first transaction within the window
+            distinct = np.zeros(n, dtype=np.int64)
+            active = position
+            for offset in range(int(count.max()) if n > 0 else 0):
+                active = active[count[active] > offset]
+                distinct[active] += previous[active - offset] < start[active]
+
+            features['txn_count_' + name] = count
+            features['amt_sum_' + name] = (cumulative_cents[position + 1] - cumulative_cents[start]) / 100
+            features['merchant_count_' + name] = distinct
+
+        # Back to the order of the transactions
+        for col, values in features.items():
+            features[col] = np.empty_like(values)
+            features[col][order] = values
+
+        return pd.DataFrame(features, index=index)
+
+    def warm(self, cc_num, unix_time, amt, merchant):
+        """ Adds the history of many cards at once, such as the training data, so that the transactions added next 
+        are counted along with it
+
+        Only the transactions that can still be in a window of their card, i.e. within the longest window of its 
+        latest transaction and among its latest max_events transactions, are added in time order. The activity 
+        kept is then the same as when every transaction is added with update()
+
+        Parameters
+        ----------
+        cc_num : Series
+            The card of every transaction
+        unix_time : Series
+            The time of every transaction in seconds
+        amt : Series
+            The amount of every transaction
+        merchant : Series
+            The merchant of every transaction
+
+        """
+        history_df = pd.DataFrame({'cc_num': np.asarray(cc_num), 'unix_time': np.asarray(unix_time, dtype=np.int64),
+                                   'amt': np.asarray(amt, dtype=np.float64), 'merchant': np.asarray(merchant)})
+
+        # Keep the transactions still within the windows of their card, in time order (stable for ties)
+        history_df = history_df.iloc[np.argsort(history_df['unix_time'].to_numpy(), kind='stable')]
+        by_card = history_df.groupby('cc_num', sort=False)
+        recent = (history_df['unix_time'] > by_card['unix_time'].transform('max') - self._seconds[-1]) & \
+                 (by_card.cumcount(ascending=False) < self.max_events)
+        history_df = history_df[recent]
+
+        for transaction in zip(history_df['cc_num'], history_df['unix_time'], history_df['amt'], history_df['merchant']):
+            self.update(*transaction)
+
+    def save(self, file_path):
+        """ Saves the activity of every card kept, from the least to the most recently active
+
+        Parameters
+        ----------
+        file_path : str
+            The full path to the npz file
+
+        """
+        with self._lock:
+            events = [(cc_num, *event) for cc_num, card in self._cards.items() for event in card.events]
+            evicted = self.evicted
+
+        cc_nums, unix_times, cents, merchants = zip(*events) if len(events) > 0 else ((), (), (), ())
+        with open(file_path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, cc_num=np.array(cc_nums, dtype=str), unix_time=np.array(unix_times, dtype=np.int64),
+                                cents=np.array(cents, dtype=np.int64), merchant=np.array(merchants, dtype=str),
+                                window_names=np.array(list(self.windows), dtype=str),
+                                window_seconds=np.array(self._seconds, dtype=np.int64),
+                                limits=np.array([self.max_cards, self.max_events, evicted], dtype=np.int64))
+        os.replace(file_path + '.tmp', file_path)
+
+    @staticmethod
+    def load(file_path):
+        """ Loads the activity of every card saved earlier
+
+        Parameters
+        ----------
+        file_path : str
+            The full path to the npz file
+
+        Returns
+        -------
+        velocity_store
+            The Velocity_Store with the windows, limits and activity it was saved with
+        """
+        with np.load(file_path) as state:
+            windows = dict(zip(state['window_names'].tolist(), state['window_seconds'].tolist()))
+            max_cards, max_events, evicted = state['limits'].tolist()
+            velocity_store = Velocity_Store(windows, max_cards, max_events)
+            velocity_store.evicted = evicted
+
+            # Every card gets its transactions back in time order, the cards from the least recently active
+            for cc_num, unix_time, cents, merchant in zip(state['cc_num'].tolist(), state['unix_time'].tolist(),
+                                                          state['cents'].tolist(), state['merchant'].tolist()):
+                card = velocity_store._cards.get(cc_num)
+                if card is None:
+                    card = _Card_Activity(len(velocity_store._seconds))
+                    velocity_store._cards[cc_num] = card
+                card.add(unix_time, cents, merchant, velocity_store._seconds, max_events)
+
+        return velocity_store
+
+    @staticmethod
+    def card_key(cc_num):
+        """ Provides the key a card is kept by, its number as a string
+
+        Parameters
+        ----------
+        cc_num : int
+            The card number, as a number or a string
+
+        """
+        if isinstance(cc_num, str):
+            return cc_num
+        if isinstance(cc_num, (float, np.floating)) and float(cc_num).is_integer():
+            return str(int(cc_num))
+        return str(cc_num)
+
+    @staticmethod
+    def column_names(windows=None):
+        """ Provides the names of the velocity features in the order update() returns them
+
+        Parameters
+        ----------
+        windows : dict
+            The window length in seconds by window name
+
+        """
+        windows = windows if windows is not None else Velocity_Store.windows
+        return [stat + '_' + name for name in windows for stat in ['txn_count', 'amt_sum', 'merchant_count']]
+
+    def get_stats(self):
+        """ Provides the number of cards and transactions kept
+
+        Returns
+        -------
+        stats
+            Dictionary with cards, transactions and evicted
+        """
+        with self._lock:
+            return {'cards': len(self._cards),
+                    'transactions': sum(len(card.events) for card in self._cards.values()),
+                    'evicted': self.evicted}
+
+class _Card_Activity:
+    """
+    The recent transactions of a card as (time, cents, merchant) along with the running count, amount in cents
+    and merchant counts of every window. The windows are nested so each holds the latest transactions of the
+    ring buffer, the longest window holding all of them
+    """
+    __slots__ = ['events', 'counts', 'cents', 'merchants']
+
+    def __init__(self, n_windows):
+        self.events = deque()
+        self.counts = [0] * n_windows
+        self.cents = [0] * n_windows
+        self.merchants = [{} for _ in range(n_windows)]
+
+    def add(self, unix_time, cents, merchant, seconds, max_events):
+        """ Adds a transaction and returns the features of every window
+        """
+        events = self.events
+        if (len(events) > 0) and (unix_time < events[-1][0]):
+            unix_time = events[-1][0]
+
+        # Expire the transactions that are now outside of every window
+        for k, window in enumerate(seconds):
+            while (self.counts[k] > 0) and (unix_time - events[len(events) - self.counts[k]][0] >= window):
+                self._remove(k, events[len(events) - self.counts[k]])
+
+        # Drop the transactions outside of the longest window, and the oldest one when the buffer is full
+        while len(events) > self.counts[-1]:
+            events.popleft()
+        if len(events) >= max_events:
+            for k in range(len(seconds)):
+                if self.counts[k] == len(events):
+                    self._remove(k, events[0])
+            events.popleft()
+
+        # Add the transaction to every window
+        event = (unix_time, cents, merchant)
+        events.append(event)
+        features = []
+        for k in range(len(seconds)):
+            self.counts[k] += 1
+            self.cents[k] += cents
+            self.merchants[k][merchant] = self.merchants[k].get(merchant, 0) + 1
+            features.extend([self.counts[k], self.cents[k] / 100, len(self.merchants[k])])
+
+        return features
+
+    def _remove(self, k, event):
+        """ Removes the oldest transaction of window k
+        """
+        self.counts[k] -= 1
+        self.cents[k] -= event[1]
+        merchants = self.merchants[k]
+        merchants[event[2]] -= 1
+        if merchants[event[2]] == 0:
+            del merchants[event[2]]
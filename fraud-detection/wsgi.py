@@ -0,0 +1,18 @@
+import fraud_service
+
+"""
+Entry point for serving the Fraud Service with gunicorn (see gunicorn.conf.py)
+
+    python -m gunicorn -c gunicorn.conf.py wsgi:app
+
+The service is initialized from the environment variables (data-folder, training-data-file, model-artifact, ...) 
+when gunicorn loads this module in the master process, so the workers forked afterwards share the model. Testing 
+the model is not done before forking, every worker tests it in the background on its first /stats request and 
+answers with the status pending until then. A model loaded from model-artifact is served with the metrics saved 
+with it, and when the trained model is saved to model-artifact it is tested once before forking
+"""
+
+# Train or load the model once for all workers
+fraud_service.initialize([], preload=True)
+
+app = fraud_service.app
@@ -3,6 +3,7 @@ import pandas as pd
 from datetime import datetime, date 
 from sklearn import preprocessing
 from sklearn.preprocessing import LabelEncoder
+from cache import Feature_Cache
 
 class ETL_Pipeline:
     """
@@ -22,13 +23,17 @@ class ETL_Pipeline:
         the dataframe representing the customer data
     transformed_df : df
         the dataframe representing the transformed data
+    _cache : Feature_Cache
+        the cache holding the transformed data in a columnar format, keyed by the source files fingerprint
+    version : str
+        the version of the transformations. Bump it whenever they change so that cached transformed data is rebuilt
 
     Methods
     -------
     process()
         Key method that extracts, transforms and loads the source. Optimizes by ensuring that if transformed
-        data is present then it simply reads it back instead of reading source, applying transforms and writing
-        transformed file
+        data is present for the same source, pipeline version and parameters then it simply reads it back instead 
+        of reading source, applying transforms and writing transformed file
     extract()
         Reads the source file given the directory and file name. Expects the file to be a CSV
     transform()
@@ -38,6 +43,7 @@ class ETL_Pipeline:
     load()
         Saves the final transformed file
     """
+    version = '1'
     
     def __init__(self, data_folder):
         """ Initializes the Data Pipeline Class
@@ -53,6 +59,8 @@ class ETL_Pipeline:
         self.response_df = None
         self.customer_df = None
         self.transformed_df = None
+        self._cache = Feature_Cache(data_folder, 'email_campaign_data', ETL_Pipeline.version)
+        self._cache_key = None
 
         # Store encoding mappings
         self.customer_type_mappings = None
@@ -77,10 +85,18 @@ class ETL_Pipeline:
             The dataset (Pandas Dataframe) equivalent of the transformed file
 
         """
+        source_files = [self._data_folder + source_file for source_file in [sent_file, response_file, customer_file]]
         try:
-            transformed_df = pd.read_csv(self._data_folder + "email_campaign_data.csv")
-        except Exception:
-            print("Did not find the email_campaign_data.csv")
+            self._cache_key = self._cache.fingerprint(source_files)
+        except FileNotFoundError:
+            # Without the source files fall back to the preprocessed campaign data committed with the service
+            print("Did not find the source files so using the preprocessed email_campaign_data.csv")
+            return pd.read_csv(self._data_folder + "email_campaign_data.csv")
+
+        transformed_df = self._cache.read(self._cache_key)
+
+        if transformed_df is None:
+            print("Did not find an up to date email_campaign_data.feather")
             self.extract(sent_file, response_file, customer_file)
             self.transform()
             self.load()   
@@ -181,7 +197,7 @@ class ETL_Pipeline:
         if self.transformed_df is None:
             self.transform()
 
-        self.transformed_df.to_csv(self._data_folder + 'email_campaign_data.csv', index=False)  
+        self._cache.write(self.transformed_df, self._cache_key)
 
     @staticmethod
     def age_group(age): 
@@ -1,7 +1,6 @@
-from sklearn.model_selection import StratifiedKFold
-from sklearn.model_selection import train_test_split
 import pandas as pd
 import numpy as np
+from folds import Dataset_Folds
 
 class Email_Dataset:
     """
@@ -17,10 +16,8 @@ class Email_Dataset:
         an array holding the class label values
     _df : df
         the dataframe representing the email campaign dataset
-    _training_sets : dict
-        the dictionary holding training data sets by fold as key
-    _testing_sets : dict
-        the dictionary holding testing data sets by fold as key
+    _folds : Dataset_Folds
+        the row indices of the training, testing and validation data sets of every fold
 
     Methods
     -------
@@ -32,7 +29,7 @@ class Email_Dataset:
         Get Validation data for the specified fold 
     """
     
-    def __init__(self, transformed_df, class_label_col, n_folds=5):
+    def __init__(self, transformed_df, class_label_col, n_folds=5, cache_size=1, memmap_folder=None):
         """ Initializes the Fraud_Dataset Class
 
         Parameters
@@ -43,32 +40,23 @@ class Email_Dataset:
             The name of the column that holds the class label 
         n_folds : int
             The number of folds needed from the data
+        cache_size : int
+            The number of recently used data sets kept after being copied out, 0 turns caching off
+        memmap_folder : str
+            When provided the feature and class label values are memory mapped from files in this folder
 
         """
         self._df = transformed_df
-        self.X = self._df.loc[:,  self._df.columns != class_label_col].values
-        self.y = self._df[class_label_col].values.ravel()
+        X = self._df.loc[:, self._df.columns != class_label_col].values
+        y = self._df[class_label_col].values.ravel()
 
         # Store column array
         self.column_names = ['SubjectLine_ID','Gender','Type','Email_Domain','Age_Group','Tenure_Group','Sent_Day','Sent_Emails','Response_Received']
 
-        # Perform a K Fold 
-        skf = StratifiedKFold(n_splits=n_folds)
-
-        # Initialize the training and testing sets
-        self._training_sets = {}
-        self._testing_sets = {}
-
-        # Perform K Fold and build the dictionary
-        for i, (train_index, test_index) in enumerate(skf.split(self.X, self.y)):
-            #print(f"Fold {i}:")
-            #print(f"  Train: index={train_index}")
-            training_tuple = (self.X[train_index], self.y[train_index])
-            testing_tuple = (self.X[test_index], self.y[test_index])
-            self._training_sets[i] = training_tuple
-            self._testing_sets[i] = testing_tuple
-
-        #print(self._training_sets)
+        # Perform a K Fold keeping only the row indices of every fold
+        self._folds = Dataset_Folds(X, y, n_folds, cache_size, memmap_folder, 'email_campaign')
+        self.X = self._folds.X
+        self.y = self._folds.y
     
     def get_training_dataset(self, fold):
         """ Get the Training Dataset
@@ -79,7 +67,7 @@ class Email_Dataset:
             The fold for which training data is desired
 
         """
-        x_train, y_train = self._training_sets[fold]
+        x_train, y_train = self._folds.get_training_data(fold)
         y_train = y_train.reshape(len(y_train), 1) 
         result = np.concatenate((x_train, y_train), axis=1)
         training_df = pd.DataFrame(result, columns = self.column_names)
@@ -94,7 +82,7 @@ class Email_Dataset:
             The fold for which testing data is desired
 
         """
-        x_test, y_test = self._testing_sets[fold]
+        x_test, y_test = self._folds.get_testing_data(fold)
         y_test = y_test.reshape(len(y_test), 1) 
         result = np.concatenate((x_test, y_test), axis=1)
         testing_df = pd.DataFrame(result, columns = self.column_names)
@@ -109,10 +97,7 @@ class Email_Dataset:
             The fold for which validation data is desired
 
         """
-        x_train, y_train = self._training_sets[fold]
-        x_train, x_vals, y_train,y_val  = train_test_split(x_train, y_train , 
-                                                                           test_size = val_split, 
-                                                                           stratify=y_train, random_state=0)
+        x_vals, y_val = self._folds.get_validation_data(fold, val_split)
         y_val = y_val.reshape(len(y_val), 1) 
         result = np.concatenate((x_vals, y_val), axis=1)
         val_df = pd.DataFrame(result, columns = self.column_names)
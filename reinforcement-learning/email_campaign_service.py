@@ -1,5 +1,5 @@
 from flask import Flask
-from flask import request, jsonify
+from flask import request, jsonify, Response
 import sys
 import os
 import pandas as pd
@@ -9,9 +9,13 @@ from email_campaign_field import EmailCampaignField
 from data_pipeline import ETL_Pipeline 
 from dataset import Email_Dataset
 from model import Email_Campaign_Model
+from instrumentation import instrumentation
 
 app = Flask(__name__)
 
+# Time every request by endpoint when the instrumentation environment variable is set
+instrumentation.instrument_app(app)
+
 """
 A class used to provides an REST API to get the next action to perform
 
@@ -22,6 +26,9 @@ Methods
 -------
 get_next_action()
     Will determine if the supplied transaction is fraudulent or not. To execute you use POST http://localhost:8786/detect-fraud
+getMetrics()
+    Will provide the request latency per endpoint and the time spent parsing, looking up the Q Table and serializing as 
+    Prometheus metrics when the instrumentation environment variable is set. To execute you use GET http://localhost:8786/metrics
 
     Sample JSON as body below
 
@@ -53,18 +60,21 @@ def get_next_action():
     }
     """
     # Obtain request payload as a dictionary
-    request_details = request.json
+    with instrumentation.span('json_parse'):
+        request_details = request.json
 
     # Obtain state 
     state = tuple(request_details["state"])
     action = request_details["action"]
 
     # Create Email campaign data
-    email_campaign_data = EmailCampaignField(df,state, states)
-    email_campaign_data.make_action(action)
+    with instrumentation.span('feature_transform'):
+        email_campaign_data = EmailCampaignField(df,state, states)
+        email_campaign_data.make_action(action)
 
     # Exploit to get the next best action
-    next_state = q_table[email_campaign_data.get_state()]
+    with instrumentation.span('inference'):
+        next_state = q_table[email_campaign_data.get_state()]
 
     # Check if you want to avoid the same action again?
     #next_state[action] = -200.00
@@ -72,7 +82,8 @@ def get_next_action():
     next_action = np.argmax(next_state) 
     
     # Return the result as Json
-    return jsonify({"next_action": next_action.item()})
+    with instrumentation.span('serialization'):
+        return jsonify({"next_action": next_action.item()})
 
 @app.route('/campaign-audience', methods=['GET'])
 def get_campaign_audience():
@@ -92,23 +103,47 @@ def get_campaign_audience():
     state = (int(subject_id),0,0,0,0,0,0)
 
     # Create Email campaign data
-    campaign_audience = email_campaign_model.predict(state)
+    with instrumentation.span('inference'):
+        campaign_audience = email_campaign_model.predict(state)
 
     # Return the result as Json
-    return jsonify({"campaign-audience": campaign_audience})
+    with instrumentation.span('serialization'):
+        return jsonify({"campaign-audience": campaign_audience})
 
-if __name__ == "__main__":
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    """ Provides the timings of the service in the Prometheus text format
+        
+    Returns
+    ----------
+    Histograms of the request latency by endpoint (http_request_duration_seconds) and of the time spent in every step 
+    of the hot path (span_duration_seconds) along with the requests by endpoint and status (http_requests_total). 
+    The spans are json_parse, feature_transform (building the state), inference,
+    serialization and at startup etl and training. Status 404 when the instrumentation environment variable is not set. 
+    With several gunicorn workers every worker reports its own requests
+
+    """
+    if not instrumentation.enabled:
+        return jsonify({"error": "Instrumentation is disabled, set the instrumentation environment variable to true"}), 404
+
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+def initialize(args):
     """ Initializes the Email Campaign Service Class
 
+    Parameters
+    ----------
+    args : list
+        The command line arguments without the script name, the environment variables are used when there are none
     """
-    flaskPort = 8786
+    global df, states, q_table, email_campaign_model
 
     # Get command line arguments
-    if (len(sys.argv)>1):
-        data_folder                 = sys.argv[1]
-        sent_emails_file            = sys.argv[2]
-        responded_emails_file       = sys.argv[3]
-        customers_file              = sys.argv[4]
+    if (len(args)>0):
+        data_folder                 = args[0]
+        sent_emails_file            = args[1]
+        responded_emails_file       = args[2]
+        customers_file              = args[3]
     else: 
         data_folder                 = os.environ['data-folder']
         sent_emails_file            = os.environ['sent-emails-file']
@@ -118,10 +153,8 @@ if __name__ == "__main__":
     # Process the Data needed to train the model
     print(f'Start an ETL_Pipeline to load training data with shared folder = {data_folder} and sent emails file = {sent_emails_file}, resp emails file = {responded_emails_file}, customers file = {customers_file}')
     dp = ETL_Pipeline(data_folder)
-    df = dp.process(sent_emails_file,responded_emails_file,customers_file)
-
-    # Load the transformed data 
-    df = pd.read_csv(data_folder + 'email_campaign_data.csv')
+    with instrumentation.span('etl'):
+        df = dp.process(sent_emails_file,responded_emails_file,customers_file)
     print('Successfully obtained Campaign Data')
 
     # Initialize the model
@@ -130,7 +163,8 @@ if __name__ == "__main__":
     print('Successfully initialized Email_Campaign_Model')
 
     # Build the Q Table
-    q_table_df = email_campaign_model.train(iterations=20000, starting_state = starting_state, epsilon = 0.1, alpha = 0.1,gamma = 0.6)
+    with instrumentation.span('training'):
+        q_table_df = email_campaign_model.train(iterations=20000, starting_state = starting_state, epsilon = 0.1, alpha = 0.1,gamma = 0.6)
     print('Successfully obtained Q Table')
 
     # Save the Q Table
@@ -144,7 +178,12 @@ if __name__ == "__main__":
     # Load the Q Table
     q_table = q_table_df[["Day of Week","Tenure Group","Email Domain","Age Group","Gender","Type"]].values
 
+if __name__ == "__main__":
+    flaskPort = 8786
+
+    # Initialize the service from the command line arguments
+    initialize(sys.argv[1:])
+
     # Now that all the setup has been done start the service
     print('Starting Server...')
     app.run(host = '0.0.0.0', port = flaskPort)
-
@@ -0,0 +1,183 @@
+import numpy as np
+from collections import OrderedDict
+from sklearn.model_selection import StratifiedKFold
+from sklearn.model_selection import train_test_split
+
+class Dataset_Folds:
+    """
+    A class used to represent the K folds of a dataset without copying its rows
+
+    Only the row indices of every fold are kept (as int32 when the dataset is small enough). The rows of a fold
+    are gathered from the feature and label arrays when they are asked for, and the most recently used ones
+    are kept so that asking again does not copy them again. The arrays can be backed by memory mapped files
+    so that only the rows being gathered need to be in memory
+
+    ...
+
+    Attributes
+    ----------
+    X : ndarray
+        the array holding the feature values (a memory mapped array when a memmap folder is given)
+    y : ndarray
+        the array holding the class label values (a memory mapped array when a memmap folder is given)
+    n_folds : int
+        the number of folds
+    cache_size : int
+        the number of materialized data sets kept, 0 turns caching off
+    _fold_indices : dict
+        the dictionary holding the training and testing row indices by fold as key
+    _validation_indices : dict
+        the dictionary holding the validation row indices by fold and split as key
+    _cache : OrderedDict
+        the most recently used data sets by kind, fold and split as key
+
+    Methods
+    -------
+    get_fold_indices()
+        Get the row indices of the training and testing data for the specified fold
+    get_validation_indices()
+        Get the row indices of the validation data for the specified fold
+    get_training_data()
+        Get the features and labels of the training data for the specified fold
+    get_testing_data()
+        Get the features and labels of the testing data for the specified fold
+    get_validation_data()
+        Get the features and labels of the validation data for the specified fold
+    """
+
+    def __init__(self, X, y, n_folds=5, cache_size=1, memmap_folder=None, name='dataset'):
+        """ Initializes the Dataset Folds
+
+        Parameters
+        ----------
+        X : ndarray
+            The feature values
+        y : ndarray
+            The class label values
+        n_folds : int
+            The number of folds needed from the data
+        cache_size : int
+            The number of materialized data sets kept, 0 turns caching off
+        memmap_folder : str
+            When provided X and y are written to this folder and memory mapped from there
+        name : str
+            The name used for the memory mapped files
+
+        """
+        if memmap_folder is not None:
+            X = Dataset_Folds._memmap(X, memmap_folder + name + '_X.npy')
+            y = Dataset_Folds._memmap(y, memmap_folder + name + '_y.npy')
+
+        self.X = X
+        self.y = y
+        self.n_folds = n_folds
+        self.cache_size = cache_size
+
+        # Smallest index type that can address every row
+        index_dtype = np.int32 if len(y) <= np.iinfo(np.int32).max else np.int64
+
+        # Perform a K Fold and keep only the row indices
+        skf = StratifiedKFold(n_splits=n_folds)
+        self._fold_indices = {}
+        for i, (train_index, test_index) in enumerate(skf.split(np.zeros(len(y)), y)):
+            self._fold_indices[i] = (train_index.astype(index_dtype), test_index.astype(index_dtype))
+
+        self._validation_indices = {}
+        self._cache = OrderedDict()
+
+    def get_fold_indices(self, fold):
+        """ Get the row indices into X and y of the Training and Testing Datasets
+
+        Parameters
+        ----------
+        fold : int
+            The fold for which the indices are desired
+
+        """
+        return self._fold_indices[fold]
+
+    def get_validation_indices(self, fold, val_split=0.3):
+        """ Get the row indices into X and y of the Validation Dataset, which is split once from the training data
+
+        Parameters
+        ----------
+        fold : int
+            The fold for which the indices are desired
+        val_split : float
+            The share of the training data used for validation
+
+        """
+        key = (fold, val_split)
+        if key not in self._validation_indices:
+            # Splitting the indices gives the same rows as splitting the training data itself
+            train_index = self._fold_indices[fold][0]
+            _, val_index = train_test_split(train_index, test_size=val_split,
+                                            stratify=self.y[train_index], random_state=0)
+            self._validation_indices[key] = val_index
+
+        return self._validation_indices[key]
+
+    def get_training_data(self, fold):
+        """ Get the features and labels of the Training Dataset
+
+        Parameters
+        ----------
+        fold : int
+            The fold for which training data is desired
+
+        """
+        return self._take(('training', fold), self._fold_indices[fold][0])
+
+    def get_testing_data(self, fold):
+        """ Get the features and labels of the Testing Dataset
+
+        Parameters
+        ----------
+        fold : int
+            The fold for which testing data is desired
+
+        """
+        return self._take(('testing', fold), self._fold_indices[fold][1])
+
+    def get_validation_data(self, fold, val_split=0.3):
+        """ Get the features and labels of the Validation Dataset
+
+        Parameters
+        ----------
+        fold : int
+            The fold for which validation data is desired
+        val_split : float
+            The share of the training data used for validation
+
+        """
+        return self._take(('validation', fold, val_split), self.get_validation_indices(fold, val_split))
+
+    def _take(self, key, index):
+        """ Gathers the rows of a data set, reusing them when they were gathered recently
+
+        Cached data sets are shared between callers so they must not be modified in place
+        """
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        data = (np.take(self.X, index, axis=0), np.take(self.y, index, axis=0))
+
+        if self.cache_size > 0:
+            self._cache[key] = data
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return data
+
+    @staticmethod
+    def _memmap(array, file):
+        """ Writes the array to a .npy file and returns it memory mapped read only
+
+        Arrays of python objects (such as text) cannot be memory mapped and are returned as they are
+        """
+        if array.dtype.hasobject:
+            return array
+
+        np.save(file, np.ascontiguousarray(array))
+        return np.load(file, mmap_mode='r')
@@ -0,0 +1,16 @@
+import email_campaign_service
+
+"""
+Entry point for serving the Email Campaign Service with gunicorn (see gunicorn.conf.py)
+
+    python -m gunicorn -c gunicorn.conf.py wsgi:app
+
+The service is initialized from the environment variables (data-folder, sent-emails-file, responded-emails-file, 
+customers-file) when gunicorn loads this module in the master process, so the workers forked afterwards share the
+Q Table
+"""
+
+# Build the Q Table once for all workers
+email_campaign_service.initialize([])
+
+app = email_campaign_service.app
@@ -1,5 +1,4 @@
-from sklearn.model_selection import StratifiedKFold
-from sklearn.model_selection import train_test_split
+from folds import Dataset_Folds
 
 class Sentiment_Analysis_Dataset:
     """
@@ -15,10 +14,8 @@ class Sentiment_Analysis_Dataset:
         an array holding the class label values
     _df : df
         the dataframe representing the fraud dataset
-    _training_sets : dict
-        the dictionary holding training data sets by fold as key
-    _testing_sets : dict
-        the dictionary holding testing data sets by fold as key
+    _folds : Dataset_Folds
+        the row indices of the training, testing and validation data sets of every fold
 
     Methods
     -------
@@ -30,7 +27,7 @@ class Sentiment_Analysis_Dataset:
         Get Validation data for the specified fold 
     """
     
-    def __init__(self, transformed_df, class_label_col, n_folds=5):
+    def __init__(self, transformed_df, class_label_col, n_folds=5, cache_size=1, memmap_folder=None):
         """ Initializes the Sentiment_Analysis_Dataset Class
 
         Parameters
@@ -41,29 +38,20 @@ class Sentiment_Analysis_Dataset:
             The name of the column that holds the class label 
         n_folds : int
             The number of folds needed from the data
+        cache_size : int
+            The number of recently used data sets kept after being copied out, 0 turns caching off
+        memmap_folder : str
+            When provided the feature and class label values are memory mapped from files in this folder
 
         """
         self._df = transformed_df
-        self.X = self._df.loc[:, self._df.columns != class_label_col].values
-        self.y = self._df[class_label_col].values.ravel()
+        X = self._df.loc[:, self._df.columns != class_label_col].values
+        y = self._df[class_label_col].values.ravel()
 
-        # Perform a K Fold 
-        skf = StratifiedKFold(n_splits=n_folds)
-
-        # Initialize the training and testing sets
-        self._training_sets = {}
-        self._testing_sets = {}
-
-        # Perform K Fold and build the dictionary
-        for i, (train_index, test_index) in enumerate(skf.split(self.X, self.y)):
-            #print(f"Fold {i}:")
-            #print(f"  Train: index={train_index}")
-            training_tuple = (self.X[train_index], self.y[train_index])
-            testing_tuple = (self.X[test_index], self.y[test_index])
-            self._training_sets[i] = training_tuple
-            self._testing_sets[i] = testing_tuple
-
-        #print(self._training_sets)
+        # Perform a K Fold keeping only the row indices of every fold
+        self._folds = Dataset_Folds(X, y, n_folds, cache_size, memmap_folder, 'reviews')
+        self.X = self._folds.X
+        self.y = self._folds.y
     
     def get_training_dataset(self, fold):
         """ Get the Training Dataset
@@ -74,7 +62,7 @@ class Sentiment_Analysis_Dataset:
             The fold for which training data is desired
 
         """
-        return self._training_sets[fold]
+        return self._folds.get_training_data(fold)
 
     def get_testing_dataset(self, fold):
         """ Get the Testing Dataset
@@ -85,7 +73,7 @@ class Sentiment_Analysis_Dataset:
             The fold for which testing data is desired
 
         """
-        return self._testing_sets[fold]
+        return self._folds.get_testing_data(fold)
     
     def get_validation_dataset(self, fold, val_split=0.3):
         """ Get the Validation Dataset
@@ -96,10 +84,6 @@ class Sentiment_Analysis_Dataset:
             The fold for which validation data is desired
 
         """
-        x_train, y_train = self._training_sets[fold]
-        x_train, x_vals, y_train,y_val  = train_test_split(x_train, y_train , 
-                                                                           test_size = val_split, 
-                                                                           stratify=y_train, random_state=0)
-        return x_vals, y_val
+        return self._folds.get_validation_data(fold, val_split)
        
     
\ No newline at end of file
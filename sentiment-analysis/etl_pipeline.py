@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import json
+from cache import Feature_Cache
 
 class ETL_Pipeline:
     """
@@ -18,13 +19,17 @@ class ETL_Pipeline:
         the dataframe representing the source data
     transformed_df : df
         the dataframe representing the transformed data
+    _cache : Feature_Cache
+        the cache holding the transformed data in a columnar format, keyed by the source file fingerprint
+    version : str
+        the version of the transformations. Bump it whenever they change so that cached transformed data is rebuilt
 
     Methods
     -------
     process()
         Key method that extracts, transforms and loads the source. Optimizes by ensuring that if transformed
-        data is present then it simply reads it back instead of reading source, applying transforms and writing
-        transformed file
+        data is present for the same source, pipeline version and parameters then it simply reads it back instead 
+        of reading source, applying transforms and writing transformed file
     extract()
         Reads the source file given the directory and file name. Expects the file to be a CSV
     transform()
@@ -34,6 +39,7 @@ class ETL_Pipeline:
     load()
         Saves the final transformed file
     """
+    version = '1'
     
     def __init__(self, data_folder):
         """ Initializes the Data Pipeline Class
@@ -49,6 +55,8 @@ class ETL_Pipeline:
         self._data_folder = data_folder
         self.source_df = None
         self.transformed_df = None
+        self._cache = Feature_Cache(data_folder, 'transformed_reviews', ETL_Pipeline.version)
+        self._cache_key = None
     
     def process(self, source_file):
         """ Executes the Pipeline to return transformed dataset 
@@ -59,10 +67,11 @@ class ETL_Pipeline:
             The dataset (Pandas Dataframe) equivalent of the transformed file
 
         """
-        try:
-            transformed_df = pd.read_csv(self._data_folder + "transformed_reviews.csv")
-        except Exception:
-            print("Did not find the transformed_reviews.csv")
+        self._cache_key = self._cache.fingerprint([self._data_folder + source_file])
+        transformed_df = self._cache.read(self._cache_key)
+
+        if transformed_df is None:
+            print("Did not find an up to date transformed_reviews.feather")
             source_df = self.extract(source_file)
             transformed_df = self.transform(source_df)
             self.load()   
@@ -168,6 +177,6 @@ class ETL_Pipeline:
         if self.transformed_df is None:
             self.transform()
 
-        self.transformed_df.to_csv(self._data_folder + 'transformed_reviews.csv', index=False)  
+        self._cache.write(self.transformed_df, self._cache_key)
 
  
\ No newline at end of file
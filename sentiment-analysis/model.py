@@ -3,6 +3,7 @@ from transformers import pipeline
 from data_pipeline import Text_Pipeline 
 import pandas as pd
 from metrics import Metrics
+from instrumentation import instrumentation
 
 class Sentiment_Analysis_Model:
     """
@@ -14,6 +15,8 @@ class Sentiment_Analysis_Model:
     ----------
     cls : 
         Classifier used for making prediction on the sentiment 
+    version : int
+        The number of times the classifier was trained, starting at 1 for the pretrained model
 
     Methods
     -------
@@ -54,6 +57,9 @@ class Sentiment_Analysis_Model:
         
         # Create mapped sentiments
         self.mapped_sentiments = {'positive':2, 'neutral':1, 'negative':0}
+
+        # Changes whenever the classifier changes so that cached metrics can be refreshed
+        self.version = 1
     
     def train(self, X_train,y_train):
         """ Train the Model 
@@ -66,6 +72,7 @@ class Sentiment_Analysis_Model:
             Data used for training the model specifically the class labels
         """
         self.cls.fit(X_train, y_train)
+        self.version += 1
 
     def test(self, X_test, y_test):
         """ Test the Model 
@@ -143,13 +150,15 @@ class Sentiment_Analysis_Model:
         s = pd.Series(text_array) 
 
         # Obtain pre processed series
-        preprocessed_series = self.text_pipeline.preprocess(s)
+        with instrumentation.span('feature_transform'):
+            preprocessed_series = self.text_pipeline.preprocess(s)
 
         # Get reviews
         preprocessed_text = preprocessed_series.values.tolist()
 
         # Analyze sentiment for each text
-        sentiments = [self.analyze_sentiment(text[:2000]) for text in text_array]
+        with instrumentation.span('inference'):
+            sentiments = [self.analyze_sentiment(text[:2000]) for text in text_array]
         
         # Return mapped class values
         return [self.mapped_sentiments[s] for s in sentiments]
@@ -1,5 +1,5 @@
 from flask import Flask
-from flask import request, jsonify
+from flask import request, jsonify, Response
 import sys
 import os
 
@@ -9,10 +9,15 @@ from etl_pipeline import ETL_Pipeline
 from dataset import Sentiment_Analysis_Dataset
 from model import Sentiment_Analysis_Model
 from metrics import Metrics
+from metrics_cache import Metrics_Cache
+from instrumentation import instrumentation
 import nltk
 
 app = Flask(__name__)
 
+# Time every request by endpoint when the instrumentation environment variable is set
+instrumentation.instrument_app(app)
+
 """
 A class used to provides an REST API to get the sentiment for a text
 
@@ -22,9 +27,13 @@ As a part of service initialization we will read the training data, clean it, sc
 Methods
 -------
 getStats()
-    Will run the testing data through the model to return the metrics. To execute you use GET http://localhost:8786/stats
+    Will return the metrics of the model on the testing data, computed in the background whenever the model changes. 
+    To execute you use GET http://localhost:8786/stats
 get_sentiment()
     Will determine sentiment associated with the review. To execute you use POST http://localhost:8786/get-sentiment
+getMetrics()
+    Will provide the request latency per endpoint and the time spent parsing, preprocessing, analyzing and serializing 
+    as Prometheus metrics when the instrumentation environment variable is set. To execute you use GET http://localhost:8786/metrics
 
     Sample JSON as body below
 
@@ -52,6 +61,11 @@ def getStats():
         A good measure of how many times we got sentiment right
     F1 Score : float
         Harmonic Mean of Precision and Recall. A good metric for this model
+    status : dict
+        The freshness of the metrics. state is fresh when they are for the current model version, stale while 
+        the metrics of a newer version are computed and pending before the first ones are ready (testing the 
+        whole testing data through the model can take minutes). When testing fails error holds the error and 
+        failed_version the model version, which is not tested again until the model changes
 
     Sample JSON Below
 
@@ -60,9 +74,41 @@ def getStats():
         "Balanced Accuracy": 0.8121015145716799,
         "F1 Score": 0.7295171245310419,
         "Precision": 0.8766724840023269,
-        "Recall": 0.6246632124352332
+        "Recall": 0.6246632124352332,
+        "status": {
+            "compute_seconds": 412.5,
+            "computed_at": "2024-01-02T10:15:00",
+            "computing": false,
+            "error": null,
+            "failed_version": null,
+            "metrics_version": 1,
+            "model_version": 1,
+            "state": "fresh"
+        }
     }
 
+    """
+    # Return the cached metrics, which are refreshed in the background when the model changed
+    statistics, status = metrics_cache.get()
+    response = dict(statistics) if statistics is not None else {}
+    response['status'] = status
+
+    return jsonify(response)
+
+def get_statistics(X_test, y_test):
+    """ Runs the testing data through the model to compute its metrics
+
+    Parameters
+    ----------
+    X_test : ndarray
+        Data used for testing the model specifically the text
+    y_test : ndarray
+        Data used for testing the model specifically the class labels
+
+    Returns
+    ----------
+    statistics : dict
+        The metrics by the names returned from /stats
     """
     # Obtain the metrics 
     acc, acc_bal, prec, recall, f1, mrr = sentiment_model.test(X_test, y_test)
@@ -76,8 +122,7 @@ def getStats():
     statistics['F1 Score'] = f1
     statistics['Mean Reciprocal Rank'] = mrr
 
-    # Return the statistics encoded as Json
-    return jsonify(statistics)
+    return statistics
 
 @app.route('/get-sentiment', methods=['POST'])
 def get_sentiment():
@@ -99,15 +144,35 @@ def get_sentiment():
 
     """
     # Obtain request payload as a dictionary
-    review_details = request.json
+    with instrumentation.span('json_parse'):
+        review_details = request.json
 
     # Pass dictionary data to model's prediction to detect if fraud or not
     text_reviews = sentiment_model.predict(review_details["reviews"])
 
     # Return the result as Json
-    return jsonify(text_reviews)
+    with instrumentation.span('serialization'):
+        return jsonify(text_reviews)
 
-if __name__ == "__main__":
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    """ Provides the timings of the service in the Prometheus text format
+        
+    Returns
+    ----------
+    Histograms of the request latency by endpoint (http_request_duration_seconds) and of the time spent in every step 
+    of the hot path (span_duration_seconds) along with the requests by endpoint and status (http_requests_total). 
+    The spans are json_parse, feature_transform, inference, serialization and at startup
+    model_load and etl. Status 404 when the instrumentation environment variable is not set. 
+    With several gunicorn workers every worker reports its own requests
+
+    """
+    if not instrumentation.enabled:
+        return jsonify({"error": "Instrumentation is disabled, set the instrumentation environment variable to true"}), 404
+
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+def initialize(args, preload=False):
     """ Initializes the Sentiment Analysis Service Class
 
     It does the following as a part of initialization
@@ -115,21 +180,30 @@ if __name__ == "__main__":
     1. Initialize the Text_Pipeline and use it to process the training data to get the features we need
     2. Initialize Sentiment_Analysis_Dataset to get the training data split
     3. Initialize the Metrics class used to generate and provide latest statistics
-    4. Initialize the Sentiment_Analysis_Model to train the classifier on the training data  
+    4. Initialize the Sentiment_Analysis_Model to train the classifier on the training data
+
+    Parameters
+    ----------
+    args : list
+        The command line arguments without the script name, the environment variables are used when there are none
+    preload : bool
+        True when the service is loaded in the gunicorn master before the workers are forked. The model is then 
+        tested by every worker on its first /stats request instead of holding up the start
     """
-    flaskPort = 8786
+    global sentiment_model, metrics_cache
 
     # Get command line arguments
-    if (len(sys.argv)>1):
-        data_folder           = sys.argv[1]
-        training_data_file    = sys.argv[2]
+    if (len(args)>0):
+        data_folder           = args[0]
+        training_data_file    = args[1]
     else: 
         data_folder = os.environ['data-folder']
         training_data_file = os.environ['training-data-file']
     
     print('Initializing model')
     model_id = "cardiffnlp/twitter-roberta-base-sentiment-latest"
-    sentiment_pipe = pipeline("sentiment-analysis", model=model_id)
+    with instrumentation.span('model_load'):
+        sentiment_pipe = pipeline("sentiment-analysis", model=model_id)
     print('Successfully initialized sentiment pre-trained model')
 
     # Download the various nltk modules
@@ -142,7 +216,8 @@ if __name__ == "__main__":
     # Process the Data needed to train the model
     print(f'Start an ETL_Pipeline to load training data with shared folder = {data_folder} and training data file = {training_data_file}')
     dp = ETL_Pipeline(data_folder)
-    df = dp.process(training_data_file)
+    with instrumentation.span('etl'):
+        df = dp.process(training_data_file)
 
     # Initialize the metrics
     print('Successfully processed and created feature data and initialized metrics')
@@ -165,7 +240,17 @@ if __name__ == "__main__":
     #model.train(X_train, y_train, X_val, y_val)
     #print('Successfully trained Sentiment Analysis Model')
 
+    # Test the model in the background, /stats returns the metrics from then on
+    metrics_cache = Metrics_Cache(lambda: get_statistics(X_test, y_test), lambda: sentiment_model.version)
+    if not preload:
+        metrics_cache.refresh()
+
+if __name__ == "__main__":
+    flaskPort = 8786
+
+    # Initialize the service from the command line arguments
+    initialize(sys.argv[1:])
+
     # Now that all the setup has been done start the service
     print('Starting Server...')
     app.run(host = '0.0.0.0', port = flaskPort)
-
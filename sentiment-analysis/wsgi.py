@@ -0,0 +1,17 @@
+import sentiment_analysis_service
+
+"""
+Entry point for serving the Sentiment Analysis Service with gunicorn (see gunicorn.conf.py)
+
+    python -m gunicorn -c gunicorn.conf.py wsgi:app
+
+The service is initialized from the environment variables (data-folder, training-data-file) when gunicorn loads 
+this module in the master process, so the workers forked afterwards share the pre-trained model. Testing the model 
+takes minutes so it is not done before forking, every worker tests it in the background on its first /stats 
+request and answers with the status pending until then
+"""
+
+# Load the model once for all workers
+sentiment_analysis_service.initialize([], preload=True)
+
+app = sentiment_analysis_service.app